@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,6 +91,29 @@ DATABASES = {
     }
 }
 
+# User data shards (see core.sharding): databases on the default server,
+# named by DB_SHARDS, join `default` as shard_1, shard_2, ... Users are
+# placed on the shards of SHARD_RING, so a new shard can be created
+# before any user is placed on it. Never reorder or remove a shard:
+# each owns an id range by its position.
+SHARDS = ['default']
+for _index, _name in enumerate(
+    filter(None, os.environ.get('DB_SHARDS', '').split(',')), start=1,
+):
+    SHARDS.append(f'shard_{_index}')
+    DATABASES[SHARDS[-1]] = {**DATABASES['default'], 'NAME': _name.strip()}
+
+SHARD_RING = [
+    alias.strip()
+    for alias in os.environ.get('SHARD_RING', ','.join(SHARDS)).split(',')
+    if alias.strip()
+]
+SHARD_RING_VNODES = 64
+# Seconds a client waits to retry a write while its data moves.
+SHARD_MOVE_RETRY_AFTER = 5
+
+DATABASE_ROUTERS = ['core.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -127,7 +151,25 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
-STATIC_URL = '/static/'
+# Static files and uploaded media share the /static/ prefix, mapped to
+# /vol/web, so the reverse proxy serves both with one location. Django
+# only serves media itself in DEBUG; media is stored under unique names,
+# so the proxy can cache it forever.
+STATIC_URL = '/static/static/'
+MEDIA_URL = '/static/media/'
+
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', '/vol/web/media')
+STATIC_ROOT = os.environ.get('STATIC_ROOT', '/vol/web/static')
+
+# The OpenAPI schema is prebuilt into this directory by `build_schema`.
+# Schema URLs that carry the current ETag as `v` are cached for this long.
+SCHEMA_ROOT = os.environ.get('SCHEMA_ROOT', '/vol/web/schema')
+SCHEMA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Thumbnails are resized in a process pool, off the request thread.
+# Set the worker count to 0 to resize inline after the upload commits.
+RECIPE_THUMBNAIL_SIZES = (128, 512)
+RECIPE_THUMBNAIL_WORKERS = int(os.environ.get('RECIPE_THUMBNAIL_WORKERS', 2))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -138,4 +180,100 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.AnonTokenBucketThrottle',
+        'core.throttling.UserTokenBucketThrottle',
+        'core.throttling.ScopedTokenBucketThrottle',
+    ],
+    # Token bucket rates: the number is both the burst and the refill per
+    # period. Scoped rates apply to views with a matching throttle_scope.
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '300/min',
+        'user': '3000/min',
+        'user:token': '30/min',
+        'user:create': '20/min',
+    },
 }
+
+# Where throttle buckets live. Production sets the shared memory backend
+# so all workers on a host share them; empty disables throttling.
+THROTTLE_BACKEND = os.environ.get(
+    'THROTTLE_BACKEND', 'core.throttling.LocalMemoryBackend',
+)
+THROTTLE_LOCAL_MAX_KEYS = 100000
+THROTTLE_SHARED_MEMORY_NAME = os.environ.get(
+    'THROTTLE_SHARED_MEMORY_NAME', 'recipe-app-throttle',
+)
+THROTTLE_SHARED_MEMORY_SLOTS = 65536
+
+# Response compression (core.middleware): bodies below the size threshold
+# are sent as is. Levels trade CPU for bytes (see benchmark_compression);
+# None, set as an empty or "none" variable, disables a coding.
+def _compression_level(name, default):
+    value = os.environ.get(name, str(default)).strip()
+    return None if value.lower() in ('', 'none') else int(value)
+
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = _compression_level('COMPRESSION_GZIP_LEVEL', 6)
+COMPRESSION_BROTLI_QUALITY = _compression_level(
+    'COMPRESSION_BROTLI_QUALITY', 4,
+)
+
+# Number of most used tags returned by /api/recipe/stats/.
+RECIPE_STATS_TOP_TAGS = 5
+
+# Ranked recipe lists (similar/ and cook-with/): default and largest page
+# size, and how many users' indexes each process keeps in memory.
+RECIPE_SIMILAR_DEFAULT_LIMIT = 10
+RECIPE_SIMILAR_MAX_LIMIT = 100
+RECIPE_SIMILARITY_CACHED_USERS = int(
+    os.environ.get('RECIPE_SIMILARITY_CACHED_USERS', 64),
+)
+# /api/recipe/recipes/cook-with/ ranks users with fewer recipes than this
+# in SQL instead of building their index, and caps the pantry size.
+RECIPE_INDEX_MIN_RECIPES = int(
+    os.environ.get('RECIPE_INDEX_MIN_RECIPES', 1000),
+)
+RECIPE_PANTRY_MAX_INGREDIENTS = 200
+
+# Most recipe ids a tag can be assigned to or removed from in one request;
+# larger selections are made with a filter.
+RECIPE_ASSIGN_MAX_RECIPES = 10000
+
+# Tag and ingredient name suggestions: default and largest count, and the
+# shortest prefix, since shorter ones match nearly every name.
+RECIPE_AUTOCOMPLETE_DEFAULT_LIMIT = 10
+RECIPE_AUTOCOMPLETE_MAX_LIMIT = 50
+RECIPE_AUTOCOMPLETE_MIN_PREFIX = 2
+
+# Delta sync (see core.sync): default and largest page size, in rows. A
+# cursor expires before the tombstones written after it are pruned.
+SYNC_BATCH_SIZE = 500
+SYNC_MAX_BATCH_SIZE = 1000
+SYNC_TOMBSTONE_RETENTION = 60 * 60 * 24 * 30
+SYNC_CURSOR_MAX_AGE = 60 * 60 * 24 * 29
+
+# Change event stream (see core.events), served by app.asgi: connection
+# limits per process and per user, seconds between heartbeats, seconds
+# clients wait before reconnecting, events kept for resuming, and events a
+# slow stream may fall behind before it is told to sync instead.
+EVENTS_PATH = '/api/recipe/events/'
+EVENTS_MAX_CONNECTIONS = int(os.environ.get('EVENTS_MAX_CONNECTIONS', 10000))
+EVENTS_MAX_USER_CONNECTIONS = 10
+EVENTS_HEARTBEAT = 15
+EVENTS_RETRY_DELAY = 3
+EVENTS_BUFFER_SIZE = 10000
+EVENTS_MAX_PENDING = 100
+
+# Background jobs (see core.jobs): retry backoff in seconds, how long a
+# running job may stay locked before it is assumed to be abandoned, and
+# how often workers refresh the lock of the jobs they run.
+JOB_RETRY_BASE_DELAY = 5
+JOB_RETRY_MAX_DELAY = 60 * 60
+JOB_STALE_TIMEOUT = 60 * 10
+JOB_HEARTBEAT_INTERVAL = 60
+
+# Seconds the status URL handed out by an account deletion stays valid
+# (see user.views).
+USER_DELETION_STATUS_MAX_AGE = 60 * 60 * 24 * 7
@@ -13,21 +13,19 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-)
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path
+
+from app import urls_api
+from core.schema_views import SchemaDocsView, serve_schema
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
+    path('api/schema/', serve_schema, name='api-schema'),
     path(
         'api/docs',
-        SpectacularSwaggerView.as_view(url_name='api-schema'),
+        SchemaDocsView.as_view(url_name='api-schema'),
         name='api-docs',
     ),
-    path('api/user/', include('user.urls')),
-    path('api/recipe/', include('recipe.urls')),
+    *urls_api.urlpatterns,
 ]
@@ -0,0 +1,15 @@
+"""API-only URL configuration, used by the app.settings_api profile.
+
+It routes the JSON API, and uploaded media in DEBUG only; ``app.urls``
+adds the admin, schema and docs on top of it.
+"""
+from django.conf import settings
+from django.conf.urls.static import static
+from django.urls import path, include
+
+urlpatterns = [
+    path('api/user/', include('user.urls')),
+    path('api/recipe/', include('recipe.urls')),
+    path('api/jobs/', include('core.urls')),
+    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
+]
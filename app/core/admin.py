@@ -1,10 +1,24 @@
 """Django Admin Customization"""
 
+from urllib.parse import urlencode
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import QueryDict
+from django.template.response import SimpleTemplateResponse, TemplateResponse
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from core import models
+from rest_framework.authtoken.models import Token
+
+from core import bulk, jobs, models, sharding
 
 
 class UserAdmin(BaseUserAdmin):
@@ -41,8 +55,362 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def get_deleted_objects(self, objs, request):
+        """List only the users: their data, which may be on another shard,
+        is purged in the background."""
+        opts = self.model._meta
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(opts.verbose_name)
+        users = [str(obj) for obj in objs]
+        return users, {opts.verbose_name_plural: len(users)}, perms_needed, []
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, [obj])
+
+    def delete_queryset(self, request, queryset):
+        """Deactivate the users now and purge them with their data in the
+        background, like the API does (see ``user.jobs.purge_user``)."""
+        with transaction.atomic():
+            for user in queryset:
+                user.is_active = False
+                user.save(update_fields=['is_active'])
+                Token.objects.filter(user=user).delete()
+                jobs.enqueue('user.purge_user', {'user_id': user.pk},
+                             user=user)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes large counts from the planner statistics.
+
+    ``COUNT(*)`` reads the whole table. An unfiltered changelist uses the
+    table's ``pg_class.reltuples`` instead, and a filtered one the row
+    estimate of the query plan. Estimates below `exact_threshold` are
+    replaced by an exact count, which is cheap at that size.
+    """
+    exact_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                estimate = row[0] if row else -1
+            else:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+        if estimate < self.exact_threshold:
+            return super().count
+        return estimate
+
+
+class TagNameForm(forms.Form):
+    name = forms.CharField(label=_('Tag name'), max_length=255)
+
+
+class PriceAdjustmentForm(forms.Form):
+    percent = forms.DecimalField(
+        label=_('Change prices by (%)'),
+        max_digits=6,
+        decimal_places=2,
+        min_value=-100,
+        max_value=1000,
+    )
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Choose the shard whose rows the changelist shows."""
+    title = _('shard')
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.SHARDS]
+
+    def choices(self, changelist):
+        selected = self.value() or DEFAULT_DB_ALIAS
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == selected,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: alias},
+                ),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # The changelist already runs on the chosen shard.
+        return queryset
+
+
+class ShardAutocompleteSelect(AutocompleteSelect):
+    """Autocomplete from the shard the widget is rendered on."""
+
+    def get_url(self):
+        return f'{super().get_url()}?{urlencode({"shard": self.db})}'
+
+
+class OwnedObjectForm(forms.ModelForm):
+    """Check the owner's data lives on the shard the object is saved to.
+    """
+
+    def clean_user(self):
+        user = self.cleaned_data['user']
+        shard = sharding.shard_for(user)
+        if shard != sharding.current():
+            raise ValidationError(
+                _('The data of this user is on the %(shard)s shard.'),
+                code='wrong_shard',
+                params={'shard': shard},
+            )
+        return user
+
+
+class OwnedObjectAdmin(admin.ModelAdmin):
+    """Base admin for the large per-user tables.
+
+    Every view runs on one shard (see ``core.sharding``): the changelist,
+    and the add page linked from it, on the shard chosen with its shard
+    filter, the pages of an object on the shard holding it.
+    """
+    form = OwnedObjectForm
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('user',)
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if len(settings.SHARDS) > 1:
+            list_filter = [ShardListFilter, *list_filter]
+        return list_filter
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).prefetch_related('user')
+        if 'shard' in request.GET:
+            # Named by ShardAutocompleteSelect; the autocomplete view is
+            # not run on a shard.
+            queryset = queryset.using(self.request_shard(request))
+        return queryset
+
+    def request_shard(self, request):
+        """Return the shard chosen on the changelist, which its links
+        keep in the preserved filters."""
+        preserved = QueryDict(request.GET.get('_changelist_filters', ''))
+        shard = request.GET.get('shard', preserved.get('shard'))
+        return shard if shard in settings.SHARDS else DEFAULT_DB_ALIAS
+
+    def object_shard(self, object_id):
+        """Return the shard holding the object; ids are unique across
+        shards."""
+        manager = self.model._default_manager
+        for alias in settings.SHARDS:
+            try:
+                if manager.using(alias).filter(pk=object_id).exists():
+                    return alias
+            except (ValidationError, ValueError):
+                break
+        return DEFAULT_DB_ALIAS
+
+    def on_shard(self, alias, view, *args, **kwargs):
+        """Run an admin view on `alias`.
+
+        Template responses are rendered inside, since their templates
+        evaluate the querysets.
+        """
+        with sharding.use_shard(alias):
+            response = view(*args, **kwargs)
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+        return response
+
+    def changelist_view(self, request, extra_context=None):
+        return self.on_shard(
+            self.request_shard(request), super().changelist_view,
+            request, extra_context,
+        )
+
+    def changeform_view(self, request, object_id=None, form_url='',
+                        extra_context=None):
+        if object_id is None:
+            alias = self.request_shard(request)
+        else:
+            alias = self.object_shard(object_id)
+        return self.on_shard(
+            alias, super().changeform_view,
+            request, object_id, form_url, extra_context,
+        )
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self.on_shard(
+            self.object_shard(object_id), super().delete_view,
+            request, object_id, extra_context,
+        )
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self.on_shard(
+            self.object_shard(object_id), super().history_view,
+            request, object_id, extra_context,
+        )
+
+    # Users live on the default database only, so they are prefetched
+    # rather than joined, and cannot order the list.
+    @admin.display(description=_('User'))
+    def user_email(self, obj):
+        return obj.user.email
+
+    def get_actions(self, request):
+        """Drop the default delete action, which deletes row by row."""
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def confirm_bulk_action(self, request, queryset, apply, message,
+                            form_class=forms.Form):
+        """Confirm an action, then `apply` it to the whole selection.
+
+        `apply` is a ``core.bulk`` function called with the selection and
+        the cleaned form data; it returns the number of rows changed.
+        """
+        confirmed = 'apply' in request.POST
+        form = form_class(request.POST if confirmed else None)
+        if confirmed and form.is_valid():
+            count = apply(bulk.selection(queryset), **form.cleaned_data)
+            self.message_user(request, message % {'count': count})
+            return None
+
+        opts = self.model._meta
+        context = {
+            **self.admin_site.each_context(request),
+            'title': _('Are you sure?'),
+            'opts': opts,
+            'form': form,
+            'count': self.get_paginator(request, queryset, 1).count,
+            'action': request.POST['action'],
+            'action_name': self.get_actions(request)[
+                request.POST['action']][2],
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(
+            request, 'admin/core/bulk_action_confirmation.html', context,
+        )
+
+
+class ShardInline(admin.TabularInline):
+    """Inline whose autocompletes search the shard of the page."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.autocomplete_fields:
+            kwargs['widget'] = ShardAutocompleteSelect(
+                db_field, self.admin_site, using=sharding.current(),
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class RecipeTagInline(ShardInline):
+    """Define the tags of a recipe on its admin page."""
+    model = models.RecipeTag
+    fields = ['tag']
+    autocomplete_fields = ['tag']
+    extra = 1
+
+
+class RecipeIngredientInline(ShardInline):
+    """Define the ingredients of a recipe on its admin page."""
+    model = models.RecipeIngredient
+    fields = ['ingredient']
+    autocomplete_fields = ['ingredient']
+    extra = 1
+
+
+@admin.register(models.Recipe)
+class RecipeAdmin(OwnedObjectAdmin):
+    """Define the admin pages for recipes."""
+    list_display = ['title', 'user_email', 'price', 'time_minutes']
+    search_fields = ['^title']
+    inlines = [RecipeTagInline, RecipeIngredientInline]
+    readonly_fields = ['thumbnails', 'version']
+    actions = ['add_tag', 'remove_tag', 'adjust_price', 'delete_recipes']
+
+    def save_formset(self, request, form, formset, change):
+        """Write the links through the recipe's many-to-many manager,
+        whose signals keep the statistics and delta sync up to date."""
+        # Lists the changes for the admin log without writing them.
+        formset.save(commit=False)
+        linked = formset.model.linked_field
+        field = next(
+            field for field in models.Recipe._meta.many_to_many
+            if field.remote_field.through is formset.model
+        )
+        getattr(form.instance, field.name).set([
+            link_form.cleaned_data[linked] for link_form in formset.forms
+            if link_form.cleaned_data.get(linked)
+            and not link_form.cleaned_data.get('DELETE')
+        ])
+
+    @admin.action(description=_('Add a tag to selected recipes'),
+                  permissions=['change'])
+    def add_tag(self, request, queryset):
+        return self.confirm_bulk_action(
+            request, queryset, bulk.add_tag,
+            _('Tagged %(count)d recipes.'), TagNameForm,
+        )
+
+    @admin.action(description=_('Remove a tag from selected recipes'),
+                  permissions=['change'])
+    def remove_tag(self, request, queryset):
+        return self.confirm_bulk_action(
+            request, queryset, bulk.remove_tag,
+            _('Untagged %(count)d recipes.'), TagNameForm,
+        )
+
+    @admin.action(description=_('Adjust price of selected recipes'),
+                  permissions=['change'])
+    def adjust_price(self, request, queryset):
+        return self.confirm_bulk_action(
+            request, queryset, bulk.adjust_price,
+            _('Repriced %(count)d recipes.'), PriceAdjustmentForm,
+        )
+
+    @admin.action(description=_('Delete selected recipes'),
+                  permissions=['delete'])
+    def delete_recipes(self, request, queryset):
+        return self.confirm_bulk_action(
+            request, queryset, bulk.delete_recipes,
+            _('Deleted %(count)d recipes.'),
+        )
+
+
+@admin.register(models.Tag)
+class TagAdmin(OwnedObjectAdmin):
+    """Define the admin pages for tags."""
+    list_display = ['name', 'user_email']
+    search_fields = ['^name']
+    actions = ['delete_tags']
+
+    @admin.action(description=_('Delete selected tags'),
+                  permissions=['delete'])
+    def delete_tags(self, request, queryset):
+        return self.confirm_bulk_action(
+            request, queryset, bulk.delete_tags,
+            _('Deleted %(count)d tags.'),
+        )
+
+
+@admin.register(models.Ingredient)
+class IngredientAdmin(OwnedObjectAdmin):
+    """Define the admin pages for ingredients."""
+    list_display = ['name', 'user_email']
+    search_fields = ['^name']
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
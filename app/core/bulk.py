@@ -0,0 +1,303 @@
+"""
+Set-based writes to many recipes or tags at once.
+
+Each operation is a single statement over a selection given as SQL, for
+example the compiled admin changelist queryset, so its cost does not
+depend on loading the rows. Signals are bypassed: changed recipes get
+their version bumped in the same statement and the statistics and links
+version of the touched users are updated afterwards.
+
+``purge_user_data`` deletes all of a user's rows the same way, in
+batches.
+"""
+from decimal import Decimal
+
+from core import sharding, stats
+from core.images import delete_image_files
+from core.models import Recipe, RecipeStats, normalize_name
+
+ADD_TAG_SQL = """
+INSERT INTO core_tag (user_id, name)
+SELECT DISTINCT r.user_id, %s::text FROM core_recipe r WHERE r.id IN ({ids})
+ON CONFLICT (user_id, lower(name)) DO NOTHING
+RETURNING user_id
+"""
+
+LINK_TAG_SQL = """
+WITH linked AS (
+    INSERT INTO core_recipe_tags (recipe_id, tag_id, user_id)
+    SELECT r.id, t.id, r.user_id FROM core_recipe r
+    JOIN core_tag t ON t.user_id = r.user_id AND lower(t.name) = lower(%s)
+    WHERE r.id IN ({ids})
+    ON CONFLICT DO NOTHING
+    RETURNING recipe_id
+)
+UPDATE core_recipe SET version = version + 1
+WHERE id IN (SELECT recipe_id FROM linked)
+RETURNING user_id
+"""
+
+UNLINK_TAG_SQL = """
+WITH unlinked AS (
+    DELETE FROM core_recipe_tags rt USING core_tag t
+    WHERE rt.tag_id = t.id AND lower(t.name) = lower(%s)
+      AND rt.recipe_id IN ({ids})
+    RETURNING rt.recipe_id
+)
+UPDATE core_recipe SET version = version + 1
+WHERE id IN (SELECT recipe_id FROM unlinked)
+RETURNING user_id
+"""
+
+# By tag: only the recipes of the tag's owner can be linked. The owner is
+# given, so each statement reads one partition of core_recipe and of
+# core_recipe_tags (see core.partitioning).
+LINK_TAG_ID_SQL = """
+WITH linked AS (
+    INSERT INTO core_recipe_tags (recipe_id, tag_id, user_id)
+    SELECT r.id, t.id, r.user_id FROM core_recipe r
+    JOIN core_tag t ON t.user_id = r.user_id AND t.id = %s
+    WHERE r.user_id = %s AND r.id IN ({ids})
+    ON CONFLICT DO NOTHING
+    RETURNING recipe_id
+)
+UPDATE core_recipe SET version = version + 1
+WHERE id IN (SELECT recipe_id FROM linked) AND user_id = %s
+RETURNING user_id
+"""
+
+UNLINK_TAG_ID_SQL = """
+WITH unlinked AS (
+    DELETE FROM core_recipe_tags
+    WHERE user_id = %s AND tag_id = %s AND recipe_id IN ({ids})
+    RETURNING recipe_id
+)
+UPDATE core_recipe SET version = version + 1
+WHERE id IN (SELECT recipe_id FROM unlinked) AND user_id = %s
+RETURNING user_id
+"""
+
+ADJUST_PRICE_SQL = """
+UPDATE core_recipe
+SET price = LEAST(GREATEST(ROUND(price * %s, 2), 0), %s),
+    version = version + 1
+WHERE id IN ({ids})
+RETURNING user_id
+"""
+
+# Through rows go in the same statement as their recipes; the foreign key
+# checks are deferred to commit, when both are gone.
+DELETE_RECIPES_SQL = """
+WITH selected AS ({ids}),
+tag_links AS (
+    DELETE FROM core_recipe_tags WHERE recipe_id IN (SELECT * FROM selected)
+),
+ingredient_links AS (
+    DELETE FROM core_recipe_ingredients
+    WHERE recipe_id IN (SELECT * FROM selected)
+)
+DELETE FROM core_recipe WHERE id IN (SELECT * FROM selected)
+RETURNING user_id, image, thumbnails
+"""
+
+DELETE_TAGS_SQL = """
+WITH selected AS ({ids}),
+links AS (
+    DELETE FROM core_recipe_tags WHERE tag_id IN (SELECT * FROM selected)
+    RETURNING recipe_id
+),
+bumped AS (
+    UPDATE core_recipe SET version = version + 1
+    WHERE id IN (SELECT recipe_id FROM links)
+),
+tag_stats AS (
+    DELETE FROM core_tagstats WHERE tag_id IN (SELECT * FROM selected)
+)
+DELETE FROM core_tag WHERE id IN (SELECT * FROM selected)
+RETURNING user_id
+"""
+
+PURGE_BATCH_SIZE = 500
+
+PURGE_RECIPES_SQL = """
+SELECT id FROM core_recipe WHERE user_id = %s ORDER BY id LIMIT %s
+"""
+
+PURGE_TAGS_SQL = """
+WITH batch AS (
+    SELECT id FROM core_tag WHERE user_id = %(user_id)s
+    ORDER BY id LIMIT %(limit)s
+),
+tag_stats AS (
+    DELETE FROM core_tagstats WHERE tag_id IN (SELECT id FROM batch)
+)
+DELETE FROM core_tag WHERE id IN (SELECT id FROM batch)
+RETURNING id
+"""
+
+PURGE_TOMBSTONES_SQL = """
+DELETE FROM core_tombstone WHERE id IN (
+    SELECT id FROM core_tombstone WHERE user_id = %(user_id)s
+    ORDER BY id LIMIT %(limit)s
+)
+"""
+
+PURGE_INGREDIENTS_SQL = """
+DELETE FROM core_ingredient WHERE id IN (
+    SELECT id FROM core_ingredient WHERE user_id = %(user_id)s
+    ORDER BY id LIMIT %(limit)s
+)
+RETURNING id
+"""
+
+
+def selection(queryset):
+    """Return the SQL and params selecting the ids of `queryset`."""
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    return sql, list(params)
+
+
+def _execute(sql, selected, params=(), trailing=()):
+    """Run `sql` over the selection and return the rows it returned.
+
+    `params` come before the selection's in the SQL, `trailing` after.
+    """
+    ids_sql, ids_params = selected
+    with sharding.connection.cursor() as cursor:
+        cursor.execute(sql.format(ids=ids_sql),
+                       [*params, *ids_params, *trailing])
+        rows = cursor.fetchall()
+    return rows
+
+
+def _finish(rows, links=True):
+    """Rebuild the statistics of the users in the rows; return the count.
+
+    With `links` their links version is bumped as well.
+    """
+    user_ids = {row[0] for row in rows}
+    stats.rebuild(user_ids)
+    if links:
+        stats.links_changed(user_ids)
+    return len(rows)
+
+
+def add_tag(selected, name):
+    """Link a tag called `name` to the selected recipes, creating it.
+
+    Returns the number of recipes that were not linked to it before.
+    """
+    name = normalize_name(name)
+    with sharding.atomic():
+        _execute(ADD_TAG_SQL, selected, [name])
+        return _finish(_execute(LINK_TAG_SQL, selected, [name]))
+
+
+def remove_tag(selected, name):
+    """Unlink the tag called `name` from the selected recipes."""
+    with sharding.atomic():
+        return _finish(
+            _execute(UNLINK_TAG_SQL, selected, [normalize_name(name)]),
+        )
+
+
+def link_tag(selected, tag):
+    """Link `tag` to the selected recipes of its owner.
+
+    Returns the number of recipes that were not linked to it before.
+    """
+    with sharding.atomic():
+        return _finish(_execute(LINK_TAG_ID_SQL, selected,
+                                [tag.pk, tag.user_id], [tag.user_id]))
+
+
+def unlink_tag(selected, tag):
+    """Unlink `tag` from the selected recipes of its owner.
+
+    Returns the number of recipes that were linked to it.
+    """
+    with sharding.atomic():
+        return _finish(_execute(UNLINK_TAG_ID_SQL, selected,
+                                [tag.user_id, tag.pk], [tag.user_id]))
+
+
+def adjust_price(selected, percent):
+    """Change the price of the selected recipes by `percent`.
+
+    Prices are clamped to what the column can hold.
+    """
+    field = Recipe._meta.get_field('price')
+    highest = Decimal(10) ** (field.max_digits - field.decimal_places) - \
+        Decimal(1).scaleb(-field.decimal_places)
+    factor = 1 + Decimal(percent) / 100
+    with sharding.atomic():
+        return _finish(
+            _execute(ADJUST_PRICE_SQL, selected, [factor, highest]),
+            links=False,
+        )
+
+
+def delete_recipes(selected, rebuild_stats=True):
+    """Delete the selected recipes and, after commit, their images.
+
+    Callers that drop the owners' statistics anyway can skip rebuilding
+    them with `rebuild_stats`.
+    """
+    with sharding.atomic():
+        rows = _execute(DELETE_RECIPES_SQL, selected)
+        files = [(image, thumbnails) for _, image, thumbnails in rows
+                 if image]
+        if files:
+            sharding.on_commit(lambda: _delete_files(files))
+        return _finish(rows) if rebuild_stats else len(rows)
+
+
+def delete_tags(selected):
+    """Delete the selected tags and unlink them from their recipes."""
+    with sharding.atomic():
+        return _finish(_execute(DELETE_TAGS_SQL, selected))
+
+
+def _delete_files(files):
+    storage = Recipe._meta.get_field('image').storage
+    for image, thumbnails in files:
+        delete_image_files(storage, image, thumbnails)
+
+
+def purge_user_data(user_id, batch_size=PURGE_BATCH_SIZE, done=None,
+                    progress=None):
+    """Delete a user's rows on the active shard; return the counts.
+
+    Every batch is its own transaction, so no lock is held for long.
+    `done` holds the counts of an interrupted earlier purge, and
+    `progress(**counts)` is called after every batch.
+    """
+    steps = [
+        ('recipes', lambda: delete_recipes(
+            (PURGE_RECIPES_SQL, [user_id, batch_size]),
+            rebuild_stats=False,
+        )),
+        ('tags', lambda: _purge_rows(PURGE_TAGS_SQL, user_id, batch_size)),
+        ('ingredients',
+         lambda: _purge_rows(PURGE_INGREDIENTS_SQL, user_id, batch_size)),
+        ('tombstones',
+         lambda: _purge_rows(PURGE_TOMBSTONES_SQL, user_id, batch_size)),
+    ]
+    done = dict(done or {})
+    for name, purge_batch in steps:
+        while True:
+            count = purge_batch()
+            if not count:
+                break
+            done[name] = done.get(name, 0) + count
+            if progress is not None:
+                progress(**{name: done[name]})
+    # The ORM cascade of the user only reaches the default database.
+    RecipeStats.objects.filter(user_id=user_id).delete()
+    return done
+
+
+def _purge_rows(sql, user_id, limit):
+    with sharding.atomic(), sharding.connection.cursor() as cursor:
+        cursor.execute(sql, {'user_id': user_id, 'limit': limit})
+        return cursor.rowcount
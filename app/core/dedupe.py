@@ -0,0 +1,109 @@
+"""
+Merging of tags and ingredients whose names differ only in case or
+whitespace.
+
+Work is done for a range of users at a time, each range in its own short
+transaction, so only the rows being merged are locked. Within a range,
+every duplicate is merged into the lowest id of its group: its recipe
+links are repointed with ``INSERT ... SELECT ... ON CONFLICT DO NOTHING``
+(a recipe may already link the survivor) and the duplicate is deleted.
+
+The SQL only uses table names, so it can run from migrations as well as
+from the ``dedupe_names`` command.
+"""
+
+NAME_TABLES = {
+    'tag': {
+        'table': 'core_tag',
+        'through': 'core_recipe_tags',
+        'column': 'tag_id',
+        'stats': 'core_tagstats',
+    },
+    'ingredient': {
+        'table': 'core_ingredient',
+        'through': 'core_recipe_ingredients',
+        'column': 'ingredient_id',
+        'stats': None,
+    },
+}
+
+NORMALIZED_NAME_SQL = "regexp_replace(btrim(name), '\\s+', ' ', 'g')"
+
+NORMALIZE_SQL = """
+UPDATE {table} SET name = """ + NORMALIZED_NAME_SQL + """
+WHERE user_id >= %(first)s AND user_id <= %(last)s
+  AND name <> """ + NORMALIZED_NAME_SQL
+
+DUPLICATES_SQL = """
+SELECT user_id, survivor, duplicate FROM (
+    SELECT user_id, id AS duplicate,
+           MIN(id) OVER (
+               PARTITION BY user_id, lower(""" + NORMALIZED_NAME_SQL + """)
+           ) AS survivor
+    FROM {table}
+    WHERE user_id >= %(first)s AND user_id <= %(last)s
+) groups
+WHERE survivor <> duplicate
+"""
+
+REPOINT_SQL = """
+INSERT INTO {through} (recipe_id, {column}, user_id)
+SELECT rt.recipe_id, m.survivor, rt.user_id
+FROM {through} rt
+JOIN unnest(%(duplicates)s::bigint[], %(survivors)s::bigint[])
+    AS m(duplicate, survivor) ON rt.{column} = m.duplicate
+ON CONFLICT DO NOTHING
+"""
+
+# Bumping the version marks the recipes as changed for clients holding
+# them (and, through the trigger, for delta sync).
+TOUCH_RECIPES_SQL = """
+UPDATE core_recipe SET version = version + 1
+WHERE id IN (
+    SELECT recipe_id FROM {through}
+    WHERE {column} = ANY(%(duplicates)s::bigint[])
+)
+"""
+
+DELETE_LINKS_SQL = """
+DELETE FROM {through} WHERE {column} = ANY(%(duplicates)s::bigint[])
+"""
+
+DELETE_STATS_SQL = """
+DELETE FROM {stats} WHERE tag_id = ANY(%(duplicates)s::bigint[])
+"""
+
+DELETE_DUPLICATES_SQL = """
+DELETE FROM {table} WHERE id = ANY(%(duplicates)s::bigint[])
+"""
+
+
+def merge_user_range(cursor, kind, first, last, dry_run=False):
+    """Normalize and merge the names of users ``first`` to ``last``.
+
+    Returns ``(duplicates, user_ids)``: how many rows were (or, with
+    `dry_run`, would be) merged away, and the users they belonged to.
+    """
+    tables = NAME_TABLES[kind]
+    bounds = {'first': first, 'last': last}
+
+    cursor.execute(DUPLICATES_SQL.format(**tables), bounds)
+    rows = cursor.fetchall()
+    user_ids = sorted({row[0] for row in rows})
+    if dry_run:
+        return len(rows), user_ids
+
+    if rows:
+        params = {
+            'duplicates': [row[2] for row in rows],
+            'survivors': [row[1] for row in rows],
+        }
+        cursor.execute(REPOINT_SQL.format(**tables), params)
+        cursor.execute(TOUCH_RECIPES_SQL.format(**tables), params)
+        cursor.execute(DELETE_LINKS_SQL.format(**tables), params)
+        if tables['stats']:
+            cursor.execute(DELETE_STATS_SQL.format(**tables), params)
+        cursor.execute(DELETE_DUPLICATES_SQL.format(**tables), params)
+    # Survivors are normalized last, once nothing else shares their name.
+    cursor.execute(NORMALIZE_SQL.format(**tables), bounds)
+    return len(rows), user_ids
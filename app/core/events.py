@@ -0,0 +1,387 @@
+"""
+Server-Sent Events stream of a user's recipe, tag and ingredient changes.
+
+Writes to those tables send a PostgreSQL notification on commit (see
+migration 0016), whatever wrote them. Each ASGI process holds one
+``LISTEN`` connection per shard, read from the event loop without a
+thread, and fans their notifications out to the streams of their user;
+an idle stream is a coroutine waiting on an ``asyncio.Event``, so
+thousands of them cost little more than their sockets.
+
+Events are numbered per process and the last ``EVENTS_BUFFER_SIZE`` are
+kept in a ring buffer. A client reconnecting with ``Last-Event-ID`` gets
+the events it missed from there; when they are gone (or it reconnects to
+another process, or notifications may have been lost) it gets a
+``reset`` event instead and catches up with ``/api/recipe/sync/``.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict, deque
+from itertools import islice
+
+import psycopg2
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from rest_framework.authtoken.models import Token
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'core_changes'
+
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class Subscription:
+    """Events waiting to be written to one stream."""
+
+    def __init__(self, user_id, max_pending):
+        self.user_id = user_id
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.reset = False
+        self.closed = False
+        self.wakeup = asyncio.Event()
+
+    def push(self, event):
+        # A client this far behind catches up faster with a sync.
+        if self.reset or len(self.pending) >= self.max_pending:
+            self.request_reset()
+            return
+        self.pending.append(event)
+        self.wakeup.set()
+
+    def request_reset(self):
+        self.pending.clear()
+        self.reset = True
+        self.wakeup.set()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+
+class Broker:
+    """Listens for change notifications and hands them to subscriptions.
+
+    Belongs to one event loop; see ``get_broker``.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.process_id = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.buffer = deque(maxlen=settings.EVENTS_BUFFER_SIZE)
+        self.subscriptions = defaultdict(set)
+        self.connection_count = 0
+        self._conns = {}
+        self._connecting = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, settings.EVENTS_MAX_PENDING)
+        self.subscriptions[user_id].add(subscription)
+        self.connection_count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            self.connection_count -= 1
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def user_connection_count(self, user_id):
+        return len(self.subscriptions.get(user_id, ()))
+
+    def dispatch(self, payload):
+        """Number a notification and push it to its user's streams."""
+        self.seq += 1
+        event = (
+            self.seq,
+            payload['user'],
+            f'{payload["kind"]}.{payload["action"]}',
+            json.dumps({
+                'kind': payload['kind'],
+                'action': payload['action'],
+                'ids': payload['ids'],
+            }),
+        )
+        self.buffer.append(event)
+        for subscription in self.subscriptions.get(payload['user'], ()):
+            subscription.push(event)
+
+    def event_id(self, seq):
+        return f'{self.process_id}-{seq}'
+
+    def replay(self, user_id, last_event_id):
+        """Return the user's buffered events after `last_event_id`.
+
+        Returns None when some of them may be missing.
+        """
+        process_id, _, seq = (last_event_id or '').partition('-')
+        if process_id != self.process_id or not seq.isdigit():
+            return None
+        seq = int(seq)
+        first = self.buffer[0][0] if self.buffer else self.seq + 1
+        if seq < first - 1 or seq > self.seq:
+            return None
+        return [
+            event for event in islice(self.buffer, seq - first + 1, None)
+            if event[1] == user_id
+        ]
+
+    def gap(self):
+        """Forget events and reset every stream after missed notifications.
+        """
+        self.buffer.clear()
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.request_reset()
+
+    async def start(self):
+        """Connect the LISTEN connections that are not connected already.
+        """
+        for alias in settings.SHARDS:
+            if alias not in self._conns and alias not in self._connecting:
+                self._connecting[alias] = asyncio.ensure_future(
+                    self._listen(alias),
+                )
+        if self._connecting:
+            await asyncio.shield(
+                asyncio.gather(*self._connecting.values()),
+            )
+
+    async def _listen(self, alias):
+        delays = iter(RECONNECT_DELAYS)
+        while True:
+            try:
+                conn = await self.loop.run_in_executor(
+                    None, self._connect, alias,
+                )
+                break
+            except psycopg2.Error:
+                delay = next(delays, RECONNECT_DELAYS[-1])
+                logger.exception('Could not listen for changes on %s, '
+                                 'retrying in %ss', alias, delay)
+                await asyncio.sleep(delay)
+        self._conns[alias] = conn
+        del self._connecting[alias]
+        self.loop.add_reader(conn.fileno(), self._read, alias)
+
+    @staticmethod
+    def _connect(alias):
+        params = connections[alias].get_connection_params()
+        conn = psycopg2.connect(
+            keepalives=1, keepalives_idle=30, keepalives_interval=10,
+            keepalives_count=3, **params,
+        )
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return conn
+
+    def _read(self, alias):
+        conn = self._conns[alias]
+        try:
+            conn.poll()
+        except psycopg2.Error:
+            logger.exception('Lost the connection listening for changes '
+                             'on %s', alias)
+            self._close(alias)
+            self.gap()
+            self._connecting[alias] = asyncio.ensure_future(
+                self._listen(alias),
+            )
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                self.dispatch(json.loads(notify.payload))
+            except (ValueError, KeyError):
+                logger.warning('Ignored malformed change notification %r',
+                               notify.payload)
+
+    def _close(self, alias):
+        conn = self._conns.pop(alias)
+        try:
+            self.loop.remove_reader(conn.fileno())
+        except (ValueError, OSError):
+            pass
+        conn.close()
+
+    def stop(self):
+        for alias in list(self._conns):
+            self._close(alias)
+
+
+_brokers = {}
+
+
+def get_broker():
+    """Return the broker of the running event loop, creating it."""
+    loop = asyncio.get_event_loop()
+    broker = _brokers.get(loop)
+    if broker is None:
+        for other in list(_brokers):
+            if other.is_closed():
+                del _brokers[other]
+        broker = _brokers[loop] = Broker(loop)
+    return broker
+
+
+def clear():
+    """Close and forget every broker."""
+    for broker in _brokers.values():
+        broker.stop()
+    _brokers.clear()
+
+
+def format_event(broker, event):
+    seq, _, name, data = event
+    return (f'id: {broker.event_id(seq)}\nevent: {name}\n'
+            f'data: {data}\n\n').encode()
+
+
+def authenticate(authorization):
+    """Return the active user of a ``Token <key>`` header, or None."""
+    keyword, _, key = authorization.partition(' ')
+    if keyword.lower() != 'token' or not key.strip():
+        return None
+    close_old_connections()
+    try:
+        token = Token.objects.select_related('user').get(key=key.strip())
+    except Token.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+    return token.user if token.user.is_active else None
+
+
+class EventStreamApplication:
+    """ASGI application serving the stream at ``EVENTS_PATH``.
+
+    Every other request goes to `application`. Clients authenticate with
+    the same ``Authorization: Token <key>`` header as the REST API.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != settings.EVENTS_PATH:
+            return await self.application(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await self.reply(send, 405, 'Method not allowed.',
+                                    [(b'allow', b'GET')])
+
+        headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope['headers']
+        }
+        user = await sync_to_async(authenticate)(
+            headers.get('authorization', ''),
+        )
+        if user is None:
+            return await self.reply(
+                send, 401, 'Authentication credentials were not provided.',
+                [(b'www-authenticate', b'Token')],
+            )
+
+        broker = get_broker()
+        retry_after = [(b'retry-after',
+                        str(settings.EVENTS_RETRY_DELAY).encode())]
+        if broker.connection_count >= settings.EVENTS_MAX_CONNECTIONS:
+            return await self.reply(send, 503, 'Too many connections.',
+                                    retry_after)
+        if broker.user_connection_count(user.pk) >= \
+                settings.EVENTS_MAX_USER_CONNECTIONS:
+            return await self.reply(send, 429, 'Too many connections.',
+                                    retry_after)
+        await broker.start()
+        await self.stream(broker, user, headers.get('last-event-id'),
+                          receive, send)
+
+    @staticmethod
+    async def reply(send, status, detail, headers=()):
+        body = json.dumps({'detail': detail}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                *headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stream(self, broker, user, last_event_id, receive, send):
+        subscription = broker.subscribe(user.pk)
+        disconnect = asyncio.ensure_future(
+            self.wait_for_disconnect(receive, subscription),
+        )
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            retry = settings.EVENTS_RETRY_DELAY * 1000
+            await self.write(send, f'retry: {retry}\n\n'.encode())
+            if last_event_id:
+                missed = broker.replay(user.pk, last_event_id)
+                if missed is None:
+                    subscription.request_reset()
+                for event in missed or ():
+                    await self.write(send, format_event(broker, event))
+
+            while True:
+                try:
+                    await asyncio.wait_for(subscription.wakeup.wait(),
+                                           settings.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await self.write(send, b': heartbeat\n\n')
+                    continue
+                subscription.wakeup.clear()
+                if subscription.closed:
+                    break
+                if subscription.reset:
+                    subscription.reset = False
+                    await self.write(send, self.reset_event(broker))
+                while subscription.pending:
+                    await self.write(
+                        send, format_event(broker,
+                                           subscription.pending.popleft()),
+                    )
+        finally:
+            broker.unsubscribe(subscription)
+            disconnect.cancel()
+
+    @staticmethod
+    def reset_event(broker):
+        # Events after this one can be resumed from its id.
+        return (f'id: {broker.event_id(broker.seq)}\nevent: reset\n'
+                f'data: {{}}\n\n').encode()
+
+    @staticmethod
+    async def write(send, body):
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+            'more_body': True,
+        })
+
+    @staticmethod
+    async def wait_for_disconnect(receive, subscription):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        subscription.close()
@@ -0,0 +1,107 @@
+"""
+Thumbnail generation for uploaded recipe images.
+
+Resizing is CPU bound, so it runs in a process pool and never on the
+request thread. The pool only receives file paths and returns the names
+of the thumbnails it wrote; the database is updated back in this process.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_name(name, size):
+    """Return the storage name of the thumbnail of `name` at `size`."""
+    stem = os.path.splitext(name)[0]
+    return f'{stem}_{size}.jpg'
+
+
+def generate_thumbnails(media_root, name, sizes):
+    """Write JPEG thumbnails of the image `name` and return their names."""
+    # Imported here so web processes do not pay for Pillow at boot.
+    from PIL import Image
+
+    thumbnails = {}
+    with Image.open(os.path.join(media_root, name)) as img:
+        img = img.convert('RGB')
+        for size in sorted(sizes, reverse=True):
+            img.thumbnail((size, size))
+            target = thumbnail_name(name, size)
+            img.save(
+                os.path.join(media_root, target),
+                'JPEG',
+                quality=85,
+                optimize=True,
+            )
+            thumbnails[str(size)] = target
+    return thumbnails
+
+
+def _get_executor():
+    """Return the lazily created process pool for thumbnail work."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.RECIPE_THUMBNAIL_WORKERS,
+            )
+        return _executor
+
+
+def save_thumbnails(using, recipe_id, name, thumbnails):
+    """Store thumbnail names unless the recipe image changed meanwhile."""
+    from core.models import Recipe
+
+    Recipe.objects.using(using).filter(id=recipe_id, image=name).update(
+        thumbnails=thumbnails,
+    )
+
+
+def _on_done(using, recipe_id, name, future):
+    """Record the result of a pooled thumbnail job."""
+    try:
+        save_thumbnails(using, recipe_id, name, future.result())
+    except Exception:
+        logger.exception('Thumbnail generation failed for %s', name)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnails(recipe):
+    """Generate thumbnails for the recipe image once the upload commits."""
+    name = recipe.image.name
+    recipe_id = recipe.id
+    using = recipe._state.db
+    sizes = settings.RECIPE_THUMBNAIL_SIZES
+
+    def submit():
+        if settings.RECIPE_THUMBNAIL_WORKERS <= 0:
+            save_thumbnails(
+                using, recipe_id, name,
+                generate_thumbnails(settings.MEDIA_ROOT, name, sizes),
+            )
+            return
+        future = _get_executor().submit(
+            generate_thumbnails, settings.MEDIA_ROOT, name, sizes,
+        )
+        future.add_done_callback(
+            lambda f: _on_done(using, recipe_id, name, f)
+        )
+
+    transaction.on_commit(submit, using=using)
+
+
+def delete_image_files(storage, name, thumbnails):
+    """Remove a replaced image and its thumbnails from storage."""
+    for target in [name, *thumbnails.values()]:
+        if target:
+            storage.delete(target)
@@ -0,0 +1,173 @@
+"""
+Database backed background jobs.
+
+Jobs are rows in ``core_job``. Workers claim them with
+``SELECT ... FOR UPDATE SKIP LOCKED`` so any number of ``run_worker``
+processes can share the queue without a broker. Handlers are registered
+with the ``job`` decorator in an app's ``jobs.py`` module.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def job(name):
+    """Register the decorated function as the handler for `name`."""
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def get_handler(name):
+    """Return the handler registered for `name`."""
+    return _registry[name]
+
+
+def autodiscover():
+    """Import the ``jobs`` module of every installed app."""
+    autodiscover_modules('jobs')
+
+
+def enqueue(name, payload=None, user=None, run_after=None,
+            max_attempts=None):
+    """Queue a job; it becomes visible when the caller's transaction commits.
+    """
+    if name not in _registry:
+        raise ValueError(f'No job handler registered for {name!r}')
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'user': user,
+    }
+    if run_after is not None:
+        fields['run_after'] = run_after
+    if max_attempts is not None:
+        fields['max_attempts'] = max_attempts
+    return Job.objects.create(**fields)
+
+
+def claim(worker_id):
+    """Claim the next runnable job, or return None when the queue is empty.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job_obj = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job_obj is None:
+            return None
+        job_obj.status = Job.RUNNING
+        job_obj.attempts += 1
+        job_obj.locked_by = worker_id
+        job_obj.locked_at = now
+        job_obj.save(update_fields=[
+            'status', 'attempts', 'locked_by', 'locked_at', 'updated_at',
+        ])
+    return job_obj
+
+
+def heartbeat(job_id, worker_id):
+    """Refresh the lock of a job `worker_id` is running.
+
+    Returns False when the job is no longer running under that worker.
+    """
+    return bool(Job.objects.filter(
+        pk=job_id, status=Job.RUNNING, locked_by=worker_id,
+    ).update(locked_at=timezone.now()))
+
+
+def retry_delay(attempts):
+    """Return the exponential backoff, with jitter, before the next try."""
+    base = settings.JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+    delay = min(base, settings.JOB_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run(job_obj):
+    """Run a claimed job and record its outcome."""
+    try:
+        handler = get_handler(job_obj.name)
+        result = handler(job_obj)
+    except Exception as exc:
+        logger.warning('Job %s failed: %s', job_obj, exc)
+        job_obj.last_error = traceback.format_exc()
+        if job_obj.attempts < job_obj.max_attempts and \
+                job_obj.name in _registry:
+            job_obj.status = Job.QUEUED
+            job_obj.run_after = timezone.now() + retry_delay(
+                job_obj.attempts,
+            )
+        else:
+            job_obj.status = Job.FAILED
+    else:
+        job_obj.status = Job.SUCCEEDED
+        job_obj.result = result
+        job_obj.last_error = ''
+
+    worker_id = job_obj.locked_by
+    job_obj.locked_by = ''
+    job_obj.locked_at = None
+    job_obj.updated_at = timezone.now()
+    # Only the worker still holding the lock may record the outcome; a job
+    # requeued by requeue_stale may already belong to another worker.
+    saved = Job.objects.filter(pk=job_obj.pk, locked_by=worker_id).update(
+        status=job_obj.status,
+        result=job_obj.result,
+        last_error=job_obj.last_error,
+        run_after=job_obj.run_after,
+        locked_by='',
+        locked_at=None,
+        updated_at=job_obj.updated_at,
+    )
+    if not saved:
+        logger.warning('Job %s lost its lock, outcome discarded', job_obj)
+    return job_obj
+
+
+def requeue_stale(timeout=None):
+    """Return jobs of crashed workers to the queue; return their count.
+
+    A running job is stale when its ``locked_at`` heartbeat, refreshed by
+    ``heartbeat`` and ``Job.set_progress``, is older than the timeout.
+    Stale jobs that have used up their attempts are marked failed instead
+    of requeued.
+    """
+    timeout = timeout or settings.JOB_STALE_TIMEOUT
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=timeout),
+    )
+    with transaction.atomic():
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED,
+            last_error=f'Worker stopped responding for {timeout} seconds',
+            locked_by='',
+            locked_at=None,
+            updated_at=now,
+        )
+        requeued = stale.update(
+            status=Job.QUEUED,
+            locked_by='',
+            locked_at=None,
+            run_after=now,
+            updated_at=now,
+        )
+    return failed + requeued
@@ -0,0 +1,377 @@
+"""
+Django command to benchmark the recipe API under concurrent load.
+"""
+import http.client
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+
+from core import seeding, sharding, stats
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+)
+
+BENCH_EMAIL = 'bench-user-{}@example.com'
+BENCH_PASSWORD = 'bench-pass-123'
+SCENARIOS = ('list', 'detail', 'create', 'update', 'token', 'me')
+
+
+def percentile(sorted_values, pct):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values))), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, conflicts, elapsed):
+    """Summarize latencies (in seconds) of one scenario as a dict."""
+    values = sorted(latencies)
+
+    def to_ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'conflicts': conflicts,
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(values) / elapsed, 2) if elapsed else None,
+        'p50_ms': to_ms(percentile(values, 50)),
+        'p95_ms': to_ms(percentile(values, 95)),
+        'p99_ms': to_ms(percentile(values, 99)),
+        'max_ms': to_ms(values[-1] if values else None),
+    }
+
+
+class WsgiTransport:
+    """Send requests through the in-process WSGI handler."""
+
+    def __init__(self):
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+        self.client = Client(HTTP_HOST=host or 'localhost')
+
+    def request(self, method, path, body=None, token=None):
+        extra = {}
+        if token:
+            extra['HTTP_AUTHORIZATION'] = f'Token {token}'
+        res = self.client.generic(
+            method,
+            path,
+            json.dumps(body) if body is not None else '',
+            content_type='application/json',
+            **extra,
+        )
+        return res.status_code, res.content
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    """Send requests over a keep-alive HTTP connection to a server."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        conn_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.prefix = parts.path.rstrip('/')
+        self.conn = conn_class(parts.netloc, timeout=30)
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, self.prefix + path, payload, headers)
+            res = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            raise
+        return res.status, res.read()
+
+    def close(self):
+        self.conn.close()
+
+
+class Command(BaseCommand):
+    """Django command to run a reproducible load benchmark of the API."""
+    help = (
+        'Seed benchmark data and drive concurrent authenticated traffic '
+        'against the API, reporting latency percentiles as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--recipes', type=int, default=50,
+                            help='Recipes per user.')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Tags per user.')
+        parser.add_argument('--ingredients', type=int, default=10,
+                            help='Ingredients per user.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=10,
+                            help='Unmeasured requests per scenario.')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help='Comma separated subset of scenarios.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--base-url', default=None,
+                            help='Benchmark a running server instead of '
+                                 'the in-process WSGI handler.')
+        parser.add_argument('--skip-seed', action='store_true',
+                            help='Reuse previously seeded benchmark data.')
+        parser.add_argument('--output', default=None,
+                            help='Write the JSON report to this file.')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep request throttling enabled for the '
+                                 'in-process WSGI handler.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        scenarios = [s for s in options['scenarios'].split(',') if s]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {sorted(unknown)}')
+
+        if not options['skip_seed']:
+            self.seed(options)
+        fixtures = self.load_fixtures(options['users'])
+
+        results = {}
+        throttling = {} if options['throttle'] else {'THROTTLE_BACKEND': ''}
+        with override_settings(**throttling):
+            for name in scenarios:
+                results[name] = self.run_scenario(name, fixtures, options)
+                self.stderr.write(
+                    f"{name}: p50={results[name]['p50_ms']}ms "
+                    f"p99={results[name]['p99_ms']}ms "
+                    f"rps={results[name]['throughput_rps']}"
+                )
+
+        report = {
+            'meta': self.metadata(options),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+    def seed(self, options):
+        """Replace benchmark users and their data with a fresh dataset."""
+        rng = random.Random(options['seed'])
+        emails = [BENCH_EMAIL.format(i) for i in range(options['users'])]
+        password = make_password(BENCH_PASSWORD)
+
+        seeding.delete_users(
+            get_user_model().objects.filter(email__in=emails),
+        )
+        by_shard = seeding.create_users(
+            get_user_model()(email=email, password=password)
+            for email in emails
+        )
+        Token.objects.bulk_create(
+            Token(user=user, key=Token.generate_key())
+            for users in by_shard.values() for user in users
+        )
+
+        for alias, users in by_shard.items():
+            with sharding.use_shard(alias), sharding.atomic():
+                for user in users:
+                    tags = Tag.objects.bulk_create(
+                        Tag(user=user, name=f'tag-{i}')
+                        for i in range(options['tags'])
+                    )
+                    Ingredient.objects.bulk_create(
+                        Ingredient(user=user, name=f'ingredient-{i}')
+                        for i in range(options['ingredients'])
+                    )
+                    recipes = Recipe.objects.bulk_create(
+                        Recipe(
+                            user=user,
+                            title=f'Bench recipe {i}',
+                            time_minutes=rng.randint(5, 120),
+                            price=Decimal(rng.randint(100, 5000)) / 100,
+                        )
+                        for i in range(options['recipes'])
+                    )
+                    Recipe.tags.through.objects.bulk_create(
+                        Recipe.tags.through(recipe=recipe, tag=tag,
+                                            user=user)
+                        for recipe in recipes
+                        for tag in rng.sample(tags, min(len(tags), 3))
+                    )
+                stats.rebuild(user.id for user in users)
+
+    def load_fixtures(self, user_count):
+        """Return (email, token, recipe ids) for each benchmark user.
+
+        Also remembers the version of every recipe, which updates send.
+        """
+        emails = [BENCH_EMAIL.format(i) for i in range(user_count)]
+        users = get_user_model().objects.filter(email__in=emails) \
+            .select_related('auth_token')
+        self.versions = {}
+        fixtures = []
+        for user in sorted(users, key=lambda user: emails.index(user.email)):
+            with sharding.use_shard(sharding.shard_for(user)):
+                recipes = dict(
+                    Recipe.objects.filter(user=user)
+                    .values_list('id', 'version')
+                )
+            for recipe_id, version in recipes.items():
+                self.versions[
+                    reverse('recipe:recipe-detail', args=[recipe_id])
+                ] = version
+            fixtures.append((user.email, user.auth_token.key, list(recipes)))
+        return fixtures
+
+    def build_request(self, name, fixture, rng):
+        """Return (method, path, body, token) for one scenario request."""
+        email, token, recipe_ids = fixture
+        if name == 'list':
+            return 'GET', reverse('recipe:recipe-list'), None, token
+        if name == 'detail':
+            url = reverse('recipe:recipe-detail',
+                          args=[rng.choice(recipe_ids)])
+            return 'GET', url, None, token
+        if name == 'create':
+            body = {
+                'title': f'Bench created {rng.random():.6f}',
+                'time_minutes': rng.randint(5, 120),
+                'price': f'{rng.randint(100, 5000) / 100:.2f}',
+                'tags': [{'name': f'tag-{rng.randint(0, 4)}'}],
+            }
+            return 'POST', reverse('recipe:recipe-list'), body, token
+        if name == 'update':
+            url = reverse('recipe:recipe-detail',
+                          args=[rng.choice(recipe_ids)])
+            body = {
+                'time_minutes': rng.randint(5, 120),
+                'version': self.versions[url],
+            }
+            return 'PATCH', url, body, token
+        if name == 'token':
+            body = {'email': email, 'password': BENCH_PASSWORD}
+            return 'POST', reverse('user:token'), body, None
+        return 'GET', reverse('user:me'), None, token
+
+    def run_scenario(self, name, fixtures, options):
+        """Drive one scenario with the configured concurrency."""
+        concurrency = max(options['concurrency'], 1)
+        total = options['requests']
+        warmup = options['warmup']
+        counter = iter(range(total + warmup))
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+        conflicts = [0]
+
+        def worker(worker_id):
+            rng = random.Random(f"{options['seed']}:{name}:{worker_id}")
+            transport = (
+                HttpTransport(options['base_url']) if options['base_url']
+                else WsgiTransport()
+            )
+            try:
+                while True:
+                    with lock:
+                        index = next(counter, None)
+                    if index is None:
+                        return
+                    method, path, body, token = self.build_request(
+                        name, rng.choice(fixtures), rng,
+                    )
+                    start = time.perf_counter()
+                    try:
+                        status_code, content = transport.request(
+                            method, path, body, token,
+                        )
+                    except (http.client.HTTPException, OSError):
+                        status_code, content = None, b''
+                    latency = time.perf_counter() - start
+                    if name == 'update':
+                        self.track_version(transport, path, token,
+                                           status_code, content)
+                    if index < warmup:
+                        continue
+                    with lock:
+                        # A concurrent update won: not a server latency.
+                        if status_code == 409:
+                            conflicts[0] += 1
+                            continue
+                        latencies.append(latency)
+                        if status_code is None or status_code >= 400:
+                            errors[0] += 1
+            finally:
+                if concurrency > 1 or options['base_url']:
+                    transport.close()
+
+        start = time.perf_counter()
+        if concurrency == 1:
+            worker(0)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(worker, range(concurrency)))
+        return summarize(latencies, errors[0], conflicts[0],
+                         time.perf_counter() - start)
+
+    def track_version(self, transport, path, token, status_code, content):
+        """Remember the version of an updated recipe.
+
+        After a conflict the recipe is read again for its version.
+        """
+        if status_code == 409:
+            status_code, content = transport.request('GET', path, None,
+                                                     token)
+        if status_code == 200:
+            self.versions[path] = json.loads(content)['version']
+
+    def metadata(self, options):
+        """Describe the environment so reports can be compared."""
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        params = {
+            key: options[key] for key in (
+                'users', 'recipes', 'tags', 'ingredients', 'requests',
+                'concurrency', 'warmup', 'seed', 'base_url',
+            )
+        }
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'params': params,
+        }
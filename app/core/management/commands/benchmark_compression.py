@@ -0,0 +1,166 @@
+"""
+Django command to benchmark response compression on recipe payloads.
+"""
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core import middleware, sharding
+from core.models import Recipe
+
+
+def parse_levels(value):
+    return [int(level) for level in value.split(',') if level]
+
+
+class Command(BaseCommand):
+    """Django command to compare compression codings and levels."""
+    help = ('Compress real recipe API payloads with every coding and level, '
+            'reporting compressed size against CPU time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', default=None,
+                            help='User whose recipes are fetched. Defaults '
+                                 'to the user with the most recipes.')
+        parser.add_argument('--gzip-levels', type=parse_levels,
+                            default=[1, 4, 6, 9])
+        parser.add_argument('--brotli-qualities', type=parse_levels,
+                            default=[1, 4, 6, 9, 11])
+        parser.add_argument('--chunk-size', type=int, default=8192,
+                            help='Chunk size when measuring streamed '
+                                 'compression.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per measurement; medians are '
+                                 'reported.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        payloads = self.fetch_payloads(options['email'])
+        candidates = [
+            (middleware.GzipCoder, level) for level in options['gzip_levels']
+        ]
+        if middleware.brotli is not None:
+            candidates += [
+                (middleware.BrotliCoder, quality)
+                for quality in options['brotli_qualities']
+            ]
+        else:
+            self.stderr.write('brotli is not installed, skipping it.')
+
+        report = {}
+        for name, payload in payloads.items():
+            report[name] = {
+                'bytes': len(payload),
+                'codings': [
+                    self.measure(coder, level, payload, options)
+                    for coder, level in candidates
+                ],
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, result in report.items():
+            self.write_payload(name, result)
+
+    def fetch_payloads(self, email):
+        """Return the uncompressed list and detail responses of a user."""
+        users = get_user_model().objects.all()
+        if email:
+            user = users.filter(email=email).first()
+        else:
+            # Recipes are on their owner's shard: take the biggest owner
+            # of every shard, then the biggest of those.
+            owners = []
+            for alias in settings.SHARDS:
+                with sharding.use_shard(alias):
+                    owners.extend(
+                        Recipe.objects.values_list('user')
+                        .annotate(recipes=Count('id'))
+                        .order_by('-recipes')[:1]
+                    )
+            user = users.filter(
+                pk=max(owners, key=lambda owner: owner[1])[0],
+            ).first() if owners else None
+        recipe = None
+        if user is not None:
+            with sharding.use_shard(sharding.shard_for(user)):
+                recipe = Recipe.objects.filter(user=user).order_by('id') \
+                    .first()
+        if recipe is None:
+            raise CommandError(
+                'No recipes to compress; seed some with seed_data first.',
+            )
+
+        host = (settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.')
+        client = APIClient(HTTP_HOST=host or 'localhost',
+                           HTTP_ACCEPT_ENCODING='identity')
+        client.force_authenticate(user)
+        urls = {
+            'recipe list': reverse('recipe:recipe-list'),
+            'recipe detail': reverse('recipe:recipe-detail',
+                                     args=[recipe.id]),
+        }
+        payloads = {}
+        with override_settings(THROTTLE_BACKEND=''):
+            for name, url in urls.items():
+                res = client.get(url)
+                if res.status_code != 200:
+                    raise CommandError(f'GET {url} returned '
+                                       f'{res.status_code}')
+                payloads[name] = res.content
+        return payloads
+
+    def measure(self, coder, level, payload, options):
+        """Compress `payload` whole and streamed; return sizes and times.
+        """
+        chunk_size = max(options['chunk_size'], 1)
+        chunks = [payload[i:i + chunk_size]
+                  for i in range(0, len(payload), chunk_size)]
+        timings, compressed = [], b''
+        for _ in range(max(options['repeat'], 1)):
+            began = time.perf_counter()
+            compressed = coder(level).compress(payload)
+            timings.append(time.perf_counter() - began)
+
+        streamed = coder(level)
+        stream_bytes = sum(len(streamed.feed(chunk)) for chunk in chunks) + \
+            len(streamed.finish())
+
+        ms = statistics.median(timings) * 1000
+        return {
+            'coding': coder.name,
+            'level': level,
+            'bytes': len(compressed),
+            'ratio': round(len(payload) / len(compressed), 2),
+            'ms': round(ms, 3),
+            'mb_per_s': round(len(payload) / 1e6 / (ms / 1000), 1)
+            if ms else None,
+            'stream_bytes': stream_bytes,
+        }
+
+    def write_payload(self, name, result):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{name}: {result["bytes"]} bytes'
+        ))
+        self.stdout.write(
+            f'  {"coding":<8}{"level":>6}{"bytes":>10}{"ratio":>8}'
+            f'{"ms":>10}{"MB/s":>9}{"streamed":>10}'
+        )
+        for row in result['codings']:
+            self.stdout.write(
+                f'  {row["coding"]:<8}{row["level"]:>6}{row["bytes"]:>10}'
+                f'{row["ratio"]:>8.2f}{row["ms"]:>10.3f}'
+                f'{row["mb_per_s"] or 0:>9.1f}{row["stream_bytes"]:>10}'
+            )
@@ -0,0 +1,18 @@
+"""
+Django command to prebuild the OpenAPI schema.
+"""
+from django.core.management.base import BaseCommand
+
+from core import schema
+
+
+class Command(BaseCommand):
+    """Django command to generate and store the compressed schema."""
+    help = 'Generate the OpenAPI schema served by /api/schema/.'
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        for path in schema.build():
+            self.stdout.write(f'Wrote {path}')
+        etag = schema.load('json').etag
+        self.stdout.write(self.style.SUCCESS(f'Schema built, ETag {etag}'))
@@ -0,0 +1,71 @@
+"""
+Django command to merge tags and ingredients with duplicate names.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import dedupe, sharding, stats
+
+
+class Command(BaseCommand):
+    """Django command to merge case and whitespace duplicate names."""
+    help = ('Merge tags and ingredients whose names only differ in case or '
+            'whitespace, repointing their recipe links.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users handled per transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the duplicates.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        dry_run = options['dry_run']
+        totals = dict.fromkeys(dedupe.NAME_TABLES, 0)
+        for alias in settings.SHARDS:
+            users = get_user_model().objects.filter(
+                sharding.users_on(alias),
+            ).order_by('id')
+            with sharding.use_shard(alias):
+                self.merge(users, totals, options)
+
+        verb = 'Found' if dry_run else 'Merged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} ' +
+            ', '.join(f'{n} duplicate {kind}s' for kind, n in totals.items())
+        ))
+
+    def merge(self, users, totals, options):
+        """Merge the duplicates of `users`, on the active shard."""
+        dry_run = options['dry_run']
+        last_id = 0
+        while True:
+            batch = list(
+                users.filter(id__gt=last_id)
+                .values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            with sharding.atomic(), sharding.connection.cursor() as cursor:
+                touched = set()
+                for kind in dedupe.NAME_TABLES:
+                    merged, user_ids = dedupe.merge_user_range(
+                        cursor, kind, batch[0], batch[-1], dry_run=dry_run,
+                    )
+                    totals[kind] += merged
+                    touched.update(user_ids)
+                if not dry_run:
+                    stats.rebuild(touched)
+                    stats.links_changed(touched)
+            last_id = batch[-1]
+            self.stdout.write(
+                f'Users up to {last_id}: ' +
+                ', '.join(f'{n} {kind}s' for kind, n in totals.items()),
+            )
+            if options['sleep']:
+                time.sleep(options['sleep'])
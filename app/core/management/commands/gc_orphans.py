@@ -0,0 +1,41 @@
+"""
+Django command to delete tags and ingredients not used by any recipe.
+"""
+from django.core.management.base import BaseCommand
+
+from core import orphans
+from core.dedupe import NAME_TABLES
+
+
+class Command(BaseCommand):
+    """Django command to garbage collect orphaned tags and ingredients."""
+    help = 'Delete tags and ingredients that no recipe links to.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(NAME_TABLES),
+                            action='append', dest='kinds',
+                            help='Only collect this kind (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows examined per transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the orphans.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        verb = 'Found' if options['dry_run'] else 'Deleted'
+        for kind in options['kinds'] or NAME_TABLES:
+            scanned, found = 0, 0
+            for scanned, found in orphans.collect(
+                kind,
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                sleep=options['sleep'],
+            ):
+                self.stdout.write(
+                    f'{kind}: scanned {scanned}, {verb.lower()} {found}',
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{verb} {found} orphaned {kind}s out of {scanned}',
+            ))
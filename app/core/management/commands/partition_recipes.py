@@ -0,0 +1,85 @@
+"""
+Django command to move existing recipes into the partitioned tables.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core import partitioning
+
+
+class Command(BaseCommand):
+    """Django command to partition the recipe tables online."""
+    help = ('Copy the recipes and their links into the partitioned tables '
+            'created by migration 0018, in batches while the API keeps '
+            'writing, then swap the tables. Writes wait for the swap only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', choices=settings.SHARDS,
+                            action='append', dest='databases',
+                            help='Only partition this shard (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows copied per transaction.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches.')
+        parser.add_argument('--max-passes', type=int, default=5,
+                            help='Catch-up passes before locking anyway.')
+        parser.add_argument('--lock-timeout', default='5s',
+                            help='Give up the swap if the tables are not '
+                                 'locked within this time.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        for alias in options['databases'] or settings.SHARDS:
+            with connections[alias].cursor() as cursor:
+                tables = [table for table in partitioning.TABLES
+                          if not partitioning.is_partitioned(cursor, table)]
+                if not tables:
+                    self.stdout.write(f'{alias}: already partitioned')
+                    continue
+                if len(tables) < len(partitioning.TABLES) or not all(
+                    partitioning.has_shadow(cursor, table)
+                    for table in tables
+                ):
+                    raise CommandError(
+                        f'{alias}: partitioned tables missing, run migrate.'
+                    )
+                self.partition(alias, cursor, options)
+
+    def partition(self, alias, cursor, options):
+        batch_size = options['batch_size']
+        # Rows left by an interrupted run.
+        partitioning.truncate_shadows(cursor)
+        since = partitioning.horizon(cursor)
+
+        for table in partitioning.TABLES:
+            after, copied = 0, 0
+            while True:
+                with transaction.atomic(using=alias):
+                    last_id, count = partitioning.copy_batch(
+                        cursor, table, after, batch_size,
+                    )
+                if not count:
+                    break
+                after, copied = last_id, copied + count
+                self.stdout.write(f'{alias}: {table}: copied {copied} rows')
+                time.sleep(options['sleep'])
+
+        for _ in range(options['max_passes']):
+            with transaction.atomic(using=alias):
+                horizon = partitioning.horizon(cursor)
+                count = partitioning.catch_up(cursor, since, batch_size)
+            since = horizon
+            self.stdout.write(f'{alias}: caught up on {count} recipes')
+            if count <= batch_size:
+                break
+
+        with transaction.atomic(using=alias):
+            partitioning.lock(cursor, options['lock_timeout'])
+            partitioning.catch_up(cursor, since, batch_size)
+            partitioning.swap(cursor)
+        for table in partitioning.TABLES:
+            cursor.execute(f'ANALYZE {table}')
+        self.stdout.write(self.style.SUCCESS(f'{alias}: partitioned'))
@@ -0,0 +1,189 @@
+"""
+Django command to profile process startup per module and app.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter, so nothing is imported already. Timing
+# wraps AppConfig.create (app module import), import_models and ready.
+PROBE = r'''
+import json, os, sys, time
+start = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+import django
+from django.apps import config
+
+apps = {}
+create = config.AppConfig.create.__func__
+
+
+def timed(label, key, func):
+    def wrapper(*args, **kwargs):
+        began = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            apps.setdefault(label, {})[key] = (
+                time.perf_counter() - began) * 1000
+    return wrapper
+
+
+def timed_create(cls, entry):
+    began = time.perf_counter()
+    app_config = create(cls, entry)
+    apps.setdefault(app_config.label, {})['import'] = (
+        time.perf_counter() - began) * 1000
+    app_config.import_models = timed(
+        app_config.label, 'models', app_config.import_models)
+    app_config.ready = timed(app_config.label, 'ready', app_config.ready)
+    return app_config
+
+
+config.AppConfig.create = classmethod(timed_create)
+phases = {}
+began = time.perf_counter()
+django.setup()
+phases['setup'] = (time.perf_counter() - began) * 1000
+
+from django.core.handlers.wsgi import WSGIHandler
+began = time.perf_counter()
+WSGIHandler()
+phases['middleware'] = (time.perf_counter() - began) * 1000
+
+from django.urls import get_resolver
+began = time.perf_counter()
+get_resolver().url_patterns
+phases['urlconf'] = (time.perf_counter() - began) * 1000
+
+phases['total'] = (time.perf_counter() - start) * 1000
+print(json.dumps({'apps': apps, 'phases': phases,
+                  'modules': len(sys.modules)}))
+'''
+
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+class Command(BaseCommand):
+    """Django command to report import and app-ready times."""
+    help = ('Boot Django in fresh interpreters and report where startup '
+            'time goes, per settings profile.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', action='append', dest='profiles',
+            help='Settings module to profile (repeatable). Defaults to '
+                 'the current settings.',
+        )
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Boots per profile; medians are reported.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of packages to list.')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        profiles = options['profiles'] or [
+            os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings'),
+        ]
+        report = {
+            profile: self.profile(profile, max(options['repeat'], 1))
+            for profile in profiles
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for profile, result in report.items():
+            self.write_profile(profile, result, options['top'])
+        if len(report) > 1:
+            base, *others = profiles
+            for other in others:
+                saved = (report[base]['phases']['total'] -
+                         report[other]['phases']['total'])
+                share = abs(saved) / report[base]['phases']['total']
+                if saved >= 0:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{other} boots {saved:.1f} ms faster than {base} '
+                        f'({share:.0%})'
+                    ))
+                else:
+                    self.stdout.write(self.style.WARNING(
+                        f'{other} boots {-saved:.1f} ms slower than {base} '
+                        f'({share:.0%})'
+                    ))
+
+    def boot(self, profile):
+        """Boot Django once; return the probe result and import times."""
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, profile],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode:
+            raise CommandError(f'Booting {profile} failed:\n{proc.stderr}')
+
+        packages = defaultdict(float)
+        for line in proc.stderr.splitlines():
+            match = IMPORT_TIME_RE.match(line)
+            if match:
+                packages[match.group(4).split('.')[0]] += \
+                    int(match.group(1)) / 1000
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result['packages'] = packages
+        return result
+
+    def profile(self, profile, repeat):
+        """Boot `repeat` times and return the median of every timing."""
+        runs = [self.boot(profile) for _ in range(repeat)]
+
+        def median(values):
+            return round(statistics.median(values), 2)
+
+        apps = {}
+        for label in runs[0]['apps']:
+            apps[label] = {
+                key: median([run['apps'][label].get(key, 0) for run in runs])
+                for key in ('import', 'models', 'ready')
+            }
+        packages = {
+            name: median([run['packages'].get(name, 0) for run in runs])
+            for name in runs[0]['packages']
+        }
+        return {
+            'phases': {
+                key: median([run['phases'][key] for run in runs])
+                for key in runs[0]['phases']
+            },
+            'apps': apps,
+            'packages': dict(
+                sorted(packages.items(), key=lambda item: -item[1]),
+            ),
+            'modules': runs[0]['modules'],
+        }
+
+    def write_profile(self, profile, result, top):
+        self.stdout.write(self.style.MIGRATE_HEADING(profile))
+        phases = ', '.join(
+            f'{key} {value:.1f} ms' for key, value in result['phases'].items()
+        )
+        self.stdout.write(f'  {phases}; {result["modules"]} modules loaded')
+        self.stdout.write(f'  {"app":<20}{"import":>10}{"models":>10}'
+                          f'{"ready":>10}  (ms)')
+        for label, times in result['apps'].items():
+            self.stdout.write(
+                f'  {label:<20}{times["import"]:>10.1f}'
+                f'{times["models"]:>10.1f}{times["ready"]:>10.1f}'
+            )
+        self.stdout.write(f'  {"package":<30}{"self import ms":>15}')
+        for name, ms in list(result['packages'].items())[:top]:
+            self.stdout.write(f'  {name:<30}{ms:>15.1f}')
@@ -0,0 +1,70 @@
+"""
+Django command to move users to the shard the hash ring assigns them.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+from core.rebalance import Move
+
+
+class Command(BaseCommand):
+    """Django command to move users between shards online."""
+    help = ('Move users whose shard differs from their place on the hash '
+            'ring (SHARD_RING), or the given users, while they keep using '
+            'the API. Run one rebalance at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only move this user id.')
+        parser.add_argument('--to', dest='target', choices=settings.SHARDS,
+                            help='Move the given users to this shard '
+                                 'instead of their place on the ring.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows copied per transaction.')
+        parser.add_argument('--grace', type=float, default=10,
+                            help='Seconds reads may still use the old shard '
+                                 'before its rows are deleted.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the users to move.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        if options['target'] and not options['users']:
+            raise CommandError('--to needs --user.')
+        users = get_user_model().objects.filter(
+            is_active=True, shard_locked=False,
+        ).order_by('id')
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+
+        moves = []
+        for user in users.only('id', 'shard').iterator():
+            target = options['target'] or sharding.placement(user.pk)
+            if target != sharding.shard_for(user):
+                moves.append((user, target))
+
+        if options['dry_run']:
+            counts = Counter(
+                (sharding.shard_for(user), target) for user, target in moves
+            )
+            for (source, target), count in sorted(counts.items()):
+                self.stdout.write(f'{source} -> {target}: {count} users')
+            self.stdout.write(self.style.SUCCESS(
+                f'Found {len(moves)} users to move',
+            ))
+            return
+
+        for user, target in moves:
+            move = Move(user, target, batch_size=options['batch_size'],
+                        grace=options['grace'])
+            source = move.source
+            copied = move.run()
+            self.stdout.write(
+                f'User {user.pk}: {source} -> {target}, {copied} rows in '
+                f'{move.passes} passes',
+            )
+        self.stdout.write(self.style.SUCCESS(f'Moved {len(moves)} users'))
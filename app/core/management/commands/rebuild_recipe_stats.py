@@ -0,0 +1,44 @@
+"""
+Django command to recompute per-user recipe statistics in bulk.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from core import sharding, stats
+
+
+class Command(BaseCommand):
+    """Django command to rebuild RecipeStats and TagStats."""
+    help = 'Recompute recipe and tag statistics from the recipe tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only rebuild this user id.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        users = get_user_model().objects.order_by('id')
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+
+        total = 0
+        for alias in settings.SHARDS:
+            shard_users = users.filter(sharding.users_on(alias))
+            last_id = 0
+            with sharding.use_shard(alias):
+                while True:
+                    batch = list(
+                        shard_users.filter(id__gt=last_id)
+                        .values_list('id', flat=True)[:options['batch_size']]
+                    )
+                    if not batch:
+                        break
+                    with sharding.atomic():
+                        stats.rebuild(batch)
+                    last_id = batch[-1]
+                    total += len(batch)
+                    self.stdout.write(f'Rebuilt statistics for {total} users')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} users rebuilt'))
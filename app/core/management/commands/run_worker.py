@@ -0,0 +1,138 @@
+"""
+Django command to process background jobs.
+"""
+import os
+import signal
+import socket
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    """Django command to run background job worker threads."""
+    help = 'Claim and run queued jobs from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of worker threads.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained.')
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help='Exit after running this many jobs.')
+        parser.add_argument('--heartbeat', type=float,
+                            default=settings.JOB_HEARTBEAT_INTERVAL,
+                            help='Seconds between refreshes of the lock '
+                                 'of a running job.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        jobs.autodiscover()
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.remaining = options['max_jobs']
+        self.processed = 0
+
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                handlers[signum] = signal.signal(
+                    signum, lambda *_: self.stop.set(),
+                )
+
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f'Worker {prefix} started with {concurrency} '
+                          f'thread(s)')
+
+        try:
+            if concurrency == 1:
+                self.work(f'{prefix}:0', options)
+            else:
+                threads = [
+                    threading.Thread(
+                        target=self.work,
+                        args=(f'{prefix}:{i}', options),
+                        daemon=True,
+                    )
+                    for i in range(concurrency)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(f'Worker {prefix} processed {self.processed} '
+                          f'job(s)')
+
+    def take_slot(self):
+        """Reserve one job from the --max-jobs allowance."""
+        with self.lock:
+            if self.remaining is None:
+                return True
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def work(self, worker_id, options):
+        """Claim and run jobs until stopped."""
+        try:
+            while not self.stop.is_set():
+                if not self.take_slot():
+                    return
+                job_obj = jobs.claim(worker_id)
+                if job_obj is None:
+                    with self.lock:
+                        if self.remaining is not None:
+                            self.remaining += 1
+                    if options['once']:
+                        return
+                    jobs.requeue_stale()
+                    self.stop.wait(options['poll_interval'])
+                    continue
+
+                with self.heartbeat(job_obj, options['heartbeat']):
+                    job_obj = jobs.run(job_obj)
+                with self.lock:
+                    self.processed += 1
+                self.stdout.write(f'{worker_id} {job_obj}')
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    @contextmanager
+    def heartbeat(self, job_obj, interval):
+        """Refresh the job's lock every `interval` seconds in the block.
+
+        Keeps jobs that run longer than JOB_STALE_TIMEOUT without reporting
+        progress from being requeued while they still run.
+        """
+        done = threading.Event()
+        job_id, worker_id = job_obj.pk, job_obj.locked_by
+
+        def beat():
+            try:
+                while not done.wait(interval):
+                    if not jobs.heartbeat(job_id, worker_id):
+                        return
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
@@ -0,0 +1,287 @@
+"""
+Django command to generate a large synthetic dataset for profiling.
+"""
+import math
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from faker import Faker
+
+from core import seeding, sharding, stats
+from core.models import (
+    Recipe,
+    Tag,
+    Ingredient,
+)
+
+SEED_DOMAIN = 'seed.example.com'
+SEED_PASSWORD = 'seed-pass-123'
+
+TAG_WORDS = [
+    'Vegan', 'Vegetarian', 'Dessert', 'Breakfast', 'Lunch', 'Dinner',
+    'Quick', 'Healthy', 'Comfort Food', 'Gluten Free', 'Spicy', 'Italian',
+    'Mexican', 'Indian', 'Thai', 'Japanese', 'Chinese', 'French', 'Baking',
+    'Grill', 'Soup', 'Salad', 'Snack', 'Party', 'Kids', 'Low Carb', 'Keto',
+    'Budget', 'Holiday', 'Summer', 'Winter', 'One Pot', 'Slow Cooker',
+    'Seafood', 'Meal Prep', 'Brunch', 'Street Food', 'High Protein',
+]
+INGREDIENT_WORDS = [
+    'Salt', 'Pepper', 'Olive Oil', 'Garlic', 'Onion', 'Butter', 'Flour',
+    'Sugar', 'Egg', 'Milk', 'Tomato', 'Rice', 'Chicken', 'Beef', 'Pork',
+    'Potato', 'Carrot', 'Lemon', 'Lime', 'Ginger', 'Soy Sauce', 'Basil',
+    'Parsley', 'Cilantro', 'Cumin', 'Paprika', 'Cheese', 'Cream', 'Yogurt',
+    'Honey', 'Vinegar', 'Mushroom', 'Spinach', 'Kale', 'Bell Pepper',
+    'Chili', 'Coconut Milk', 'Pasta', 'Bread', 'Salmon', 'Shrimp', 'Tofu',
+    'Beans', 'Lentils', 'Corn', 'Avocado', 'Cinnamon', 'Vanilla', 'Oats',
+]
+DISH_WORDS = [
+    'Stew', 'Curry', 'Pie', 'Bowl', 'Bake', 'Salad', 'Soup', 'Tacos',
+    'Skillet', 'Roast', 'Stir Fry', 'Risotto', 'Pasta', 'Cake', 'Wrap',
+]
+
+
+def zipf_weights(size, exponent):
+    """Return Zipf weights so a few words are popular and many are rare."""
+    return [1 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+class DataGenerator:
+    """Deterministic generator of users, tags, ingredients and recipes."""
+
+    def __init__(self, seed, vocabulary_size=200, zipf_exponent=1.1):
+        self.rng = random.Random(seed)
+        self.faker = Faker()
+        self.faker.seed_instance(seed)
+        self.tag_vocabulary = self._vocabulary(TAG_WORDS, vocabulary_size)
+        self.ingredient_vocabulary = self._vocabulary(
+            INGREDIENT_WORDS, vocabulary_size,
+        )
+        self.vocabulary_weights = zipf_weights(vocabulary_size, zipf_exponent)
+
+    def _vocabulary(self, words, size):
+        """Pad the curated words with a long tail of generated ones."""
+        vocabulary = list(words)
+        seen = set(w.lower() for w in vocabulary)
+        while len(vocabulary) < size:
+            word = self.faker.word().title()
+            if word.lower() in seen:
+                word = f'{word} {self.faker.word().title()}'
+            if word.lower() not in seen:
+                seen.add(word.lower())
+                vocabulary.append(word)
+        return vocabulary[:size]
+
+    def sample_words(self, vocabulary, count):
+        """Sample distinct words with a Zipf skew towards the top ranks."""
+        count = min(count, len(vocabulary))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.rng.choices(
+                range(len(vocabulary)),
+                weights=self.vocabulary_weights,
+                k=count - len(chosen),
+            ))
+        return [vocabulary[i] for i in sorted(chosen)]
+
+    def recipe_count(self, mean):
+        """Return a Pareto skewed recipe count with the given mean."""
+        alpha = 1.5
+        scale = mean * (alpha - 1) / alpha
+        return max(int(scale * self.rng.paretovariate(alpha)), 0)
+
+    def tags_per_recipe(self, available):
+        """Return a small, mostly 1-4, number of tags for a recipe."""
+        count = self.rng.choices(
+            range(9), weights=[5, 20, 28, 22, 12, 6, 4, 2, 1],
+        )[0]
+        return min(count, available)
+
+    def price(self):
+        """Return a right skewed price: cheap is common, pricey is rare."""
+        value = math.exp(self.rng.gauss(2.3, 0.7))
+        return Decimal(min(max(value, 0.5), 999.99)).quantize(Decimal('0.01'))
+
+    def time_minutes(self):
+        """Return a right skewed preparation time in minutes."""
+        return min(max(int(math.exp(self.rng.gauss(3.3, 0.6))), 1), 600)
+
+    def title(self, ingredients):
+        """Return a plausible recipe title built from its ingredients."""
+        main = self.rng.choice(ingredients) if ingredients else 'House'
+        return (
+            f'{self.faker.word().title()} {main} '
+            f'{self.rng.choice(DISH_WORDS)}'
+        )
+
+
+class Command(BaseCommand):
+    """Django command to seed realistic synthetic data in bulk."""
+    help = (
+        'Generate users, tags, ingredients and recipes in bulk. '
+        'Scale 1 is roughly 100 users and 10k recipes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--users-per-scale', type=int, default=100)
+        parser.add_argument('--recipes-per-user', type=int, default=100,
+                            help='Mean recipes per user (Pareto skewed).')
+        parser.add_argument('--tags-per-user', type=int, default=25)
+        parser.add_argument('--ingredients-per-user', type=int, default=60)
+        parser.add_argument('--vocabulary-size', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--chunk-users', type=int, default=50,
+                            help='Users generated per transaction.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete previously seeded users first.')
+
+    def handle(self, *args, **options):
+        """Entry point for command"""
+        users = get_user_model().objects.filter(
+            email__endswith=f'@{SEED_DOMAIN}',
+        )
+        if options['clear']:
+            seeding.delete_users(users)
+        elif users.exists():
+            raise CommandError(
+                'Seeded users already exist, pass --clear to replace them.'
+            )
+
+        generator = DataGenerator(
+            options['seed'],
+            vocabulary_size=options['vocabulary_size'],
+        )
+        password = make_password(SEED_PASSWORD)
+        user_count = max(int(options['users_per_scale'] * options['scale']),
+                         1)
+        chunk = max(options['chunk_users'], 1)
+
+        start = time.perf_counter()
+        totals = {'users': 0, 'recipes': 0, 'tags': 0,
+                  'ingredients': 0, 'recipe_tags': 0,
+                  'recipe_ingredients': 0}
+        for offset in range(0, user_count, chunk):
+            indexes = range(offset, min(offset + chunk, user_count))
+            with transaction.atomic():
+                counts = self.seed_users(
+                    generator, indexes, password, options,
+                )
+            for key, value in counts.items():
+                totals[key] += value
+            self.stdout.write(
+                f"{totals['users']}/{user_count} users, "
+                f"{totals['recipes']} recipes "
+                f'({time.perf_counter() - start:.1f}s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{k}={v}' for k, v in totals.items())
+            + f' in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def seed_users(self, generator, indexes, password, options):
+        """Generate and bulk insert one chunk of users with their data.
+
+        Users are placed like new ones and their data is inserted on
+        their shard.
+        """
+        batch_size = options['batch_size']
+        seed = options['seed']
+        by_shard = seeding.create_users(
+            [
+                get_user_model()(
+                    email=f'seed-{seed}-{i}@{SEED_DOMAIN}',
+                    name=generator.faker.name(),
+                    password=password,
+                )
+                for i in indexes
+            ],
+            batch_size=batch_size,
+        )
+
+        counts = {'users': len(indexes)}
+        for alias, shard_users in by_shard.items():
+            with sharding.use_shard(alias), sharding.atomic():
+                for key, value in self.seed_data(
+                        generator, shard_users, options).items():
+                    counts[key] = counts.get(key, 0) + value
+        return counts
+
+    def seed_data(self, generator, users, options):
+        """Bulk insert the data of `users` on the active shard."""
+        batch_size = options['batch_size']
+        tags, ingredients, recipes = [], [], []
+        for user in users:
+            tag_names = generator.sample_words(
+                generator.tag_vocabulary,
+                generator.rng.randint(1, options['tags_per_user'] * 2),
+            )
+            ingredient_names = generator.sample_words(
+                generator.ingredient_vocabulary,
+                generator.rng.randint(1, options['ingredients_per_user'] * 2),
+            )
+            tags.extend(Tag(user=user, name=n) for n in tag_names)
+            ingredients.extend(
+                Ingredient(user=user, name=n) for n in ingredient_names
+            )
+            for _ in range(generator.recipe_count(
+                    options['recipes_per_user'])):
+                recipes.append(Recipe(
+                    user=user,
+                    title=generator.title(ingredient_names),
+                    description=generator.faker.sentence(),
+                    time_minutes=generator.time_minutes(),
+                    price=generator.price(),
+                ))
+
+        tags = Tag.objects.bulk_create(tags, batch_size=batch_size)
+        ingredients = Ingredient.objects.bulk_create(
+            ingredients, batch_size=batch_size,
+        )
+        recipes = Recipe.objects.bulk_create(recipes, batch_size=batch_size)
+
+        tags_by_user, ingredients_by_user = {}, {}
+        for tag in tags:
+            tags_by_user.setdefault(tag.user_id, []).append(tag.id)
+        for ingredient in ingredients:
+            ingredients_by_user.setdefault(
+                ingredient.user_id, []).append(ingredient.id)
+
+        recipe_tags, recipe_ingredients = [], []
+        for recipe in recipes:
+            user_tags = tags_by_user[recipe.user_id]
+            for tag_id in generator.rng.sample(
+                    user_tags, generator.tags_per_recipe(len(user_tags))):
+                recipe_tags.append(Recipe.tags.through(
+                    recipe_id=recipe.id, tag_id=tag_id, user_id=recipe.user_id,
+                ))
+            user_ingredients = ingredients_by_user[recipe.user_id]
+            count = min(generator.rng.randint(3, 12), len(user_ingredients))
+            for ingredient_id in generator.rng.sample(
+                    user_ingredients, count):
+                recipe_ingredients.append(Recipe.ingredients.through(
+                    recipe_id=recipe.id, ingredient_id=ingredient_id,
+                    user_id=recipe.user_id,
+                ))
+
+        Recipe.tags.through.objects.bulk_create(
+            recipe_tags, batch_size=batch_size,
+        )
+        Recipe.ingredients.through.objects.bulk_create(
+            recipe_ingredients, batch_size=batch_size,
+        )
+        stats.rebuild(user.id for user in users)
+        return {
+            'recipes': len(recipes),
+            'tags': len(tags),
+            'ingredients': len(ingredients),
+            'recipe_tags': len(recipe_tags),
+            'recipe_ingredients': len(recipe_ingredients),
+        }
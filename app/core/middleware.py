@@ -0,0 +1,157 @@
+"""
+Negotiated response compression.
+
+``CompressionMiddleware`` replaces Django's ``GZipMiddleware``: it also
+speaks brotli (when the ``brotli`` package is installed), leaves bodies
+under ``COMPRESSION_MIN_SIZE`` bytes alone, only compresses text-like
+content types and compresses streaming responses chunk by chunk, flushing
+after every chunk so streamed events are not held back.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/vnd.oai.openapi',
+    'image/svg+xml',
+)
+
+ACCEPT_ENCODING_RE = _lazy_re_compile(
+    r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*(?:,|$)',
+)
+
+
+def accepted_encodings(header):
+    """Return the codings of an ``Accept-Encoding`` header with their q.
+    """
+    accepted = {}
+    for coding, quality in ACCEPT_ENCODING_RE.findall(header or ''):
+        try:
+            accepted[coding.lower()] = float(quality) if quality else 1.0
+        except ValueError:
+            continue
+    return accepted
+
+
+class GzipCoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer around the stream.
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+    def feed(self, data):
+        return self._compressor.compress(data) + \
+            self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.finish()
+
+    def feed(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def coders():
+    """Return the available coders by preference, with their level."""
+    available = []
+    quality = settings.COMPRESSION_BROTLI_QUALITY
+    if brotli is not None and quality is not None:
+        available.append((BrotliCoder, quality))
+    if settings.COMPRESSION_GZIP_LEVEL is not None:
+        available.append((GzipCoder, settings.COMPRESSION_GZIP_LEVEL))
+    return available
+
+
+def negotiate(header):
+    """Return a coder for the best coding the client accepts, or None."""
+    accepted = accepted_encodings(header)
+    best, best_quality = None, 0
+    for coder, level in coders():
+        quality = accepted.get(coder.name, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = coder(level), quality
+    return best
+
+
+class CompressionMiddleware:
+    """Compress responses with the best coding the client accepts."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.is_compressible(response):
+            return response
+
+        # The response differs by Accept-Encoding from here on, even if
+        # this request does not get it compressed.
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coder = negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if coder is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(
+                coder, response.streaming_content,
+            )
+            del response['Content-Length']
+        else:
+            compressed = coder.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The representation changed, so a strong validator no longer holds.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = coder.name
+        return response
+
+    @staticmethod
+    def is_compressible(response):
+        if response.has_header('Content-Encoding'):
+            return False
+        content_type = response.get('Content-Type', '').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        if response.streaming:
+            return True
+        return len(response.content) >= settings.COMPRESSION_MIN_SIZE
+
+    @staticmethod
+    def compress_stream(coder, chunks):
+        for chunk in chunks:
+            data = coder.feed(chunk)
+            if data:
+                yield data
+        yield coder.finish()
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:13
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=core.models.recipe_image_file_path),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BACKFILL_SQL = """
+INSERT INTO core_recipestats (
+    user_id, recipe_count, price_sum, price_min, price_max,
+    time_minutes_sum, time_minutes_min, time_minutes_max
+)
+SELECT user_id, COUNT(*), SUM(price), MIN(price), MAX(price),
+       SUM(time_minutes), MIN(time_minutes), MAX(time_minutes)
+FROM core_recipe GROUP BY user_id;
+
+INSERT INTO core_tagstats (tag_id, user_id, recipe_count)
+SELECT t.id, t.user_id, COUNT(*)
+FROM core_tag t JOIN core_recipe_tags rt ON rt.tag_id = t.id
+GROUP BY t.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to='core.user')),
+                ('recipe_count', models.IntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('price_min', models.DecimalField(decimal_places=2, max_digits=5, null=True)),
+                ('price_max', models.DecimalField(decimal_places=2, max_digits=5, null=True)),
+                ('time_minutes_sum', models.BigIntegerField(default=0)),
+                ('time_minutes_min', models.IntegerField(null=True)),
+                ('time_minutes_max', models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TagStats',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='core.tag')),
+                ('recipe_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'price'], name='core_recipe_user_id_72b3b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'time_minutes'], name='core_recipe_user_id_ca9f7e_idx'),
+        ),
+        migrations.AddField(
+            model_name='tagstats',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tagstats',
+            index=models.Index(fields=['user', '-recipe_count'], name='core_tagsta_user_id_037a0a_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,161 @@
+from django.db import migrations, transaction
+
+USER_BATCH_SIZE = 1000
+
+# The SQL of core.dedupe and core.stats as of this migration; those
+# modules follow the current schema.
+NAME_TABLES = {
+    'tag': {
+        'table': 'core_tag',
+        'through': 'core_recipe_tags',
+        'column': 'tag_id',
+        'stats': 'core_tagstats',
+    },
+    'ingredient': {
+        'table': 'core_ingredient',
+        'through': 'core_recipe_ingredients',
+        'column': 'ingredient_id',
+        'stats': None,
+    },
+}
+
+NORMALIZED_NAME_SQL = "regexp_replace(btrim(name), '\\s+', ' ', 'g')"
+
+NORMALIZE_SQL = """
+UPDATE {table} SET name = """ + NORMALIZED_NAME_SQL + """
+WHERE user_id >= %(first)s AND user_id <= %(last)s
+  AND name <> """ + NORMALIZED_NAME_SQL
+
+DUPLICATES_SQL = """
+SELECT user_id, survivor, duplicate FROM (
+    SELECT user_id, id AS duplicate,
+           MIN(id) OVER (
+               PARTITION BY user_id, lower(""" + NORMALIZED_NAME_SQL + """)
+           ) AS survivor
+    FROM {table}
+    WHERE user_id >= %(first)s AND user_id <= %(last)s
+) groups
+WHERE survivor <> duplicate
+"""
+
+REPOINT_SQL = """
+INSERT INTO {through} (recipe_id, {column})
+SELECT rt.recipe_id, m.survivor
+FROM {through} rt
+JOIN unnest(%(duplicates)s::bigint[], %(survivors)s::bigint[])
+    AS m(duplicate, survivor) ON rt.{column} = m.duplicate
+ON CONFLICT (recipe_id, {column}) DO NOTHING
+"""
+
+DELETE_LINKS_SQL = """
+DELETE FROM {through} WHERE {column} = ANY(%(duplicates)s::bigint[])
+"""
+
+DELETE_STATS_SQL = """
+DELETE FROM {stats} WHERE tag_id = ANY(%(duplicates)s::bigint[])
+"""
+
+DELETE_DUPLICATES_SQL = """
+DELETE FROM {table} WHERE id = ANY(%(duplicates)s::bigint[])
+"""
+
+REBUILD_RECIPE_SQL = """
+INSERT INTO core_recipestats AS s (
+    user_id, recipe_count, price_sum, price_min, price_max,
+    time_minutes_sum, time_minutes_min, time_minutes_max
+)
+SELECT u.id, COUNT(r.id), COALESCE(SUM(r.price), 0), MIN(r.price),
+       MAX(r.price), COALESCE(SUM(r.time_minutes), 0),
+       MIN(r.time_minutes), MAX(r.time_minutes)
+FROM core_user u LEFT JOIN core_recipe r ON r.user_id = u.id
+WHERE u.id = ANY(%(ids)s::bigint[])
+GROUP BY u.id
+ON CONFLICT (user_id) DO UPDATE SET
+    recipe_count = EXCLUDED.recipe_count,
+    price_sum = EXCLUDED.price_sum,
+    price_min = EXCLUDED.price_min,
+    price_max = EXCLUDED.price_max,
+    time_minutes_sum = EXCLUDED.time_minutes_sum,
+    time_minutes_min = EXCLUDED.time_minutes_min,
+    time_minutes_max = EXCLUDED.time_minutes_max
+"""
+
+REBUILD_TAGS_SQL = """
+INSERT INTO core_tagstats AS s (tag_id, user_id, recipe_count)
+SELECT t.id, t.user_id, COUNT(rt.id)
+FROM core_tag t LEFT JOIN core_recipe_tags rt ON rt.tag_id = t.id
+WHERE t.user_id = ANY(%(ids)s::bigint[])
+GROUP BY t.id
+ON CONFLICT (tag_id) DO UPDATE SET recipe_count = EXCLUDED.recipe_count
+"""
+
+
+def merge_user_range(cursor, tables, first, last):
+    """Merge the names of users ``first`` to ``last``; return the users
+    that had duplicates."""
+    bounds = {'first': first, 'last': last}
+    cursor.execute(DUPLICATES_SQL.format(**tables), bounds)
+    rows = cursor.fetchall()
+    if rows:
+        params = {
+            'duplicates': [row[2] for row in rows],
+            'survivors': [row[1] for row in rows],
+        }
+        cursor.execute(REPOINT_SQL.format(**tables), params)
+        cursor.execute(DELETE_LINKS_SQL.format(**tables), params)
+        if tables['stats']:
+            cursor.execute(DELETE_STATS_SQL.format(**tables), params)
+        cursor.execute(DELETE_DUPLICATES_SQL.format(**tables), params)
+    # Survivors are normalized last, once nothing else shares their name.
+    cursor.execute(NORMALIZE_SQL.format(**tables), bounds)
+    return {row[0] for row in rows}
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge existing duplicates so the unique indexes can be built.
+
+    Large installations should run ``manage.py dedupe_names`` before
+    migrating, which leaves nothing to do here.
+    """
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT id FROM core_user ORDER BY id')
+        user_ids = [row[0] for row in cursor.fetchall()]
+    for start in range(0, len(user_ids), USER_BATCH_SIZE):
+        batch = user_ids[start:start + USER_BATCH_SIZE]
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                touched = set()
+                for tables in NAME_TABLES.values():
+                    touched |= merge_user_range(
+                        cursor, tables, batch[0], batch[-1],
+                    )
+                if touched:
+                    params = {'ids': sorted(touched)}
+                    cursor.execute(REBUILD_RECIPE_SQL, params)
+                    cursor.execute(REBUILD_TAGS_SQL, params)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_recipe_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+            'core_tag_user_lower_name_uniq ON core_tag (user_id, lower(name))',
+            'DROP INDEX CONCURRENTLY IF EXISTS core_tag_user_lower_name_uniq',
+        ),
+        migrations.RunSQL(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+            'core_ingredient_user_lower_name_uniq '
+            'ON core_ingredient (user_id, lower(name))',
+            'DROP INDEX CONCURRENTLY IF EXISTS '
+            'core_ingredient_user_lower_name_uniq',
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+# The admin searches with istartswith, which Django compiles to
+# UPPER(column) LIKE UPPER('term%'). Django 3.2 can not declare an
+# operator class on an expression index, hence the raw SQL.
+SEARCH_INDEXES = [
+    ('core_recipe_upper_title_like', 'core_recipe', 'title'),
+    ('core_tag_upper_name_like', 'core_tag', 'name'),
+    ('core_ingredient_upper_name_like', 'core_ingredient', 'name'),
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_unique_names'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} (UPPER({column}) text_pattern_ops)',
+            f'DROP INDEX CONCURRENTLY IF EXISTS {name}',
+        )
+        for name, table, column in SEARCH_INDEXES
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipestats',
+            name='links_version',
+            field=models.BigIntegerField(default=0),
+        ),
+        # core.stats inserts rows with raw SQL that does not list the
+        # column, so it keeps a database default.
+        migrations.RunSQL(
+            'ALTER TABLE core_recipestats '
+            'ALTER COLUMN links_version SET DEFAULT 0',
+            'ALTER TABLE core_recipestats '
+            'ALTER COLUMN links_version DROP DEFAULT',
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# Autocomplete matches lower(name) LIKE 'prefix%' within one user. The
+# unique (user_id, lower(name)) indexes use the database collation, which
+# LIKE can not use unless it is C; text_pattern_ops compares bytes.
+PREFIX_INDEXES = [
+    ('core_tag_user_lower_name_like', 'core_tag'),
+    ('core_ingredient_user_lower_name_like', 'core_ingredient'),
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0012_recipestats_links_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+            f'ON {table} (user_id, lower(name) text_pattern_ops)',
+            f'DROP INDEX CONCURRENTLY IF EXISTS {name}',
+        )
+        for name, table in PREFIX_INDEXES
+    ]
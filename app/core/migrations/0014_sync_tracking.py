@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+SYNCED_TABLES = [
+    ('core_recipe', 'recipe'),
+    ('core_tag', 'tag'),
+    ('core_ingredient', 'ingredient'),
+]
+
+# Rows remember the transaction that last wrote them, whatever wrote them
+# (the ORM, raw SQL in core.bulk and core.dedupe, the admin). Deletes of
+# an active user's rows leave tombstones, one INSERT per statement.
+FUNCTIONS_SQL = """
+CREATE FUNCTION core_track_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE FUNCTION core_write_tombstones() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO core_tombstone (
+        user_id, kind, object_id, change_xid, deleted_at
+    )
+    SELECT d.user_id, TG_ARGV[0], d.id,
+           pg_current_xact_id()::text::bigint, now()
+    FROM deleted d JOIN core_user u ON u.id = d.user_id
+    WHERE u.is_active;
+    RETURN NULL;
+END
+$$;
+"""
+
+DROP_FUNCTIONS_SQL = """
+DROP FUNCTION core_track_change();
+DROP FUNCTION core_write_tombstones();
+"""
+
+# Raw INSERTs (NamedObjectManager, core.bulk) do not list these columns.
+TABLE_SQL = """
+ALTER TABLE {table}
+    ALTER COLUMN created_at SET DEFAULT now(),
+    ALTER COLUMN updated_at SET DEFAULT now(),
+    ALTER COLUMN change_xid SET DEFAULT 0;
+
+CREATE TRIGGER {table}_track_change
+BEFORE INSERT OR UPDATE ON {table}
+FOR EACH ROW EXECUTE FUNCTION core_track_change();
+
+CREATE TRIGGER {table}_tombstones
+AFTER DELETE ON {table}
+REFERENCING OLD TABLE AS deleted
+FOR EACH STATEMENT EXECUTE FUNCTION core_write_tombstones('{kind}');
+"""
+
+DROP_TABLE_SQL = """
+DROP TRIGGER {table}_track_change ON {table};
+DROP TRIGGER {table}_tombstones ON {table};
+"""
+
+
+def timestamps(model_name):
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name='created_at',
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now,
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name=model_name,
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name=model_name,
+            name='change_xid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_name_prefix_indexes'),
+    ]
+
+    operations = [
+        *timestamps('recipe'),
+        *timestamps('tag'),
+        *timestamps('ingredient'),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'Recipe'), ('tag', 'Tag'), ('ingredient', 'Ingredient')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('change_xid', models.BigIntegerField(default=0)),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['user', 'change_xid', 'id'], name='tombstone_user_change_idx'),
+                    models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+                ],
+            },
+        ),
+        migrations.RunSQL(FUNCTIONS_SQL, DROP_FUNCTIONS_SQL),
+        *[
+            migrations.RunSQL(
+                TABLE_SQL.format(table=table, kind=kind),
+                DROP_TABLE_SQL.format(table=table),
+            )
+            for table, kind in SYNCED_TABLES
+        ],
+    ]
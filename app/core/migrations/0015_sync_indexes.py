@@ -0,0 +1,26 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0014_sync_tracking'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'change_xid', 'id'], name='recipe_user_change_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='tag',
+            index=models.Index(fields=['user', 'change_xid', 'id'], name='tag_user_change_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'change_xid', 'id'], name='ingredient_user_change_idx'),
+        ),
+    ]
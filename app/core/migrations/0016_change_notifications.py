@@ -0,0 +1,79 @@
+from django.db import migrations
+
+SYNCED_TABLES = [
+    ('core_recipe', 'recipe'),
+    ('core_tag', 'tag'),
+    ('core_ingredient', 'ingredient'),
+]
+
+# One notification per user and up to 200 changed rows of a statement, so
+# set-based writes stay cheap and payloads stay under the 8000 byte limit.
+# NOTIFY is delivered on commit, and not at all on rollback.
+FUNCTION_SQL = """
+CREATE FUNCTION core_notify_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    FOR payload IN
+        SELECT json_build_object(
+            'user', user_id, 'kind', TG_ARGV[0], 'action', TG_ARGV[1],
+            'ids', json_agg(id ORDER BY id)
+        )::text
+        FROM (
+            SELECT user_id, id,
+                   (row_number() OVER (PARTITION BY user_id ORDER BY id)
+                    - 1) / 200 AS chunk
+            FROM changed
+        ) numbered
+        GROUP BY user_id, chunk
+    LOOP
+        PERFORM pg_notify('core_changes', payload);
+    END LOOP;
+    RETURN NULL;
+END
+$$;
+"""
+
+DROP_FUNCTION_SQL = 'DROP FUNCTION core_notify_changes();'
+
+TABLE_SQL = """
+CREATE TRIGGER {table}_notify_insert
+AFTER INSERT ON {table}
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION core_notify_changes('{kind}', 'created');
+
+CREATE TRIGGER {table}_notify_update
+AFTER UPDATE ON {table}
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION core_notify_changes('{kind}', 'updated');
+
+CREATE TRIGGER {table}_notify_delete
+AFTER DELETE ON {table}
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION core_notify_changes('{kind}', 'deleted');
+"""
+
+DROP_TABLE_SQL = """
+DROP TRIGGER {table}_notify_insert ON {table};
+DROP TRIGGER {table}_notify_update ON {table};
+DROP TRIGGER {table}_notify_delete ON {table};
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FUNCTION_SQL, DROP_FUNCTION_SQL),
+        *[
+            migrations.RunSQL(
+                TABLE_SQL.format(table=table, kind=kind),
+                DROP_TABLE_SQL.format(table=table),
+            )
+            for table, kind in SYNCED_TABLES
+        ],
+    ]
@@ -0,0 +1,163 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Shards have no users to join, so every delete leaves tombstones (purges
+# delete them last). Rows copied and deleted while a user moves between
+# shards (core.rebalance, with core.moving set) leave no tombstones,
+# notifications or new updated_at.
+FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION core_track_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    IF TG_OP = 'UPDATE'
+            AND current_setting('core.moving', true) IS DISTINCT FROM 'on' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION core_write_tombstones() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('core.moving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO core_tombstone (
+        user_id, kind, object_id, change_xid, deleted_at
+    )
+    SELECT d.user_id, TG_ARGV[0], d.id,
+           pg_current_xact_id()::text::bigint, now()
+    FROM deleted d;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION core_notify_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    IF current_setting('core.moving', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    FOR payload IN
+        SELECT json_build_object(
+            'user', user_id, 'kind', TG_ARGV[0], 'action', TG_ARGV[1],
+            'ids', json_agg(id ORDER BY id)
+        )::text
+        FROM (
+            SELECT user_id, id,
+                   (row_number() OVER (PARTITION BY user_id ORDER BY id)
+                    - 1) / 200 AS chunk
+            FROM changed
+        ) numbered
+        GROUP BY user_id, chunk
+    LOOP
+        PERFORM pg_notify('core_changes', payload);
+    END LOOP;
+    RETURN NULL;
+END
+$$;
+"""
+
+REVERSE_FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION core_track_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    IF TG_OP = 'UPDATE' THEN
+        NEW.updated_at := now();
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION core_write_tombstones() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO core_tombstone (
+        user_id, kind, object_id, change_xid, deleted_at
+    )
+    SELECT d.user_id, TG_ARGV[0], d.id,
+           pg_current_xact_id()::text::bigint, now()
+    FROM deleted d JOIN core_user u ON u.id = d.user_id
+    WHERE u.is_active;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION core_notify_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    payload text;
+BEGIN
+    FOR payload IN
+        SELECT json_build_object(
+            'user', user_id, 'kind', TG_ARGV[0], 'action', TG_ARGV[1],
+            'ids', json_agg(id ORDER BY id)
+        )::text
+        FROM (
+            SELECT user_id, id,
+                   (row_number() OVER (PARTITION BY user_id ORDER BY id)
+                    - 1) / 200 AS chunk
+            FROM changed
+        ) numbered
+        GROUP BY user_id, chunk
+    LOOP
+        PERFORM pg_notify('core_changes', payload);
+    END LOOP;
+    RETURN NULL;
+END
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_change_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='shard',
+            field=models.CharField(blank=True, max_length=63),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='shard_locked',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='recipestats',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='tagstats',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunSQL(FUNCTIONS_SQL, REVERSE_FUNCTIONS_SQL),
+    ]
@@ -0,0 +1,253 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:26
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+import django.db.models.deletion
+
+BATCH_SIZE = 10000
+
+PARTITIONS = 16
+
+# The SQL of core.partitioning as of this migration, which the
+# ``partition_recipes`` command keeps using for the copy. Links reference
+# the recipes.
+TABLES = ('core_recipe', 'core_recipe_tags', 'core_recipe_ingredients')
+
+RECIPE_LINKS = ('core_recipe_tags', 'core_recipe_ingredients')
+
+ADD_OWNER_SQL = 'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS user_id bigint'
+
+FILL_OWNERS_SQL = """
+WITH batch AS (
+    SELECT id FROM {table} WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+), filled AS (
+    UPDATE {table} l SET user_id = r.user_id FROM batch b, core_recipe r
+    WHERE l.id = b.id AND r.id = l.recipe_id AND l.user_id IS NULL
+)
+SELECT MAX(id) FROM batch
+"""
+
+IS_PARTITIONED_SQL = """
+SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)
+"""
+
+CREATE_SQL = """
+CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+PARTITION BY HASH (user_id)
+"""
+
+PARTITION_SQL = """
+CREATE TABLE {table}_p{remainder} PARTITION OF {shadow}
+FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})
+"""
+
+PRIMARY_KEY_SQL = """
+ALTER TABLE {shadow} ADD CONSTRAINT {shadow}_pkey PRIMARY KEY (id, user_id)
+"""
+
+INDEXES_SQL = """
+SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype = 'f'
+      AND confrelid <> 'core_recipe'::regclass
+"""
+
+TRIGGERS_SQL = """
+SELECT pg_get_triggerdef(oid) FROM pg_trigger
+WHERE tgrelid = %s::regclass AND NOT tgisinternal
+"""
+
+LOCK_SQL = """
+SET LOCAL lock_timeout = '1min';
+LOCK TABLE core_recipe, core_recipe_tags, core_recipe_ingredients
+IN EXCLUSIVE MODE
+"""
+
+SEQUENCE_SQL = "SELECT pg_get_serial_sequence(%s, 'id')"
+
+
+def shadow_name(table):
+    return f'{table}_partitioned'
+
+
+def index_body(definition):
+    """Return the partitioned index for `definition`, without its name
+    and table; unique indexes get the owner first."""
+    body = re.sub(r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+ ',
+                  r'CREATE \1INDEX ON ', definition)
+    if body.startswith('CREATE UNIQUE') and \
+            not re.search(r'\buser_id\b', body):
+        body = re.sub(r'USING (\w+) \(', r'USING \1 (user_id, ', body,
+                      count=1)
+    return body
+
+
+def indexes(cursor, table):
+    cursor.execute(INDEXES_SQL, [table])
+    return {index_body(definition): name
+            for name, definition in cursor.fetchall()}
+
+
+def create_shadow(cursor, table):
+    shadow = shadow_name(table)
+    cursor.execute(f'DROP TABLE IF EXISTS {shadow}')
+    cursor.execute(CREATE_SQL.format(shadow=shadow, table=table))
+    for remainder in range(PARTITIONS):
+        cursor.execute(PARTITION_SQL.format(
+            table=table, shadow=shadow, modulus=PARTITIONS,
+            remainder=remainder,
+        ))
+    cursor.execute(PRIMARY_KEY_SQL.format(shadow=shadow))
+    for body in indexes(cursor, table):
+        cursor.execute(body.replace(' ON ', f' ON {shadow} ', 1))
+    cursor.execute(FOREIGN_KEYS_SQL, [table])
+    for name, definition in cursor.fetchall():
+        cursor.execute(
+            f'ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition}'
+        )
+
+
+def swap(cursor):
+    """Replace the empty tables by their shadows."""
+    renames = []
+    for table in TABLES:
+        shadow = shadow_name(table)
+        cursor.execute(TRIGGERS_SQL, [table])
+        for definition, in cursor.fetchall():
+            cursor.execute(re.sub(
+                rf' ON (\S+\.)?{table} ', f' ON {shadow} ', definition,
+                count=1,
+            ))
+        cursor.execute(SEQUENCE_SQL, [table])
+        sequence, = cursor.fetchone()
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {shadow}.id')
+        old = indexes(cursor, table)
+        for body, name in indexes(cursor, shadow).items():
+            renames.append((name, old[body]))
+
+    cursor.execute('DROP TABLE ' + ', '.join(reversed(TABLES)))
+    for table in TABLES:
+        cursor.execute(f'ALTER TABLE {shadow_name(table)} RENAME TO {table}')
+        cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT '
+                       f'{shadow_name(table)}_pkey TO {table}_pkey')
+    for name, original in renames:
+        cursor.execute(f'ALTER INDEX {name} RENAME TO {original}')
+
+
+def fill_owners(apps, schema_editor):
+    """Give existing links the owner of their recipe, in batches."""
+    connection = schema_editor.connection
+    for table in RECIPE_LINKS:
+        after = 0
+        while after is not None:
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(FILL_OWNERS_SQL.format(table=table),
+                                   {'after': after, 'limit': BATCH_SIZE})
+                    after = cursor.fetchone()[0]
+
+
+def create_partitioned(apps, schema_editor):
+    """Create the partitioned tables, in place of empty tables.
+
+    Tables holding rows only get their partitioned shadows here; the
+    ``partition_recipes`` command copies the rows over and swaps them.
+    """
+    connection = schema_editor.connection
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            tables = []
+            for table in TABLES:
+                cursor.execute(IS_PARTITIONED_SQL, [table])
+                row = cursor.fetchone()
+                if not (row and row[0]):
+                    tables.append(table)
+            if not tables:
+                return
+            for table in tables:
+                create_shadow(cursor, table)
+            for table in tables:
+                cursor.execute(f'SELECT EXISTS (SELECT FROM {table})')
+                if cursor.fetchone()[0]:
+                    return
+            cursor.execute(LOCK_SQL)
+            swap(cursor)
+
+
+def drop_shadows(apps, schema_editor):
+    """Drop shadows not swapped in; partitioned tables stay as they are.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f'DROP TABLE IF EXISTS {shadow_name(table)}')
+
+
+class Migration(migrations.Migration):
+    # Owners are filled in one transaction per batch.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0017_sharding'),
+    ]
+
+    operations = [
+        # The links get explicit models carrying their recipe's owner, the
+        # partition key. Until the swap the column may still be NULL.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    ADD_OWNER_SQL.format(table=table),
+                    migrations.RunSQL.noop,
+                )
+                for table in RECIPE_LINKS
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='RecipeTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('recipe', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.recipe')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.tag')),
+                        ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_tags',
+                        'unique_together': {('user', 'recipe', 'tag')},
+                    },
+                ),
+                migrations.CreateModel(
+                    name='RecipeIngredient',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.ingredient')),
+                        ('recipe', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='core.recipe')),
+                        ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'core_recipe_ingredients',
+                        'unique_together': {('user', 'recipe', 'ingredient')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='ingredients',
+                    field=models.ManyToManyField(through='core.RecipeIngredient', to='core.Ingredient'),
+                ),
+                migrations.AlterField(
+                    model_name='recipe',
+                    name='tags',
+                    field=models.ManyToManyField(through='core.RecipeTag', to='core.Tag'),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_owners, migrations.RunPython.noop),
+        migrations.RunPython(create_partitioned, drop_shadows),
+    ]
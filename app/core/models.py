@@ -1,15 +1,33 @@
 """
 Database model.
 """
+import os
+import uuid
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
 
+from core import sharding
+
+
+def recipe_image_file_path(instance, filename):
+    """Generate file path for new recipe image."""
+    ext = os.path.splitext(filename)[1].lower()
+    filename = f'{uuid.uuid4()}{ext}'
+
+    return os.path.join('uploads', 'recipe', filename)
+
+
+def normalize_name(name):
+    """Strip a tag or ingredient name and collapse inner whitespace."""
+    return ' '.join(name.split())
+
 
 class UserManager(BaseUserManager):
     """Manager for user."""
@@ -22,6 +40,9 @@ class UserManager(BaseUserManager):
         user = self.model(email=self.normalize_email(email), **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
+        if not user.shard:
+            user.shard = sharding.placement(user.pk)
+            user.save(using=self._db, update_fields=['shard'])
 
         return user
 
@@ -41,49 +62,479 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Database alias holding the user's data (see core.sharding), and
+    # whether it is being moved to another.
+    shard = models.CharField(max_length=63, blank=True)
+    shard_locked = models.BooleanField(default=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
-class Recipe(models.Model):
+class SyncedModel(models.Model):
+    """Abstract model tracking changes for delta sync (see core.sync).
+
+    ``change_xid`` is the id of the transaction that last wrote the row.
+    It and ``updated_at`` are set by a database trigger, so raw SQL writes
+    are tracked too; deletes leave a ``Tombstone``.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    change_xid = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+class Recipe(SyncedModel):
     """Recipe object."""
+    # Users live on the default database and their data on any shard (see
+    # core.sharding), so user foreign keys of user data are not enforced.
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
-    tags = models.ManyToManyField('Tag')
-    ingredients = models.ManyToManyField('Ingredient')
+    tags = models.ManyToManyField('Tag', through='RecipeTag')
+    ingredients = models.ManyToManyField('Ingredient',
+                                         through='RecipeIngredient')
+    image = models.ImageField(
+        null=True,
+        blank=True,
+        upload_to=recipe_image_file_path,
+    )
+    thumbnails = models.JSONField(default=dict, blank=True)
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'price']),
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'change_xid', 'id'],
+                         name='recipe_user_change_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember loaded values so saves can update stats by delta."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _do_update(self, base_qs, *args, **kwargs):
+        """Update by owner too: core_recipe is partitioned by user (see
+        core.partitioning), so the update visits one partition."""
+        user_id = getattr(self, '_loaded_values', {}).get('user_id',
+                                                          self.user_id)
+        return super()._do_update(base_qs.filter(user_id=user_id), *args,
+                                  **kwargs)
+
+
+class NamedObjectManager(models.Manager):
+    """Manager for per-user objects that are unique by normalized name.
+
+    Names are unique per user ignoring case, enforced by a
+    ``(user_id, lower(name))`` unique index created in migration 0010.
+    Prefix searches use the ``text_pattern_ops`` variant from migration
+    0013.
+    """
+
+    GET_OR_CREATE_SQL = """
+    WITH wanted(name) AS (SELECT unnest(%(names)s::text[])),
+    inserted AS (
+        INSERT INTO {table} (user_id, name)
+        SELECT %(user_id)s, name FROM wanted
+        ON CONFLICT (user_id, lower(name)) DO NOTHING
+        RETURNING id, user_id, name
+    ),
+    existing AS (
+        SELECT t.id, t.user_id, t.name FROM {table} t
+        WHERE t.user_id = %(user_id)s
+          AND lower(t.name) IN (SELECT lower(name) FROM wanted)
+        FOR KEY SHARE OF t
+    )
+    SELECT id, user_id, name FROM inserted
+    UNION ALL
+    SELECT id, user_id, name FROM existing
+    """
+
+    AUTOCOMPLETE_SQL = """
+    SELECT t.id, t.user_id, t.name, {usage} AS recipe_count
+    FROM {table} t
+    WHERE t.user_id = %(user_id)s AND lower(t.name) LIKE %(pattern)s
+    ORDER BY recipe_count DESC, lower(t.name), t.id
+    LIMIT %(limit)s
+    """
+
+    # Number of recipes using each object: maintained for tags, counted
+    # on the through table's foreign key index for ingredients.
+    USAGE_SQL = {
+        'core_tag': (
+            'COALESCE((SELECT s.recipe_count FROM core_tagstats s '
+            'WHERE s.tag_id = t.id), 0)'
+        ),
+        'core_ingredient': (
+            '(SELECT COUNT(*) FROM core_recipe_ingredients ri '
+            'WHERE ri.user_id = %(user_id)s AND ri.ingredient_id = t.id)'
+        ),
+    }
+
+    def get_or_create_names(self, user, names):
+        """Return the user's objects for `names`, creating missing ones.
+
+        Creation is a single ``INSERT ... ON CONFLICT DO NOTHING``, so
+        concurrent requests can not create duplicates. A name inserted by
+        a transaction that committed after this statement started is
+        neither inserted nor visible here; those are read again.
+
+        Existing rows are locked ``FOR KEY SHARE`` until the caller's
+        transaction ends, so the orphan collector (``core.orphans``),
+        which skips locked rows, can not delete one before it is linked;
+        a row it already deleted is missing and created again.
+        """
+        wanted = {}
+        for name in names:
+            name = normalize_name(name)
+            wanted.setdefault(name.lower(), name)
+        if not wanted:
+            return []
+
+        sql = self.GET_OR_CREATE_SQL.format(table=self.model._meta.db_table)
+        found = {}
+        for _ in range(3):
+            missing = [n for key, n in wanted.items() if key not in found]
+            if not missing:
+                break
+            for obj in self.raw(sql, {'names': missing, 'user_id': user.pk}):
+                found[obj.name.lower()] = obj
+        return [found[key] for key in wanted]
+
+    def autocomplete(self, user, prefix, limit):
+        """Return the user's objects whose name starts with `prefix`.
+
+        Matching ignores case; the most used come first, each with its
+        ``recipe_count``.
+        """
+        table = self.model._meta.db_table
+        prefix = normalize_name(prefix).lower()
+        for char in ('\\', '%', '_'):
+            prefix = prefix.replace(char, '\\' + char)
+        return self.raw(
+            self.AUTOCOMPLETE_SQL.format(
+                table=table, usage=self.USAGE_SQL[table],
+            ),
+            {'user_id': user.pk, 'pattern': prefix + '%', 'limit': limit},
+        )
 
-class Tag(models.Model):
+
+class Tag(SyncedModel):
     """Tag to be used for a recipe."""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     name = models.CharField(max_length=255)
 
+    objects = NamedObjectManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_xid', 'id'],
+                         name='tag_user_change_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(SyncedModel):
     """Ingredient to be used in a recipe."""
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
     )
     name = models.CharField(max_length=255)
 
+    objects = NamedObjectManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_xid', 'id'],
+                         name='ingredient_user_change_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
+
+
+class RecipeLinkQuerySet(models.QuerySet):
+    """Links of recipes to tags or ingredients.
+
+    Links added through the recipes' many-to-many managers come without
+    their owner; ``bulk_create`` reads it from the linked objects.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        column = f'{self.model.linked_field}_id'
+        missing = [obj for obj in objs if obj.user_id is None]
+        if missing:
+            linked = self.model._meta.get_field(
+                self.model.linked_field,
+            ).related_model
+            owners = dict(
+                linked.objects.using(self.db)
+                .filter(pk__in={getattr(obj, column) for obj in missing})
+                .values_list('pk', 'user_id')
+            )
+            for obj in missing:
+                obj.user_id = owners.get(getattr(obj, column))
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class RecipeLink(models.Model):
+    """Abstract link of a recipe to a tag or ingredient of its owner.
+
+    Links are partitioned by owner like recipes (see core.partitioning),
+    so they carry the owner, which is part of their keys, and the recipe
+    foreign key is not enforced.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+
+    objects = RecipeLinkQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class RecipeTag(RecipeLink):
+    """Tag of a recipe."""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    linked_field = 'tag'
+
+    class Meta:
+        db_table = 'core_recipe_tags'
+        unique_together = [('user', 'recipe', 'tag')]
+
+
+class RecipeIngredient(RecipeLink):
+    """Ingredient of a recipe."""
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+
+    linked_field = 'ingredient'
+
+    class Meta:
+        db_table = 'core_recipe_ingredients'
+        unique_together = [('user', 'recipe', 'ingredient')]
+
+
+def link_prefetches(user_id):
+    """Return prefetches of the tags and ingredients of `user_id`'s
+    recipes.
+
+    The prefetch joins each through table under its own name; filtering it
+    by owner reads one partition (see core.partitioning).
+    """
+    return [
+        models.Prefetch(name, queryset=model.objects.extra(
+            where=[f'{link._meta.db_table}.user_id = %s'],
+            params=[user_id],
+        ))
+        for name, model, link in (
+            ('tags', Tag, RecipeTag),
+            ('ingredients', Ingredient, RecipeIngredient),
+        )
+    ]
+
+
+class RecipeStats(models.Model):
+    """Per-user recipe aggregates, maintained incrementally by core.stats."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='recipe_stats',
+    )
+    recipe_count = models.IntegerField(default=0)
+    price_sum = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0,
+    )
+    price_min = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True,
+    )
+    price_max = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True,
+    )
+    time_minutes_sum = models.BigIntegerField(default=0)
+    time_minutes_min = models.IntegerField(null=True)
+    time_minutes_max = models.IntegerField(null=True)
+    # Bumped by every write to the user's recipe tag or ingredient links,
+    # so caches derived from them can tell they are stale.
+    links_version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'Recipe stats for {self.user_id}'
+
+
+class TagStats(models.Model):
+    """Number of recipes using a tag, maintained incrementally."""
+    tag = models.OneToOneField(
+        Tag,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='stats',
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+    )
+    recipe_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count']),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.recipe_count}'
+
+
+class Tombstone(models.Model):
+    """Deleted recipe, tag or ingredient, kept for delta sync clients.
+
+    Written by a database trigger and pruned after
+    ``SYNC_TOMBSTONE_RETENTION``. There is no foreign key to the user: a
+    user's tombstones may be written while the user is being deleted.
+    """
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    change_xid = models.BigIntegerField(default=0)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_xid', 'id'],
+                         name='tombstone_user_change_idx'),
+            models.Index(fields=['deleted_at'],
+                         name='tombstone_deleted_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id} deleted'
+
+
+class Job(models.Model):
+    """Background job stored in the database and claimed by workers."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    progress = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['run_after', 'id'],
+                name='job_queued_run_after_idx',
+                condition=models.Q(status='queued'),
+            ),
+            models.Index(
+                fields=['locked_at'],
+                name='job_running_locked_at_idx',
+                condition=models.Q(status='running'),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+    def set_progress(self, **progress):
+        """Merge progress information and store it right away.
+
+        Also refreshes ``locked_at`` as the running worker's heartbeat, so
+        long jobs that report progress are not requeued as stale.
+        """
+        self.progress = {**self.progress, **progress}
+        now = timezone.now()
+        fields = {'progress': self.progress, 'updated_at': now}
+        if self.status == Job.RUNNING:
+            self.locked_at = fields['locked_at'] = now
+        Job.objects.filter(pk=self.pk, locked_by=self.locked_by).update(
+            **fields,
+        )
@@ -0,0 +1,84 @@
+"""
+Garbage collection of tags and ingredients no recipe links to.
+
+The table of every shard is walked in primary key order, ``batch_size``
+rows at a time, each batch in its own transaction. Orphans are found with
+a ``NOT EXISTS`` anti-join on the through table's foreign key index and
+locked with ``SKIP LOCKED``, so a row a concurrent recipe write is
+linking is left for the next run instead of being waited for.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from core.dedupe import NAME_TABLES
+
+SCAN_SQL = """
+WITH scanned AS (
+    SELECT id FROM {table}
+    WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+),
+orphans AS (
+    SELECT t.id FROM {table} t JOIN scanned USING (id)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {through} rt WHERE rt.{column} = t.id
+    )
+    {lock}
+)
+"""
+
+COUNT_SQL = SCAN_SQL + """
+SELECT (SELECT MAX(id) FROM scanned), (SELECT COUNT(*) FROM scanned),
+       (SELECT COUNT(*) FROM orphans)
+"""
+
+DELETE_SQL = SCAN_SQL + """,
+{delete_stats}
+deleted AS (
+    DELETE FROM {table} WHERE id IN (SELECT id FROM orphans) RETURNING id
+)
+SELECT (SELECT MAX(id) FROM scanned), (SELECT COUNT(*) FROM scanned),
+       (SELECT COUNT(*) FROM deleted)
+"""
+
+DELETE_STATS_SQL = """
+deleted_stats AS (
+    DELETE FROM {stats} WHERE tag_id IN (SELECT id FROM orphans)
+),
+"""
+
+
+def collect(kind, batch_size=1000, dry_run=False, sleep=0):
+    """Delete orphaned rows of `kind`, one batch per iteration.
+
+    Yields ``(scanned, orphans)`` running totals after every batch; with
+    `dry_run` the orphans are only counted.
+    """
+    tables = NAME_TABLES[kind]
+    if dry_run:
+        sql = COUNT_SQL.format(lock='', **tables)
+    else:
+        sql = DELETE_SQL.format(
+            lock='FOR UPDATE OF t SKIP LOCKED',
+            delete_stats=(
+                DELETE_STATS_SQL.format(**tables) if tables['stats'] else ''
+            ),
+            **tables,
+        )
+
+    scanned, orphans = 0, 0
+    for alias in settings.SHARDS:
+        after = 0
+        while True:
+            with transaction.atomic(using=alias), \
+                    connections[alias].cursor() as cursor:
+                cursor.execute(sql, {'after': after, 'limit': batch_size})
+                after, batch_scanned, batch_orphans = cursor.fetchone()
+            if after is None:
+                break
+            scanned += batch_scanned
+            orphans += batch_orphans
+            yield scanned, orphans
+            if sleep:
+                time.sleep(sleep)
@@ -0,0 +1,343 @@
+"""
+Hash partitioning of recipes and their links by user.
+
+``core_recipe`` and its tag and ingredient links (``core_recipe_tags``
+and ``core_recipe_ingredients``, which carry the recipe's owner for it)
+are split into ``PARTITIONS`` partitions by ``user_id``. API views only
+read and write the requesting user's rows and filter on their owner, so
+their queries are pruned to one partition of each table. Only the ORM's
+deletes, of a recipe by primary key and of its links by recipe, visit an
+index of every partition.
+
+The unique indexes of a partitioned table must include its partition
+key, so the primary keys become ``(id, user_id)`` and the links are
+unique by owner, recipe and tag or ingredient; ids still come from one
+sequence each and stay unique. Nothing unique is left on
+``core_recipe.id`` alone for the links to reference, so their
+``recipe_id`` foreign keys are dropped: links are deleted with their
+recipe by the ORM and by every raw delete (see core.rebalance).
+
+Migration 0018 adds the owner column to the links and fills it in
+batches. Existing tables are then converted online, by the migration when
+they are empty and by the ``partition_recipes`` command otherwise:
+
+1. A partitioned shadow table, ``<table>_partitioned``, is created next to
+   each table, without triggers, so copies keep ``change_xid``.
+2. Rows are copied in batches of ids. Links written without their owner,
+   by code older than the migration, get it from their recipe.
+3. Catch-up passes copy the recipes written since the previous pass, by
+   ``change_xid``, with their links, and apply tombstones.
+4. The tables are locked against writes, a last pass is copied, and the
+   shadow tables take the place of the originals, with their triggers,
+   sequences and index names.
+"""
+import re
+from collections import defaultdict
+
+from core.sync import HORIZON_SQL
+
+PARTITIONS = 16
+
+# Links reference the recipes.
+TABLES = ('core_recipe', 'core_recipe_tags', 'core_recipe_ingredients')
+
+RECIPE_LINKS = ('core_recipe_tags', 'core_recipe_ingredients')
+
+LINK_COLUMNS = {
+    'tag': ('core_recipe_tags', 'tag_id'),
+    'ingredient': ('core_recipe_ingredients', 'ingredient_id'),
+}
+
+IS_PARTITIONED_SQL = """
+SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)
+"""
+
+CREATE_SQL = """
+CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+PARTITION BY HASH (user_id)
+"""
+
+PARTITION_SQL = """
+CREATE TABLE {table}_p{remainder} PARTITION OF {shadow}
+FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})
+"""
+
+PRIMARY_KEY_SQL = """
+ALTER TABLE {shadow} ADD CONSTRAINT {shadow}_pkey PRIMARY KEY (id, user_id)
+"""
+
+INDEXES_SQL = """
+SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+WHERE conrelid = %s::regclass AND contype = 'f'
+      AND confrelid <> 'core_recipe'::regclass
+"""
+
+COLUMNS_SQL = """
+SELECT attname FROM pg_attribute
+WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+ORDER BY attnum
+"""
+
+TRIGGERS_SQL = """
+SELECT pg_get_triggerdef(oid) FROM pg_trigger
+WHERE tgrelid = %s::regclass AND NOT tgisinternal
+"""
+
+ADD_OWNER_SQL = 'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS user_id bigint'
+
+FILL_OWNERS_SQL = """
+WITH batch AS (
+    SELECT id FROM {table} WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+), filled AS (
+    UPDATE {table} l SET user_id = r.user_id FROM batch b, core_recipe r
+    WHERE l.id = b.id AND r.id = l.recipe_id AND l.user_id IS NULL
+)
+SELECT MAX(id) FROM batch
+"""
+
+COPY_SQL = """
+WITH batch AS (
+    SELECT * FROM {table} WHERE id > %(after)s ORDER BY id LIMIT %(limit)s
+), copied AS (
+    INSERT INTO {shadow} {rows} ON CONFLICT DO NOTHING
+)
+SELECT MAX(id), COUNT(*) FROM batch
+"""
+
+# Recipes written from `since` on: a loose index scan of the owners, then
+# their recipes by (user_id, change_xid), so no index on change_xid alone
+# is needed.
+CHANGED_SQL = """
+WITH RECURSIVE owners(user_id) AS (
+    SELECT MIN(user_id) FROM core_recipe
+    UNION ALL
+    SELECT (SELECT MIN(user_id) FROM core_recipe WHERE user_id > o.user_id)
+    FROM owners o WHERE o.user_id IS NOT NULL
+)
+SELECT r.id FROM owners o CROSS JOIN LATERAL (
+    SELECT id FROM core_recipe
+    WHERE user_id = o.user_id AND change_xid >= %(since)s
+) r
+ORDER BY r.id
+"""
+
+TOMBSTONES_SQL = """
+SELECT kind, object_id FROM core_tombstone
+WHERE change_xid >= %(since)s AND kind IN ('recipe', 'tag', 'ingredient')
+"""
+
+DELETE_SQL = 'DELETE FROM {table} WHERE {column} = ANY(%(ids)s)'
+
+INSERT_SQL = 'INSERT INTO {shadow} {rows}'
+
+SOME_ROWS_SQL = '(SELECT * FROM {table} WHERE {column} = ANY(%(ids)s))'
+
+
+LOCK_SQL = """
+LOCK TABLE core_recipe, core_recipe_tags, core_recipe_ingredients
+IN EXCLUSIVE MODE
+"""
+
+LOCK_TIMEOUT_SQL = 'SET LOCAL lock_timeout = %s'
+
+SEQUENCE_SQL = "SELECT pg_get_serial_sequence(%s, 'id')"
+
+
+def shadow_name(table):
+    return f'{table}_partitioned'
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(IS_PARTITIONED_SQL, [table])
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def has_shadow(cursor, table):
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [shadow_name(table)])
+    return cursor.fetchone()[0]
+
+
+def is_empty(cursor, table):
+    cursor.execute(f'SELECT NOT EXISTS (SELECT FROM {table})')
+    return cursor.fetchone()[0]
+
+
+def _index_body(definition):
+    """Return the partitioned index for `definition`, without its name
+    and table.
+
+    Unique indexes must include the owner; it goes first, so they also
+    serve the lookups of an owner's rows.
+    """
+    body = re.sub(r'^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+ ',
+                  r'CREATE \1INDEX ON ', definition)
+    if body.startswith('CREATE UNIQUE') and \
+            not re.search(r'\buser_id\b', body):
+        body = re.sub(r'USING (\w+) \(', r'USING \1 (user_id, ', body,
+                      count=1)
+    return body
+
+
+def _indexes(cursor, table):
+    """Return the non-primary indexes of `table` by partitioned body."""
+    cursor.execute(INDEXES_SQL, [table])
+    return {_index_body(definition): name
+            for name, definition in cursor.fetchall()}
+
+
+def _rows(cursor, table, source):
+    """Return the SELECT of the shadow rows of `table` from `source`.
+
+    Links get their owner from their recipe.
+    """
+    if table == 'core_recipe':
+        return f'SELECT * FROM {source} l'
+    cursor.execute(COLUMNS_SQL, [table])
+    columns = ', '.join('r.user_id' if column == 'user_id' else f'l.{column}'
+                        for column, in cursor.fetchall())
+    return (f'SELECT {columns} FROM {source} l '
+            'JOIN core_recipe r ON r.id = l.recipe_id')
+
+
+def fill_owners(cursor, table, after, limit):
+    """Set the owner of the `limit` links of `table` after id `after`.
+
+    Returns the last id seen, None once done.
+    """
+    cursor.execute(FILL_OWNERS_SQL.format(table=table),
+                   {'after': after, 'limit': limit})
+    return cursor.fetchone()[0]
+
+
+def create_shadow(cursor, table, partitions=PARTITIONS):
+    """Create the empty partitioned copy of `table`, indexes included."""
+    shadow = shadow_name(table)
+    cursor.execute(CREATE_SQL.format(shadow=shadow, table=table))
+    for remainder in range(partitions):
+        cursor.execute(PARTITION_SQL.format(
+            table=table, shadow=shadow, modulus=partitions,
+            remainder=remainder,
+        ))
+    cursor.execute(PRIMARY_KEY_SQL.format(shadow=shadow))
+    # Unique constraints become unique indexes, which ON CONFLICT finds
+    # all the same. Postgres names them until the swap.
+    for body in _indexes(cursor, table):
+        cursor.execute(body.replace(' ON ', f' ON {shadow} ', 1))
+    cursor.execute(FOREIGN_KEYS_SQL, [table])
+    for name, definition in cursor.fetchall():
+        cursor.execute(
+            f'ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition}'
+        )
+
+
+def drop_shadow(cursor, table):
+    cursor.execute(f'DROP TABLE IF EXISTS {shadow_name(table)}')
+
+
+def truncate_shadows(cursor):
+    cursor.execute('TRUNCATE ' + ', '.join(
+        shadow_name(table) for table in TABLES
+    ))
+
+
+def horizon(cursor):
+    """Return the xid from which writes may still be missing."""
+    cursor.execute(HORIZON_SQL)
+    return cursor.fetchone()[0]
+
+
+def copy_batch(cursor, table, after, limit):
+    """Copy the `limit` rows of `table` after id `after`.
+
+    Returns the last id copied and the number of rows, 0 once done.
+    """
+    cursor.execute(COPY_SQL.format(
+        table=table, shadow=shadow_name(table),
+        rows=_rows(cursor, table, 'batch'),
+    ), {'after': after, 'limit': limit})
+    return cursor.fetchone()
+
+
+def _replace_recipes(cursor, ids):
+    params = {'ids': ids}
+    for table in (*RECIPE_LINKS, 'core_recipe'):
+        column = 'id' if table == 'core_recipe' else 'recipe_id'
+        cursor.execute(DELETE_SQL.format(table=shadow_name(table),
+                                         column=column), params)
+        source = SOME_ROWS_SQL.format(table=table, column=column)
+        cursor.execute(INSERT_SQL.format(
+            shadow=shadow_name(table), rows=_rows(cursor, table, source),
+        ), params)
+
+
+def catch_up(cursor, since, batch_size):
+    """Copy what changed from `since` on to the shadow tables.
+
+    Returns the number of recipes copied. A change to a recipe's links
+    touches the recipe (see core.signals), so links are copied with it.
+    """
+    cursor.execute(TOMBSTONES_SQL, {'since': since})
+    deleted = defaultdict(list)
+    for kind, object_id in cursor.fetchall():
+        deleted[kind].append(object_id)
+    if deleted['recipe']:
+        params = {'ids': deleted['recipe']}
+        for table in RECIPE_LINKS:
+            cursor.execute(DELETE_SQL.format(table=shadow_name(table),
+                                             column='recipe_id'), params)
+        cursor.execute(DELETE_SQL.format(table=shadow_name('core_recipe'),
+                                         column='id'), params)
+    for kind, (table, column) in LINK_COLUMNS.items():
+        if deleted[kind]:
+            cursor.execute(DELETE_SQL.format(table=shadow_name(table),
+                                             column=column),
+                           {'ids': deleted[kind]})
+
+    cursor.execute(CHANGED_SQL, {'since': since})
+    ids = [pk for pk, in cursor.fetchall()]
+    for start in range(0, len(ids), batch_size):
+        _replace_recipes(cursor, ids[start:start + batch_size])
+    return len(ids)
+
+
+def lock(cursor, lock_timeout):
+    """Block writes to the tables for the rest of the transaction."""
+    cursor.execute(LOCK_TIMEOUT_SQL, [lock_timeout])
+    cursor.execute(LOCK_SQL)
+
+
+def swap(cursor):
+    """Replace the tables by their shadows, in the lock of ``lock``."""
+    renames = []
+    for table in TABLES:
+        shadow = shadow_name(table)
+        cursor.execute(TRIGGERS_SQL, [table])
+        for definition, in cursor.fetchall():
+            cursor.execute(re.sub(
+                rf' ON (\S+\.)?{table} ', f' ON {shadow} ', definition,
+                count=1,
+            ))
+        # The shadow's id default already uses the sequence; it must not
+        # be dropped with the table.
+        cursor.execute(SEQUENCE_SQL, [table])
+        sequence, = cursor.fetchone()
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {shadow}.id')
+
+        old = _indexes(cursor, table)
+        for body, name in _indexes(cursor, shadow).items():
+            renames.append((name, old[body]))
+
+    cursor.execute('DROP TABLE ' + ', '.join(reversed(TABLES)))
+    for table in TABLES:
+        cursor.execute(f'ALTER TABLE {shadow_name(table)} RENAME TO {table}')
+        cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT '
+                       f'{shadow_name(table)}_pkey TO {table}_pkey')
+    for name, original in renames:
+        cursor.execute(f'ALTER INDEX {name} RENAME TO {original}')
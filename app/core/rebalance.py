@@ -0,0 +1,259 @@
+"""
+Online moves of a user's data between shards (see core.sharding).
+
+The user keeps using the API while their rows are copied:
+
+1. Every row is copied to the target from one snapshot of the source.
+2. Catch-up passes copy the rows written since the previous snapshot, by
+   ``change_xid``, and apply its tombstones, until few are left.
+3. The user is locked: ``shard_locked`` is set and the user's advisory
+   lock taken exclusively on the source, which waits for the writes in
+   progress; later ones are refused with a 503. A last pass, statistics
+   included, leaves the target an exact copy.
+4. The user is switched to the target and unlocked.
+5. After a grace period for reads still running on the source, the
+   source rows are deleted.
+
+Rows keep their ids, which are unique across shards. Copies and deletes
+set ``core.moving``, so the triggers (migration 0017) write no tombstones
+or notifications for them.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+
+from core.sharding import shard_for
+from core.sync import HORIZON_SQL
+
+SNAPSHOT_SQL = 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY'
+
+MOVING_SQL = "SET LOCAL core.moving = 'on'"
+
+LOCK_SQL = 'SELECT pg_advisory_lock(%s)'
+UNLOCK_SQL = 'SELECT pg_advisory_unlock(%s)'
+
+ROWS_SQL = """
+SELECT id, row_to_json(t)::text FROM {table} t
+WHERE user_id = %(user_id)s AND change_xid >= %(since)s AND id > %(after)s
+ORDER BY id LIMIT %(limit)s
+"""
+
+IDS_SQL = """
+SELECT id FROM {table} WHERE user_id = %(user_id)s ORDER BY id LIMIT %(limit)s
+"""
+
+LINKS_SQL = """
+SELECT row_to_json(t)::text FROM {table} t
+WHERE user_id = %(user_id)s AND recipe_id = ANY(%(ids)s)
+"""
+
+STATS_SQL = """
+SELECT row_to_json(t)::text FROM {table} t WHERE user_id = %(user_id)s
+"""
+
+TOMBSTONES_SQL = """
+SELECT kind, object_id FROM core_tombstone
+WHERE user_id = %(user_id)s AND change_xid >= %(since)s
+"""
+
+# Both shards run the same migrations, so the columns line up.
+INSERT_SQL = """
+INSERT INTO {table}
+SELECT * FROM json_populate_recordset(NULL::{table}, %(rows)s::json)
+"""
+
+DELETE_SQL = 'DELETE FROM {table} WHERE {column} = ANY(%(ids)s)'
+
+DELETE_STATS_SQL = 'DELETE FROM {table} WHERE user_id = %(user_id)s'
+
+# Tables of a user's rows, referenced ones first.
+ROW_TABLES = ('core_tag', 'core_ingredient', 'core_recipe')
+
+STATS_TABLES = ('core_recipestats', 'core_tagstats')
+
+# Rows referencing a row, deleted with it.
+DEPENDENTS = {
+    'core_recipe': (
+        ('core_recipe_tags', 'recipe_id'),
+        ('core_recipe_ingredients', 'recipe_id'),
+    ),
+    'core_tag': (
+        ('core_recipe_tags', 'tag_id'),
+        ('core_tagstats', 'tag_id'),
+    ),
+    'core_ingredient': (
+        ('core_recipe_ingredients', 'ingredient_id'),
+    ),
+    'core_tombstone': (),
+}
+
+# A recipe change (links included, see core.signals) bumps the recipe, so
+# its links are copied with it.
+RECIPE_LINKS = ('core_recipe_tags', 'core_recipe_ingredients')
+
+KIND_TABLES = {
+    'recipe': 'core_recipe',
+    'tag': 'core_tag',
+    'ingredient': 'core_ingredient',
+}
+
+
+class Move:
+    """Move of one user's data from their shard to `target`."""
+
+    def __init__(self, user, target, batch_size=1000, max_passes=5,
+                 grace=10):
+        self.user = user
+        self.source = shard_for(user)
+        self.target = target
+        self.batch_size = batch_size
+        self.max_passes = max_passes
+        self.grace = grace
+        self.copied = 0
+        self.passes = 0
+
+    def run(self):
+        """Move the user; return the number of rows copied."""
+        if self.source == self.target:
+            return 0
+        # Rows left behind by an interrupted move.
+        self.clear(self.target)
+
+        since = self.copy_pass(0)
+        for _ in range(self.max_passes):
+            copied = self.copied
+            since = self.copy_pass(since)
+            if self.copied - copied <= self.batch_size:
+                break
+
+        users = get_user_model().objects.filter(pk=self.user.pk)
+        users.update(shard_locked=True)
+        try:
+            with connections[self.source].cursor() as cursor:
+                cursor.execute(LOCK_SQL, [self.user.pk])
+            try:
+                self.copy_pass(since, stats=True)
+                users.update(shard=self.target, shard_locked=False)
+            finally:
+                with connections[self.source].cursor() as cursor:
+                    cursor.execute(UNLOCK_SQL, [self.user.pk])
+        finally:
+            users.filter(shard_locked=True).update(shard_locked=False)
+        self.user.shard = self.target
+
+        time.sleep(self.grace)
+        self.clear(self.source)
+        return self.copied
+
+    @contextmanager
+    def writing(self, alias):
+        """Return a cursor in a transaction on `alias` marked as moving."""
+        with transaction.atomic(using=alias), \
+                connections[alias].cursor() as cursor:
+            cursor.execute(MOVING_SQL)
+            yield cursor
+
+    @staticmethod
+    def insert(cursor, table, rows):
+        if rows:
+            cursor.execute(INSERT_SQL.format(table=table),
+                           {'rows': '[' + ','.join(rows) + ']'})
+
+    @staticmethod
+    def delete(cursor, table, ids):
+        """Delete rows of `table` and the rows referencing them."""
+        for dependent, column in DEPENDENTS[table]:
+            cursor.execute(DELETE_SQL.format(table=dependent, column=column),
+                           {'ids': ids})
+        cursor.execute(DELETE_SQL.format(table=table, column='id'),
+                       {'ids': ids})
+
+    def copy_pass(self, since, stats=False):
+        """Copy what changed from `since` on, from one source snapshot.
+
+        Returns the xmin of the snapshot: what it missed was written by
+        transactions from there on.
+        """
+        self.passes += 1
+        params = {'user_id': self.user.pk, 'since': since}
+        with transaction.atomic(using=self.source), \
+                connections[self.source].cursor() as source:
+            source.execute(SNAPSHOT_SQL)
+            source.execute(HORIZON_SQL)
+            horizon = source.fetchone()[0]
+
+            source.execute(TOMBSTONES_SQL, params)
+            deleted = defaultdict(list)
+            for kind, object_id in source.fetchall():
+                deleted[KIND_TABLES[kind]].append(object_id)
+            if deleted:
+                with self.writing(self.target) as target:
+                    for table, ids in deleted.items():
+                        self.delete(target, table, ids)
+
+            for table in ROW_TABLES:
+                self.copy_rows(source, table, params)
+
+            if stats:
+                with self.writing(self.target) as target:
+                    for table in STATS_TABLES:
+                        target.execute(DELETE_STATS_SQL.format(table=table),
+                                       params)
+                        source.execute(STATS_SQL.format(table=table),
+                                       params)
+                        self.insert(target, table,
+                                    [row for row, in source.fetchall()])
+        return horizon
+
+    def copy_rows(self, source, table, params):
+        """Copy the changed rows of `table`, replacing the target's."""
+        after = 0
+        while True:
+            source.execute(ROWS_SQL.format(table=table), {
+                **params, 'after': after, 'limit': self.batch_size,
+            })
+            rows = source.fetchall()
+            if not rows:
+                return
+            ids = [pk for pk, _ in rows]
+            links = {}
+            if table == 'core_recipe':
+                for link_table in RECIPE_LINKS:
+                    source.execute(LINKS_SQL.format(table=link_table),
+                                   {**params, 'ids': ids})
+                    links[link_table] = [row for row, in source.fetchall()]
+
+            # Foreign keys are deferred: rows referencing a replaced row
+            # find it again at commit.
+            with self.writing(self.target) as target:
+                for link_table in links:
+                    target.execute(
+                        DELETE_SQL.format(table=link_table,
+                                          column='recipe_id'),
+                        {'ids': ids},
+                    )
+                target.execute(DELETE_SQL.format(table=table, column='id'),
+                               {'ids': ids})
+                self.insert(target, table, [row for _, row in rows])
+                for link_table, link_rows in links.items():
+                    self.insert(target, link_table, link_rows)
+            self.copied += len(rows)
+            after = ids[-1]
+
+    def clear(self, alias):
+        """Delete the user's rows on `alias`, in batches."""
+        params = {'user_id': self.user.pk, 'limit': self.batch_size}
+        for table in (*ROW_TABLES[::-1], 'core_tombstone'):
+            while True:
+                with self.writing(alias) as cursor:
+                    cursor.execute(IDS_SQL.format(table=table), params)
+                    ids = [pk for pk, in cursor.fetchall()]
+                    if not ids:
+                        break
+                    self.delete(cursor, table, ids)
+        with self.writing(alias) as cursor:
+            for table in STATS_TABLES:
+                cursor.execute(DELETE_STATS_SQL.format(table=table), params)
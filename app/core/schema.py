@@ -0,0 +1,87 @@
+"""
+Prebuilt OpenAPI schema.
+
+Generating the schema introspects every view and serializer, so it is
+done once per deploy by the ``build_schema`` command. The result is kept
+gzip compressed in ``SCHEMA_ROOT``, one file per format, and loaded once
+per process; a missing artifact is built on first use.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from drf_spectacular.renderers import (
+    OpenApiJsonRenderer,
+    OpenApiYamlRenderer,
+)
+from drf_spectacular.settings import spectacular_settings
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'yaml': ('openapi.yaml.gz', OpenApiYamlRenderer),
+    'json': ('openapi.json.gz', OpenApiJsonRenderer),
+}
+
+Artifact = namedtuple(
+    'Artifact', ['etag', 'compressed', 'content', 'media_type'],
+)
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _path(fmt):
+    return os.path.join(settings.SCHEMA_ROOT, FORMATS[fmt][0])
+
+
+def build():
+    """Generate the schema and store every format; return their paths."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=True)
+    os.makedirs(settings.SCHEMA_ROOT, exist_ok=True)
+
+    paths = []
+    for fmt, (_, renderer_class) in FORMATS.items():
+        content = renderer_class().render(schema, renderer_context={})
+        path = _path(fmt)
+        # Written aside and renamed, so readers never see a partial file.
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(gzip.compress(content, compresslevel=9, mtime=0))
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def load(fmt):
+    """Return the stored schema in `fmt`, reloading it when it changes."""
+    path = _path(fmt)
+    with _lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            logger.warning('No prebuilt schema at %s, building it', path)
+            build()
+            mtime = os.stat(path).st_mtime_ns
+
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as fh:
+            compressed = fh.read()
+        content = gzip.decompress(compressed)
+        artifact = Artifact(
+            etag=hashlib.sha256(content).hexdigest()[:32],
+            compressed=compressed,
+            content=content,
+            media_type=FORMATS[fmt][1].media_type,
+        )
+        _cache[path] = (mtime, artifact)
+        return artifact
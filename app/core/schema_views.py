@@ -0,0 +1,76 @@
+"""
+Views serving the prebuilt OpenAPI schema and its docs.
+
+They live apart from ``core.views`` so the API-only profile, which does
+not install drf_spectacular, never imports it.
+"""
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.views.decorators.http import require_safe
+
+from drf_spectacular.plumbing import set_query_parameters
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SpectacularSwaggerView
+
+from core import schema
+from core.middleware import accepted_encodings
+
+
+@require_safe
+def serve_schema(request):
+    """Serve the prebuilt OpenAPI schema as YAML, or JSON when asked for.
+
+    A request for the current version (``?v=<etag>``) may be cached
+    forever; otherwise clients revalidate with the ETag. The gzip and the
+    identity bodies carry distinct ETags.
+    """
+    accept = request.META.get('HTTP_ACCEPT', '')
+    fmt = 'json' if request.GET.get('format') == 'json' or 'json' in accept \
+        else 'yaml'
+    artifact = schema.load(fmt)
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
+    gzipped = accepted.get('gzip', accepted.get('*', 0)) > 0
+    etag = f'"{artifact.etag}-gz"' if gzipped else f'"{artifact.etag}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if gzipped:
+            response = HttpResponse(
+                artifact.compressed, content_type=artifact.media_type,
+            )
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(
+                artifact.content, content_type=artifact.media_type,
+            )
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    if request.GET.get('v') == artifact.etag:
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.SCHEMA_CACHE_MAX_AGE,
+            immutable=True,
+        )
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+class SchemaDocsView(SpectacularSwaggerView):
+    """Swagger UI loading the prebuilt schema by its current version."""
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        self.url = set_query_parameters(
+            reverse(self.url_name),
+            format='json',
+            v=schema.load('json').etag,
+        )
+        return super().get(request, *args, **kwargs)
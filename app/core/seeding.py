@@ -0,0 +1,35 @@
+"""
+Users for generated datasets, shared by ``seed_data`` and ``benchmark_api``.
+
+Generated users are placed on shards like users signing up, so their data
+must be inserted on their shard, and deleted with the batched purge of
+account deletion rather than the ORM cascade, which never reaches shards.
+"""
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from core import bulk, sharding
+
+
+def create_users(users, batch_size=None):
+    """Insert unsaved `users` and place them on shards.
+
+    Returns the users grouped by shard.
+    """
+    User = get_user_model()
+    users = User.objects.bulk_create(users, batch_size=batch_size)
+    by_shard = {}
+    for user in users:
+        user.shard = sharding.placement(user.pk)
+        by_shard.setdefault(user.shard, []).append(user)
+    User.objects.bulk_update(users, ['shard'], batch_size=batch_size)
+    return by_shard
+
+
+def delete_users(users):
+    """Delete the users of a queryset, purging their data first."""
+    for user_id, shard in users.values_list('pk', 'shard'):
+        with sharding.use_shard(shard or DEFAULT_DB_ALIAS):
+            bulk.purge_user_data(user_id)
+    # Only the users are left for the ORM cascade.
+    users.delete()
@@ -0,0 +1,272 @@
+"""
+Placement of each user's recipes, tags and ingredients on one of several
+PostgreSQL databases.
+
+``SHARDS`` lists the database aliases holding user data; ``default`` is
+always one of them and also holds everything that is not per-user data
+(users, tokens, jobs). A new user is placed by consistent hashing of
+their id over ``SHARD_RING``, and the placement is stored on the user, so
+changing the ring never moves anyone implicitly: the
+``rebalance_shards`` command moves the users whose stored shard differs
+from the ring (see ``core.rebalance``).
+
+Queries are routed by the active shard, a context variable. API views
+activate the authenticated user's shard (``UserShardMixin``); jobs and
+commands activate the shard of the user they work on with ``use_shard``.
+The ORM follows it through ``ShardRouter``, and raw SQL through
+``connection``, ``atomic`` and ``on_commit`` of this module, which stand
+in for their ``django.db`` namesakes.
+
+Every shard allocates ids from its own range (``ID_RANGE`` apart, see
+``reset_sequences``), so rows keep their ids when their user moves.
+"""
+import bisect
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+
+# Rows of the user data tables, and the through tables of their links.
+SHARDED_TABLES = (
+    'core_recipe',
+    'core_tag',
+    'core_ingredient',
+    'core_recipe_tags',
+    'core_recipe_ingredients',
+    'core_recipestats',
+    'core_tagstats',
+    'core_tombstone',
+)
+
+# Ids of shard i start at i * ID_RANGE. Tag and ingredient ids must stay
+# below recipe.similarity.INGREDIENT_OFFSET (1 << 48), so up to 256 shards.
+ID_RANGE = 1 << 40
+
+SEQUENCE_TABLES = (
+    'core_recipe',
+    'core_tag',
+    'core_ingredient',
+    'core_recipe_tags',
+    'core_recipe_ingredients',
+    'core_tombstone',
+)
+
+# Only ever moves a sequence forward.
+SEQUENCE_SQL = """
+SELECT setval(seq, %(start)s, false)
+FROM (SELECT pg_get_serial_sequence(%(table)s, 'id')::regclass AS seq) s
+WHERE COALESCE(pg_sequence_last_value(seq), 0) < %(start)s
+"""
+
+_active = contextvars.ContextVar('shard', default=DEFAULT_DB_ALIAS)
+
+
+class HashRing:
+    """Consistent hash ring of database aliases.
+
+    Every alias owns ``vnodes`` points on the ring; a key belongs to the
+    alias of the first point after its hash. Adding a shard to a ring of
+    n moves about 1/(n+1) of the keys, all of them to the new shard.
+    """
+
+    def __init__(self, aliases, vnodes=64):
+        points = sorted(
+            (self._hash(f'{alias}#{i}'), alias)
+            for alias in aliases for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def node(self, key):
+        """Return the alias owning `key`."""
+        index = bisect.bisect(self._hashes, self._hash(str(key)))
+        return self._aliases[index % len(self._aliases)]
+
+
+@lru_cache(maxsize=8)
+def _ring(aliases, vnodes):
+    return HashRing(aliases, vnodes)
+
+
+def placement(user_id):
+    """Return the shard the ring assigns to `user_id`."""
+    return _ring(tuple(settings.SHARD_RING),
+                 settings.SHARD_RING_VNODES).node(user_id)
+
+
+def shard_for(user):
+    """Return the shard holding the user's data."""
+    return user.shard or DEFAULT_DB_ALIAS
+
+
+def users_on(alias):
+    """Return a filter of the users whose data is on `alias`."""
+    users = Q(shard=alias)
+    if alias == DEFAULT_DB_ALIAS:
+        users |= Q(shard='')
+    return users
+
+
+def current():
+    """Return the active shard."""
+    return _active.get()
+
+
+def activate(alias):
+    """Make `alias` the active shard; returns a token for ``deactivate``.
+    """
+    return _active.set(alias)
+
+
+def deactivate(token):
+    _active.reset(token)
+
+
+@contextmanager
+def use_shard(alias):
+    """Route the queries of the block to `alias`."""
+    token = activate(alias)
+    try:
+        yield alias
+    finally:
+        deactivate(token)
+
+
+class ConnectionProxy:
+    """The connection of the active shard, like ``django.db.connection``.
+    """
+
+    def __getattr__(self, name):
+        return getattr(connections[current()], name)
+
+
+connection = ConnectionProxy()
+
+
+def atomic(savepoint=True):
+    """``transaction.atomic`` on the active shard."""
+    return transaction.atomic(using=current(), savepoint=savepoint)
+
+
+def on_commit(func):
+    """Run `func` when the active shard's transaction commits."""
+    transaction.on_commit(func, using=current())
+
+
+def sequence_start(alias):
+    return settings.SHARDS.index(alias) * ID_RANGE
+
+
+def reset_sequences(alias):
+    """Move the id sequences of `alias` into its range."""
+    start = sequence_start(alias)
+    if not start:
+        return
+    with connections[alias].cursor() as cursor:
+        for table in SEQUENCE_TABLES:
+            cursor.execute(SEQUENCE_SQL, {'table': table, 'start': start})
+
+
+@receiver(post_migrate)
+def shard_migrated(sender, using, **kwargs):
+    if sender.name == 'core' and using in settings.SHARDS:
+        reset_sequences(using)
+
+
+class ShardRouter:
+    """Route the user data models to the active shard.
+
+    Related objects follow the database of the instance they are read
+    from; every other model lives on ``default``. Every database gets
+    every table: shards keep the other tables empty.
+    """
+
+    def _db(self, model, hints):
+        if model._meta.db_table not in SHARDED_TABLES:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and \
+                instance._meta.db_table in SHARDED_TABLES and \
+                instance._state.db:
+            return instance._state.db
+        return current()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users live on the default database, their data on any shard.
+        return True
+
+
+class ShardMoving(exceptions.APIException):
+    """The user's data is being moved to another shard."""
+    status_code = 503
+    default_detail = 'Your data is being moved; retry in a moment.'
+    default_code = 'shard_moving'
+
+    def __init__(self):
+        super().__init__()
+        self.wait = settings.SHARD_MOVE_RETRY_AFTER
+
+
+USER_LOCK_SQL = 'SELECT pg_advisory_lock_shared(%s)'
+USER_UNLOCK_SQL = 'SELECT pg_advisory_unlock_shared(%s)'
+
+
+class UserShardMixin:
+    """Route a view's queries to the authenticated user's shard.
+
+    Writes hold a shared advisory lock on the user for the request; a
+    move takes it exclusively before its final copy, so no write can be
+    lost. Writes that find the user moving, or moved, get a 503.
+    """
+    _shard_token = None
+    _shard_lock = None
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._shard_lock is not None:
+                alias, user_id = self._shard_lock
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(USER_UNLOCK_SQL, [user_id])
+                self._shard_lock = None
+            if self._shard_token is not None:
+                deactivate(self._shard_token)
+                self._shard_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if not user or not user.is_authenticated:
+            return
+        self._shard_token = activate(shard_for(user))
+        if request.method in SAFE_METHODS:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(USER_LOCK_SQL, [user.pk])
+        self._shard_lock = (current(), user.pk)
+        # Read again now that no move can start its final copy.
+        user.refresh_from_db(fields=['shard', 'shard_locked'])
+        if user.shard_locked or shard_for(user) != current():
+            raise ShardMoving()
@@ -0,0 +1,130 @@
+"""
+Signal receivers keeping denormalized data in sync with model writes.
+"""
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import stats
+from core.models import Ingredient, Recipe, Tag
+
+
+def _snapshot(recipe):
+    """Return the stats relevant values last read from or written to the db.
+    """
+    loaded = getattr(recipe, '_loaded_values', None)
+    if loaded is None or 'price' not in loaded or \
+            'time_minutes' not in loaded:
+        return None
+    return loaded['price'], loaded['time_minutes']
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, raw, update_fields, **kwargs):
+    """Apply an inserted or updated recipe to the user's aggregates."""
+    if raw:
+        return
+    new = (instance.price, instance.time_minutes)
+    if created:
+        stats.recipe_changed(instance.user_id, new=new)
+    elif update_fields is None or \
+            {'price', 'time_minutes'} & set(update_fields):
+        old = _snapshot(instance)
+        if old is None:
+            stats.rebuild([instance.user_id])
+        elif old != new:
+            stats.recipe_changed(instance.user_id, old=old, new=new)
+    instance._loaded_values = {
+        **getattr(instance, '_loaded_values', {}),
+        'price': instance.price,
+        'time_minutes': instance.time_minutes,
+    }
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """Release the recipe's tags before its through rows disappear."""
+    stats.recipe_tags_released(instance.user_id, instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Remove a deleted recipe from the user's aggregates."""
+    old = _snapshot(instance) or (instance.price, instance.time_minutes)
+    stats.recipe_changed(instance.user_id, old=old)
+    stats.links_changed([instance.user_id])
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def name_deleting(sender, instance, **kwargs):
+    """Touch the recipes of a tag or ingredient before the cascade deletes
+    their links, which sends no m2m_changed."""
+    instance._had_links = bool(
+        instance.recipe_set.filter(user=instance.user_id)
+        .update(updated_at=timezone.now())
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def name_deleted(sender, instance, **kwargs):
+    """Bump the owner's links version if the deletion unlinked recipes."""
+    if getattr(instance, '_had_links', False):
+        stats.links_changed([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Keep tag usage counts in sync with recipe tag changes."""
+    # pk_set of a remove lists the requested ids, which may not all be
+    # linked, so removals are counted from the through rows beforehand.
+    if action == 'post_add':
+        if reverse:
+            stats.tags_changed([instance.pk], len(pk_set))
+        else:
+            stats.tags_changed(pk_set, 1)
+    elif action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            linked = sender.objects.filter(user=instance.user_id,
+                                           tag_id=instance.pk)
+            if action == 'pre_remove':
+                linked = linked.filter(recipe_id__in=pk_set)
+            stats.tags_changed([instance.pk], -linked.count())
+        else:
+            stats.recipe_tags_released(
+                instance.user_id, instance.pk,
+                tag_ids=pk_set if action == 'pre_remove' else None,
+            )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_links_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+    """Bump the owner's links version after links were written.
+
+    The recipes whose links changed are touched too, so delta sync picks
+    them up; a reverse clear touches them before their links are gone.
+    """
+    recipes = None
+    if action in ('post_add', 'post_remove'):
+        recipes = Recipe.objects.filter(
+            pk__in=pk_set if reverse else [instance.pk],
+            user=instance.user_id,
+        )
+    elif action == 'post_clear' and not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk, user=instance.user_id)
+    elif action == 'pre_clear' and reverse:
+        recipes = instance.recipe_set.filter(user=instance.user_id)
+    if recipes is not None:
+        recipes.update(updated_at=timezone.now())
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        stats.links_changed([instance.user_id])
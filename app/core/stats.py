@@ -0,0 +1,194 @@
+"""
+Incremental maintenance of per-user recipe statistics.
+
+``RecipeStats`` and ``TagStats`` are updated by delta from the model
+signals in ``core.signals``, so reading them never scans a user's recipes.
+Minimum and maximum can not be maintained by delta when the current
+extreme is removed; those are recomputed from the ``(user, price)`` and
+``(user, time_minutes)`` indexes, which is a single index probe, of one
+partition of ``core_recipe`` (see core.partitioning).
+
+Bulk writes that bypass signals (``bulk_create``, raw SQL) must call
+``rebuild`` for the users they touched, and ``links_changed`` if they
+changed recipe tag or ingredient links.
+"""
+from decimal import Decimal
+
+from core.sharding import connection
+
+RECIPE_DELTA_SQL = """
+    recipe_count = s.recipe_count + %(count)s,
+    price_sum = s.price_sum + %(price_delta)s,
+    price_min = CASE
+        WHEN s.price_min = %(old_price)s THEN (
+            SELECT MIN(price) FROM core_recipe
+            WHERE user_id = %(user_id)s)
+        ELSE LEAST(s.price_min, %(new_price)s) END,
+    price_max = CASE
+        WHEN s.price_max = %(old_price)s THEN (
+            SELECT MAX(price) FROM core_recipe
+            WHERE user_id = %(user_id)s)
+        ELSE GREATEST(s.price_max, %(new_price)s) END,
+    time_minutes_sum = s.time_minutes_sum + %(time_delta)s,
+    time_minutes_min = CASE
+        WHEN s.time_minutes_min = %(old_time)s THEN (
+            SELECT MIN(time_minutes) FROM core_recipe
+            WHERE user_id = %(user_id)s)
+        ELSE LEAST(s.time_minutes_min, %(new_time)s) END,
+    time_minutes_max = CASE
+        WHEN s.time_minutes_max = %(old_time)s THEN (
+            SELECT MAX(time_minutes) FROM core_recipe
+            WHERE user_id = %(user_id)s)
+        ELSE GREATEST(s.time_minutes_max, %(new_time)s) END
+"""
+
+# Inserts may be the first recipe of a user, so they upsert the row.
+UPSERT_RECIPE_SQL = """
+INSERT INTO core_recipestats AS s (
+    user_id, recipe_count, price_sum, price_min, price_max,
+    time_minutes_sum, time_minutes_min, time_minutes_max
+)
+VALUES (%(user_id)s, %(count)s, %(price_delta)s, %(new_price)s,
+        %(new_price)s, %(time_delta)s, %(new_time)s, %(new_time)s)
+ON CONFLICT (user_id) DO UPDATE SET
+""" + RECIPE_DELTA_SQL
+
+# Updates and deletes only touch an existing row; a user being deleted
+# must not get its row re-created by the cascade.
+UPDATE_RECIPE_SQL = """
+UPDATE core_recipestats AS s SET
+""" + RECIPE_DELTA_SQL + """
+WHERE s.user_id = %(user_id)s
+"""
+
+UPSERT_TAGS_SQL = """
+INSERT INTO core_tagstats AS s (tag_id, user_id, recipe_count)
+SELECT t.id, t.user_id, %(delta)s
+FROM core_tag t WHERE t.id = ANY(%(ids)s::bigint[])
+ON CONFLICT (tag_id) DO UPDATE SET
+    recipe_count = s.recipe_count + EXCLUDED.recipe_count
+"""
+
+UPDATE_TAGS_SQL = """
+UPDATE core_tagstats SET recipe_count = recipe_count + %(delta)s
+WHERE tag_id = ANY(%(ids)s::bigint[])
+"""
+
+RELEASE_TAGS_OF_RECIPE_SQL = """
+UPDATE core_tagstats s SET recipe_count = s.recipe_count - 1
+FROM core_recipe_tags rt
+WHERE rt.tag_id = s.tag_id AND rt.user_id = %(user_id)s
+  AND rt.recipe_id = %(recipe_id)s
+  AND (%(tag_ids)s::bigint[] IS NULL
+       OR rt.tag_id = ANY(%(tag_ids)s::bigint[]))
+"""
+
+# Users live on the default database only (see core.sharding), so the
+# given ids are not joined to them. The repeated user filters let the
+# planner prune core_recipe and core_recipe_tags to the users' partitions.
+REBUILD_RECIPE_SQL = """
+INSERT INTO core_recipestats AS s (
+    user_id, recipe_count, price_sum, price_min, price_max,
+    time_minutes_sum, time_minutes_min, time_minutes_max
+)
+SELECT u.id, COUNT(r.id), COALESCE(SUM(r.price), 0), MIN(r.price),
+       MAX(r.price), COALESCE(SUM(r.time_minutes), 0),
+       MIN(r.time_minutes), MAX(r.time_minutes)
+FROM (SELECT DISTINCT unnest(%(ids)s::bigint[]) AS id) u
+LEFT JOIN core_recipe r
+    ON r.user_id = u.id AND r.user_id = ANY(%(ids)s::bigint[])
+GROUP BY u.id
+ON CONFLICT (user_id) DO UPDATE SET
+    recipe_count = EXCLUDED.recipe_count,
+    price_sum = EXCLUDED.price_sum,
+    price_min = EXCLUDED.price_min,
+    price_max = EXCLUDED.price_max,
+    time_minutes_sum = EXCLUDED.time_minutes_sum,
+    time_minutes_min = EXCLUDED.time_minutes_min,
+    time_minutes_max = EXCLUDED.time_minutes_max
+"""
+
+REBUILD_TAGS_SQL = """
+INSERT INTO core_tagstats AS s (tag_id, user_id, recipe_count)
+SELECT t.id, t.user_id, COUNT(rt.id)
+FROM core_tag t LEFT JOIN core_recipe_tags rt
+    ON rt.tag_id = t.id AND rt.user_id = ANY(%(ids)s::bigint[])
+WHERE t.user_id = ANY(%(ids)s::bigint[])
+GROUP BY t.id
+ON CONFLICT (tag_id) DO UPDATE SET recipe_count = EXCLUDED.recipe_count
+"""
+
+LINKS_CHANGED_SQL = """
+UPDATE core_recipestats SET links_version = links_version + 1
+WHERE user_id = ANY(%(ids)s::bigint[])
+"""
+
+
+def _number(value, cast):
+    return None if value is None else cast(str(value))
+
+
+def recipe_changed(user_id, old=None, new=None):
+    """Apply a recipe insert, update or delete to the user's aggregates.
+
+    `old` and `new` are ``(price, time_minutes)`` tuples, or None for the
+    missing side of an insert or a delete.
+    """
+    old_price, old_time = old or (None, None)
+    new_price, new_time = new or (None, None)
+    old_price = _number(old_price, Decimal)
+    new_price = _number(new_price, Decimal)
+    old_time = _number(old_time, int)
+    new_time = _number(new_time, int)
+
+    sql = UPSERT_RECIPE_SQL if new is not None else UPDATE_RECIPE_SQL
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'user_id': user_id,
+            'count': (new is not None) - (old is not None),
+            'price_delta': (new_price or 0) - (old_price or 0),
+            'time_delta': (new_time or 0) - (old_time or 0),
+            'new_price': new_price,
+            'new_time': new_time,
+            'old_price': old_price,
+            'old_time': old_time,
+        })
+
+
+def tags_changed(tag_ids, delta):
+    """Add `delta` to the recipe count of each tag."""
+    tag_ids = list(tag_ids)
+    if not tag_ids or not delta:
+        return
+    sql = UPSERT_TAGS_SQL if delta > 0 else UPDATE_TAGS_SQL
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'ids': tag_ids, 'delta': delta})
+
+
+def recipe_tags_released(user_id, recipe_id, tag_ids=None):
+    """Decrement the count of the recipe's linked tags, or some of them."""
+    with connection.cursor() as cursor:
+        cursor.execute(RELEASE_TAGS_OF_RECIPE_SQL, {
+            'user_id': user_id,
+            'recipe_id': recipe_id,
+            'tag_ids': None if tag_ids is None else list(tag_ids),
+        })
+
+
+def rebuild(user_ids):
+    """Recompute the aggregates of the given users from scratch."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(REBUILD_RECIPE_SQL, {'ids': user_ids})
+        cursor.execute(REBUILD_TAGS_SQL, {'ids': user_ids})
+
+
+def links_changed(user_ids):
+    """Bump the links version of the given users."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(LINKS_CHANGED_SQL, {'ids': user_ids})
@@ -0,0 +1,162 @@
+"""
+Delta sync of a user's recipes, tags and ingredients.
+
+Every synced row carries the id of the transaction that last wrote it
+(``change_xid``, set by a trigger) and deletes leave a ``Tombstone`` with
+the id of the deleting transaction. A client's cursor is a position in
+the ``(change_xid, source, id)`` order of the four tables; a page is the
+rows after it, read from the ``(user, change_xid, id)`` indexes, so its
+cost depends on the number of changes and not on the size of the catalog.
+
+Transaction ids are assigned when a transaction starts writing, not when
+it commits, so a row committed late can sort before rows that were read
+already. Pages therefore stop at the xmin of the current snapshot: every
+transaction older than it has committed or aborted, and nothing can
+appear behind the cursor any more. A long running transaction holds
+changes back until it ends; none are lost.
+
+``updated_at`` is informational. Wall clock times do not follow commit
+order either, so they can not be used as a cursor.
+
+Transaction ids are only comparable within a database, so a cursor names
+the shard it was issued on; once the user moves to another, it expires.
+"""
+from django.conf import settings
+from django.core import signing
+
+from core.models import Tombstone
+from core.sharding import connection, current
+
+RECIPES, TAGS, INGREDIENTS, TOMBSTONES = range(4)
+
+SOURCE_TABLES = {
+    RECIPES: 'core_recipe',
+    TAGS: 'core_tag',
+    INGREDIENTS: 'core_ingredient',
+    TOMBSTONES: 'core_tombstone',
+}
+
+CURSOR_SALT = 'core.sync'
+
+HORIZON_SQL = """
+SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+"""
+
+# Rows of one source after the position. Sources ordered before the
+# position's are read past its transaction, sources ordered after it from
+# its transaction on.
+SOURCE_SQL = """
+(SELECT {source} AS source, id, change_xid FROM {table}
+ WHERE user_id = %(user_id)s AND change_xid < %(horizon)s AND {after}
+ ORDER BY change_xid, id LIMIT %(limit)s)
+"""
+
+AFTER_SQL = {
+    'before': 'change_xid > %(xid)s',
+    'same': '(change_xid, id) > (%(xid)s, %(id)s)',
+    'after': 'change_xid >= %(xid)s',
+}
+
+
+class InvalidCursor(ValueError):
+    """The cursor was not issued by this server."""
+
+
+class ExpiredCursor(ValueError):
+    """The cursor is older than the tombstones kept for it, or from
+    another shard.
+    """
+
+
+def encode_cursor(position):
+    return signing.dumps([*position, current()], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    """Return the position of a cursor issued by ``encode_cursor``."""
+    try:
+        position = signing.loads(
+            cursor, salt=CURSOR_SALT,
+            max_age=settings.SYNC_CURSOR_MAX_AGE,
+        )
+    except signing.SignatureExpired:
+        raise ExpiredCursor(cursor)
+    except signing.BadSignature:
+        raise InvalidCursor(cursor)
+    if not isinstance(position, list) or len(position) != 4:
+        raise InvalidCursor(cursor)
+    if position[3] != current():
+        raise ExpiredCursor(cursor)
+    return tuple(position[:3])
+
+
+def _branches_sql(position):
+    """Return the UNION of the source queries after `position`.
+
+    The comparison of each source with the position's is resolved here,
+    so every branch is a plain range scan of its index.
+    """
+    _, position_source, _ = position
+    branches = []
+    for source, table in SOURCE_TABLES.items():
+        if source < position_source:
+            after = AFTER_SQL['before']
+        elif source == position_source:
+            after = AFTER_SQL['same']
+        else:
+            after = AFTER_SQL['after']
+        branches.append(SOURCE_SQL.format(
+            source=source, table=table, after=after,
+        ))
+    return (
+        '\nUNION ALL\n'.join(branches)
+        + '\nORDER BY change_xid, source, id LIMIT %(limit)s'
+    )
+
+
+def changes(user, cursor=None, limit=None):
+    """Return a page of the user's changes after `cursor`.
+
+    Returns ``(ids, has_more, cursor)``: the ids of the changed rows
+    keyed by source (``RECIPES``, ``TAGS``, ``INGREDIENTS`` and
+    ``TOMBSTONES``), whether more changes follow and the cursor to read
+    them with. Without a cursor, the sync starts from the beginning.
+    """
+    position = (0, -1, 0) if cursor is None else decode_cursor(cursor)
+    limit = limit or settings.SYNC_BATCH_SIZE
+    xid, source, pk = position
+
+    with connection.cursor() as db:
+        db.execute(HORIZON_SQL)
+        horizon = db.fetchone()[0]
+        db.execute(_branches_sql(position), {
+            'user_id': user.pk,
+            'horizon': horizon,
+            'xid': xid,
+            'id': pk,
+            'limit': limit + 1,
+        })
+        rows = db.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    ids = {source: [] for source in SOURCE_TABLES}
+    for row_source, row_id, _ in rows:
+        ids[row_source].append(row_id)
+
+    if has_more:
+        last_source, last_id, last_xid = rows[-1]
+        position = (last_xid, last_source, last_id)
+    elif horizon > xid:
+        # Everything before the horizon has been read.
+        position = (horizon, -1, 0)
+    return ids, has_more, encode_cursor(position)
+
+
+def tombstones(ids):
+    """Return ``{kind: [object ids]}`` of the tombstones with `ids`."""
+    deleted = {kind: [] for kind, _ in Tombstone.KIND_CHOICES}
+    for kind, object_id in Tombstone.objects.filter(pk__in=ids) \
+            .order_by('change_xid', 'id').values_list('kind', 'object_id'):
+        deleted[kind].append(object_id)
+    return deleted
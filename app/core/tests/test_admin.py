@@ -1,10 +1,19 @@
 """Test for django admin modifications"""
+from decimal import Decimal
+from unittest import skipUnless
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.test import Client
 
+from core.admin import EstimatedCountPaginator
+from core.models import Job, Recipe, RecipeStats, Tag, TagStats
+
 
 class AdminSiteTests(TestCase):
     """Test for django admin"""
@@ -46,3 +55,315 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_delete_user_queues_purge(self):
+        """Test deleting a user deactivates them and queues the purge"""
+        url = reverse('admin:core_user_delete', args=[self.user.id])
+
+        res = self.client.post(url, {'post': 'yes'})
+
+        self.assertEqual(res.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        job_obj = Job.objects.get()
+        self.assertEqual(job_obj.name, 'user.purge_user')
+        self.assertEqual(job_obj.payload, {'user_id': self.user.pk})
+
+
+class RecipeAdminTests(TestCase):
+    """Test the admin pages of recipes, tags and ingredients"""
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='password123',
+        )
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Pancakes', time_minutes=5, price='1.00',
+        )
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Sweet'))
+
+    def test_recipe_list_shows_user_email(self):
+        """Test the recipe list shows the owner in a constant query count"""
+        url = reverse('admin:core_recipe_changelist')
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+        for i in range(5):
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5,
+                price='1.00',
+            )
+        with CaptureQueriesContext(connection) as more_queries:
+            self.client.get(url)
+
+        self.assertContains(res, self.recipe.title)
+        self.assertContains(res, self.user.email)
+        self.assertEqual(len(queries), len(more_queries))
+
+    def test_search_tags_by_prefix(self):
+        """Test tag search matches name prefixes ignoring case"""
+        Tag.objects.create(user=self.user, name='Dessert')
+        url = reverse('admin:core_tag_changelist')
+
+        res = self.client.get(url, {'q': 'swe'})
+
+        self.assertContains(res, 'Sweet')
+        self.assertNotContains(res, 'Dessert')
+
+    def test_recipe_change_page_uses_autocomplete(self):
+        """Test the recipe form does not render every tag as an option"""
+        for i in range(3):
+            Tag.objects.create(user=self.user, name=f'Unrelated {i}')
+        url = reverse('admin:core_recipe_change', args=[self.recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(res, 'admin-autocomplete')
+        self.assertContains(res, 'Sweet')
+        self.assertNotContains(res, 'Unrelated')
+
+    def test_recipe_change_page_saves_tags(self):
+        """Test tags edited inline update the tag usage counts"""
+        sweet = self.recipe.tags.get()
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        link = Recipe.tags.through.objects.get()
+        url = reverse('admin:core_recipe_change', args=[self.recipe.id])
+
+        res = self.client.post(url, {
+            'user': self.user.pk, 'title': 'Pancakes', 'time_minutes': 5,
+            'price': '1.00', 'link': '', 'description': '',
+            'recipetag_set-TOTAL_FORMS': 2,
+            'recipetag_set-INITIAL_FORMS': 1,
+            'recipetag_set-0-id': link.pk,
+            'recipetag_set-0-recipe': self.recipe.pk,
+            'recipetag_set-0-tag': sweet.pk,
+            'recipetag_set-0-DELETE': 'on',
+            'recipetag_set-1-recipe': self.recipe.pk,
+            'recipetag_set-1-tag': quick.pk,
+            'recipeingredient_set-TOTAL_FORMS': 0,
+            'recipeingredient_set-INITIAL_FORMS': 0,
+        })
+
+        self.assertEqual(res.status_code, 302)
+        self.assertEqual(list(self.recipe.tags.all()), [quick])
+        self.assertEqual(
+            Recipe.tags.through.objects.get().user_id, self.user.pk,
+        )
+        self.assertEqual(TagStats.objects.get(tag=sweet).recipe_count, 0)
+        self.assertEqual(TagStats.objects.get(tag=quick).recipe_count, 1)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """Test counting changelist rows from planner statistics"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        for i in range(3):
+            Tag.objects.create(user=user, name=f'Tag {i}')
+
+    def test_small_counts_are_exact(self):
+        """Test estimates below the threshold fall back to COUNT(*)"""
+        paginator = EstimatedCountPaginator(Tag.objects.order_by('id'), 2)
+
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_large_counts_are_estimated(self):
+        """Test large tables are counted from the planner statistics"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_tag')
+        queryset = Tag.objects.order_by('id')
+        paginator = EstimatedCountPaginator(queryset, 2)
+        paginator.exact_threshold = 0
+
+        with CaptureQueriesContext(connection) as queries:
+            count = paginator.count
+
+        self.assertGreaterEqual(count, 0)
+        self.assertIn('pg_class', queries[0]['sql'])
+        self.assertNotIn('COUNT', ' '.join(q['sql'] for q in queries))
+
+
+class BulkActionTests(TestCase):
+    """Test the set-based admin actions"""
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='password123',
+        )
+        self.client.force_login(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='password123',
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5,
+                price=Decimal('10.00'),
+            )
+            for i in range(3)
+        ]
+
+    def run_action(self, action, ids, url=None, **data):
+        return self.client.post(
+            url or reverse('admin:core_recipe_changelist'),
+            {'action': action, ACTION_CHECKBOX_NAME: ids, **data},
+        )
+
+    def test_action_asks_for_confirmation(self):
+        """Test an action shows a confirmation page before changing rows"""
+        res = self.run_action('adjust_price', [self.recipes[0].id])
+
+        self.assertContains(res, 'Are you sure?')
+        self.assertContains(res, 'name="percent"')
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].price, Decimal('10.00'))
+
+    def test_add_and_remove_tag(self):
+        """Test tagging and untagging a selection"""
+        ids = [r.id for r in self.recipes[:2]]
+
+        res = self.run_action('add_tag', ids, name=' vegan ', apply='1')
+
+        self.assertEqual(res.status_code, 302)
+        tag = Tag.objects.get(user=self.user)
+        self.assertEqual(tag.name, 'vegan')
+        self.assertEqual(sorted(tag.recipe_set.values_list('id', flat=True)),
+                         ids)
+        self.assertEqual(TagStats.objects.get(tag=tag).recipe_count, 2)
+        self.recipes[0].refresh_from_db()
+        self.assertEqual(self.recipes[0].version, 2)
+
+        self.run_action('remove_tag', ids[:1], name='Vegan', apply='1')
+
+        self.assertEqual(list(tag.recipe_set.values_list('id', flat=True)),
+                         ids[1:])
+        self.assertEqual(TagStats.objects.get(tag=tag).recipe_count, 1)
+
+    def test_adjust_price_across_filtered_selection(self):
+        """Test repricing every recipe matching the changelist search"""
+        url = reverse('admin:core_recipe_changelist') + '?q=Recipe'
+
+        self.run_action('adjust_price', [self.recipes[0].id], url=url,
+                        select_across='1', percent='-25', apply='1')
+
+        self.assertEqual(
+            set(Recipe.objects.values_list('price', flat=True)),
+            {Decimal('7.50')},
+        )
+        self.assertEqual(
+            RecipeStats.objects.get(user=self.user).price_sum,
+            Decimal('22.50'),
+        )
+
+    def test_delete_recipes(self):
+        """Test deleting a selection with its links"""
+        self.recipes[0].tags.add(Tag.objects.create(user=self.user,
+                                                    name='Dinner'))
+
+        self.run_action('delete_recipes', [self.recipes[0].id], apply='1')
+
+        self.assertEqual(Recipe.objects.count(), 2)
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         2)
+
+    def test_delete_tags(self):
+        """Test deleting tags unlinks them from recipes"""
+        tag = Tag.objects.create(user=self.user, name='Dinner')
+        self.recipes[0].tags.add(tag)
+
+        self.run_action('delete_tags', [tag.id],
+                        url=reverse('admin:core_tag_changelist'), apply='1')
+
+        self.assertFalse(Tag.objects.exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertFalse(TagStats.objects.exists())
+
+
+@skipUnless(len(settings.SHARDS) > 1, 'needs DB_SHARDS')
+class ShardedAdminTests(TransactionTestCase):
+    """Test the admin pages of data on shard databases"""
+    databases = '__all__'
+
+    def setUp(self):
+        self.shard = settings.SHARDS[1]
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='password123',
+        )
+        self.client.force_login(self.admin_user)
+        with override_settings(SHARD_RING=[self.shard]):
+            self.user = get_user_model().objects.create_user(
+                email='user@example.com',
+                password='password123',
+            )
+        self.recipe = Recipe.objects.using(self.shard).create(
+            user=self.user, title='Pancakes', time_minutes=5, price='1.00',
+        )
+        self.url = reverse('admin:core_recipe_changelist')
+
+    def test_changelist_shows_chosen_shard(self):
+        """Test the changelist lists the rows of the chosen shard"""
+        res = self.client.get(self.url)
+        self.assertNotContains(res, 'Pancakes')
+
+        res = self.client.get(self.url, {'shard': self.shard})
+        self.assertContains(res, 'Pancakes')
+
+    def test_change_page_saves_to_object_shard(self):
+        """Test an object is edited on the shard holding it"""
+        url = reverse('admin:core_recipe_change', args=[self.recipe.id])
+
+        res = self.client.post(url, {
+            'user': self.user.pk, 'title': 'Waffles', 'time_minutes': 5,
+            'price': '1.00', 'link': '', 'description': '',
+            'recipetag_set-TOTAL_FORMS': 0,
+            'recipetag_set-INITIAL_FORMS': 0,
+            'recipeingredient_set-TOTAL_FORMS': 0,
+            'recipeingredient_set-INITIAL_FORMS': 0,
+        })
+
+        self.assertEqual(res.status_code, 302)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Waffles')
+        self.assertFalse(Recipe.objects.using('default').exists())
+
+    def test_add_refuses_user_of_other_shard(self):
+        """Test objects are only added on their owner's shard"""
+        url = reverse('admin:core_tag_add')
+        data = {'user': self.user.pk, 'name': 'Vegan'}
+
+        res = self.client.post(url, data)
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(Tag.objects.using('default').exists())
+
+        res = self.client.post(f'{url}?_changelist_filters=shard%3D'
+                               f'{self.shard}', data)
+        self.assertEqual(res.status_code, 302)
+        self.assertTrue(Tag.objects.using(self.shard).exists())
+
+    def test_action_applies_to_chosen_shard(self):
+        """Test bulk actions change the rows of the chosen shard"""
+        self.client.post(f'{self.url}?shard={self.shard}', {
+            'action': 'adjust_price', ACTION_CHECKBOX_NAME: [self.recipe.id],
+            'percent': '100', 'apply': '1',
+        })
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.price, Decimal('2.00'))
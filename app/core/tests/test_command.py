@@ -1,14 +1,31 @@
 """
 Test custom django management commands
 """
-
+import json
+from io import StringIO
 from unittest.mock import patch
 
 from psycopg2 import OperationalError as Psycopg2Error
 
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase
+
+from core import sharding
+from core.management.commands.benchmark_api import (
+    Command as BenchmarkCommand,
+)
+from core.models import (
+    Ingredient,
+    Recipe,
+    Tag,
+    TagStats,
+)
+from core.tests.utils import UserShardTestMixin
 
 
 @patch('core.management.commands.wait_for_db.Command.check', return_value=True)
@@ -33,3 +50,302 @@ class CommandTest(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkCommandTest(UserShardTestMixin, TestCase):
+    """Test the API benchmark command."""
+
+    def test_benchmark_reports_percentiles(self):
+        """Test benchmark seeds data and reports every scenario as JSON"""
+        out = StringIO()
+
+        call_command(
+            'benchmark_api',
+            users=2, recipes=3, tags=2, ingredients=2,
+            requests=5, warmup=1, concurrency=1,
+            stdout=out, stderr=StringIO(),
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {
+            'list', 'detail', 'create', 'update', 'token', 'me',
+        })
+        for result in report['results'].values():
+            self.assertEqual(result['requests'], 5)
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(result['conflicts'], 0)
+            self.assertIsNotNone(result['p99_ms'])
+        users = get_user_model().objects.filter(
+            email__startswith='bench-',
+        ).values_list('pk', flat=True)
+        self.assertEqual(
+            Recipe.objects.filter(user__in=list(users)).count(),
+            2 * 3 + 5 + 1,
+        )
+
+    def test_benchmark_update_conflicts_not_sampled(self):
+        """Test updates refetch a changed version instead of failing"""
+        load_fixtures = BenchmarkCommand.load_fixtures
+
+        def load_then_change(command, user_count):
+            fixtures = load_fixtures(command, user_count)
+            Recipe.objects.update(version=F('version') + 1)
+            return fixtures
+
+        out = StringIO()
+        with patch.object(BenchmarkCommand, 'load_fixtures',
+                          load_then_change):
+            call_command(
+                'benchmark_api', scenarios='update',
+                users=1, recipes=1, tags=1, ingredients=1,
+                requests=3, warmup=0, concurrency=1,
+                stdout=out, stderr=StringIO(),
+            )
+
+        result = json.loads(out.getvalue())['results']['update']
+        self.assertEqual(result['conflicts'], 1)
+        self.assertEqual(result['requests'], 2)
+        self.assertEqual(result['errors'], 0)
+        self.assertEqual(Recipe.objects.get().version, 4)
+
+    def test_benchmark_rejects_unknown_scenario(self):
+        """Test an unknown scenario fails the command"""
+        with self.assertRaises(CommandError):
+            call_command('benchmark_api', scenarios='list,nope',
+                         stdout=StringIO(), stderr=StringIO())
+
+
+class SeedDataCommandTest(UserShardTestMixin, TestCase):
+    """Test the synthetic data generator command."""
+
+    def seed(self, **options):
+        call_command('seed_data', scale=0.05, seed=7, stdout=StringIO(),
+                     **options)
+        users = get_user_model().objects.filter(
+            email__endswith='@seed.example.com',
+        ).values_list('pk', flat=True)
+        return list(
+            Recipe.objects.filter(user__in=list(users))
+            .order_by('id').values_list('title', 'price', 'time_minutes')
+        )
+
+    def test_seed_data_creates_related_rows(self):
+        """Test seeding creates users with tagged recipes"""
+        recipes = self.seed()
+
+        self.assertEqual(
+            get_user_model().objects.filter(
+                email__endswith='@seed.example.com').count(),
+            5,
+        )
+        self.assertGreater(len(recipes), 0)
+        self.assertEqual(
+            set(get_user_model().objects.values_list('shard', flat=True)),
+            {settings.SHARDS[-1]},
+        )
+        self.assertTrue(Recipe.tags.through.objects.exists())
+        self.assertTrue(Recipe.ingredients.through.objects.exists())
+
+    def test_seed_data_is_deterministic(self):
+        """Test the same seed generates the same dataset"""
+        first = self.seed()
+        second = self.seed(clear=True)
+
+        self.assertEqual(first, second)
+        self.assertEqual(Recipe.objects.count(), len(second))
+
+    def test_seed_data_requires_clear(self):
+        """Test seeding twice without clear raises error"""
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class DedupeNamesCommandTest(UserShardTestMixin, TestCase):
+    """Test merging duplicate tag and ingredient names."""
+
+    def setUp(self):
+        # Duplicates can only predate the unique indexes, so drop them for
+        # the duration of the test transaction.
+        with sharding.connection.cursor() as cursor:
+            cursor.execute('DROP INDEX core_tag_user_lower_name_uniq')
+            cursor.execute('DROP INDEX core_ingredient_user_lower_name_uniq')
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123',
+        )
+
+    def create_duplicates(self):
+        tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('Vegan', 'vegan', 'VEGAN')
+        ]
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        Ingredient.objects.create(user=self.user, name='salt')
+        Ingredient.objects.filter(pk=ingredient.pk).update(name=' Salt  ')
+        for tag in tags:
+            recipe = Recipe.objects.create(
+                user=self.user, title='Sample', time_minutes=5, price='1.00',
+            )
+            recipe.tags.add(tag)
+        recipe.tags.add(tags[0])
+        return tags, ingredient
+
+    def test_dedupe_merges_and_repoints(self):
+        """Test duplicates are merged into the oldest row"""
+        tags, ingredient = self.create_duplicates()
+
+        call_command('dedupe_names', stdout=StringIO())
+
+        self.assertEqual(
+            list(Tag.objects.values_list('id', flat=True)), [tags[0].id],
+        )
+        self.assertEqual(Recipe.tags.through.objects.count(), 3)
+        self.assertEqual(TagStats.objects.get(tag=tags[0]).recipe_count, 3)
+        self.assertEqual(
+            list(Ingredient.objects.values_list('id', 'name')),
+            [(ingredient.id, 'Salt')],
+        )
+
+    def test_dedupe_dry_run_changes_nothing(self):
+        """Test --dry-run only reports the duplicates"""
+        self.create_duplicates()
+        out = StringIO()
+
+        call_command('dedupe_names', dry_run=True, stdout=out)
+
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(Ingredient.objects.count(), 2)
+        self.assertIn('Found 2 duplicate tags, 1 duplicate ingredients',
+                      out.getvalue())
+
+
+class GcOrphansCommandTest(TestCase):
+    """Test deleting tags and ingredients without recipes."""
+    # The collection visits every shard.
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123',
+        )
+        recipe = Recipe.objects.create(
+            user=self.user, title='Sample', time_minutes=5, price='1.00',
+        )
+        self.used_tag = Tag.objects.create(user=self.user, name='Used')
+        recipe.tags.add(self.used_tag)
+        recipe.tags.remove(Tag.objects.create(user=self.user, name='Old'))
+        for i in range(4):
+            Tag.objects.create(user=self.user, name=f'Orphan {i}')
+        self.used_ingredient = Ingredient.objects.create(
+            user=self.user, name='Salt',
+        )
+        recipe.ingredients.add(self.used_ingredient)
+        Ingredient.objects.create(user=self.user, name='Pepper')
+
+    def test_gc_orphans_deletes_unused_rows(self):
+        """Test only unreferenced rows are deleted, in batches"""
+        out = StringIO()
+
+        call_command('gc_orphans', batch_size=2, stdout=out)
+
+        self.assertEqual(list(Tag.objects.all()), [self.used_tag])
+        self.assertEqual(list(Ingredient.objects.all()),
+                         [self.used_ingredient])
+        self.assertFalse(TagStats.objects.exclude(tag=self.used_tag).exists())
+        self.assertIn('Deleted 5 orphaned tags out of 6', out.getvalue())
+
+    def test_gc_orphans_dry_run(self):
+        """Test --dry-run counts orphans without deleting them"""
+        out = StringIO()
+
+        call_command('gc_orphans', dry_run=True, kinds=['tag'], stdout=out)
+
+        self.assertEqual(Tag.objects.count(), 6)
+        self.assertIn('Found 5 orphaned tags out of 6', out.getvalue())
+        self.assertNotIn('ingredient', out.getvalue())
+
+
+class ProfileStartupCommandTest(SimpleTestCase):
+    """Test the startup profiler."""
+
+    def test_profile_startup_compares_profiles(self):
+        """Test the API profile boots without the admin and docs apps"""
+        out = StringIO()
+
+        call_command(
+            'profile_startup', profiles=['app.settings', 'app.settings_api'],
+            repeat=1, json=True, stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        full, api = report['app.settings'], report['app.settings_api']
+        self.assertIn('admin', full['apps'])
+        self.assertNotIn('admin', api['apps'])
+        self.assertNotIn('drf_spectacular', api['packages'])
+        self.assertNotIn('numpy', api['packages'])
+        self.assertIn('ready', api['apps']['core'])
+        self.assertLess(api['modules'], full['modules'])
+        self.assertGreater(api['phases']['total'], 0)
+
+    def test_profile_startup_reports_slower_profile(self):
+        """Test a profile booting slower is not reported as faster"""
+        results = {
+            'app.settings': {'phases': {'total': 400.0}, 'apps': {},
+                             'packages': {}, 'modules': 800},
+            'app.settings_api': {'phases': {'total': 500.0}, 'apps': {},
+                                 'packages': {}, 'modules': 700},
+        }
+        out = StringIO()
+
+        with patch(
+            'core.management.commands.profile_startup.Command.profile',
+            side_effect=lambda profile, repeat: results[profile],
+        ):
+            call_command(
+                'profile_startup',
+                profiles=['app.settings', 'app.settings_api'],
+                stdout=out,
+            )
+
+        self.assertIn('app.settings_api boots 100.0 ms slower than '
+                      'app.settings (25%)', out.getvalue())
+        self.assertNotIn('faster', out.getvalue())
+
+
+class BenchmarkCompressionCommandTest(UserShardTestMixin, TestCase):
+    """Test the compression benchmark."""
+
+    def test_benchmark_compression_reports_codings(self):
+        """Test every coding and level is measured on real payloads"""
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='testpass123',
+        )
+        for i in range(20):
+            Recipe.objects.create(
+                user=user, title=f'Recipe {i}', time_minutes=5, price=1,
+            )
+        out = StringIO()
+
+        call_command(
+            'benchmark_compression', gzip_levels=[1, 9],
+            brotli_qualities=[4], repeat=1, json=True, stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        listing = report['recipe list']
+        self.assertEqual(
+            [(row['coding'], row['level']) for row in listing['codings']],
+            [('gzip', 1), ('gzip', 9), ('br', 4)],
+        )
+        for row in listing['codings']:
+            self.assertLess(row['bytes'], listing['bytes'])
+            self.assertLessEqual(row['bytes'], row['stream_bytes'])
+        self.assertIn('recipe detail', report)
+
+    def test_benchmark_compression_requires_recipes(self):
+        """Test a helpful error is raised without any recipes"""
+        with self.assertRaises(CommandError):
+            call_command('benchmark_compression', stdout=StringIO())
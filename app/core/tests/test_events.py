@@ -0,0 +1,309 @@
+"""
+Tests for the change event stream.
+"""
+import json
+import select
+from unittest import mock
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core import events
+from core.models import Recipe, Tag
+
+EVENTS_PATH = '/api/recipe/events/'
+
+
+def create_user(**params):
+    """Create and return a new user."""
+    defaults = {
+        'email': 'user@example.com',
+        'password': 'test@123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+def create_recipe(user, **params):
+    """Create and return a recipe."""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 22,
+        'price': '5.25',
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+async def inner_application(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 204,
+                'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def notification(user, ids, kind='recipe', action='updated'):
+    return {'user': user.pk, 'kind': kind, 'action': action, 'ids': ids}
+
+
+class EventStreamMixin:
+    """Open streams on an ``EventStreamApplication``."""
+
+    def tearDown(self):
+        events.clear()
+        super().tearDown()
+
+    def open(self, token=None, last_event_id=None, method='GET',
+             path=EVENTS_PATH):
+        headers = []
+        if token is not None:
+            headers.append((b'authorization', f'Token {token}'.encode()))
+        if last_event_id is not None:
+            headers.append((b'last-event-id', last_event_id.encode()))
+        communicator = ApplicationCommunicator(
+            events.EventStreamApplication(inner_application),
+            {'type': 'http', 'method': method, 'path': path,
+             'headers': headers},
+        )
+        return communicator
+
+    async def start(self, communicator, status=200):
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        self.assertEqual(start['status'], status)
+        return dict(start['headers'])
+
+    async def read(self, communicator):
+        message = await communicator.receive_output(5)
+        return message['body'].decode()
+
+    async def read_event(self, communicator):
+        """Return the fields of the next event, skipping comments."""
+        while True:
+            body = await self.read(communicator)
+            if not body.startswith((':', 'retry:')):
+                break
+        return dict(
+            line.split(': ', 1) for line in body.strip().split('\n')
+        )
+
+    async def close(self, communicator):
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+
+
+class EventStreamTests(EventStreamMixin, TestCase):
+    """Test the stream application with notifications dispatched directly.
+    """
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user).key
+        # Like the test client, keep the test transaction's connection.
+        patcher = mock.patch('core.events.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_other_requests_pass_through(self):
+        """Test requests to other paths go to the wrapped application"""
+        communicator = self.open(path='/api/recipe/recipes/')
+
+        await self.start(communicator, status=204)
+
+    async def test_auth_required(self):
+        """Test streams require a valid token"""
+        for token in (None, 'invalid'):
+            communicator = self.open(token)
+            headers = await self.start(communicator, status=401)
+            self.assertEqual(headers[b'www-authenticate'], b'Token')
+
+    async def test_inactive_user_rejected(self):
+        """Test a deactivated user can not open a stream"""
+        self.user.is_active = False
+        await sync_to_async(self.user.save)()
+
+        await self.start(self.open(self.token), status=401)
+
+    async def test_only_get_allowed(self):
+        """Test other methods are rejected"""
+        await self.start(self.open(self.token, method='POST'), status=405)
+
+    async def test_stream_events(self):
+        """Test the user's notifications are streamed as events"""
+        other = await sync_to_async(create_user)(email='other@example.com')
+        communicator = self.open(self.token)
+        headers = await self.start(communicator)
+        self.assertEqual(headers[b'content-type'], b'text/event-stream')
+        self.assertEqual(await self.read(communicator), 'retry: 3000\n\n')
+
+        broker = events.get_broker()
+        broker.dispatch(notification(other, [9]))
+        broker.dispatch(notification(self.user, [1, 2], action='created'))
+        event = await self.read_event(communicator)
+
+        self.assertEqual(event['event'], 'recipe.created')
+        self.assertEqual(json.loads(event['data']), {
+            'kind': 'recipe', 'action': 'created', 'ids': [1, 2],
+        })
+        self.assertEqual(event['id'], broker.event_id(2))
+        await self.close(communicator)
+        self.assertEqual(broker.connection_count, 0)
+
+    @override_settings(EVENTS_HEARTBEAT=0.01)
+    async def test_heartbeat(self):
+        """Test idle streams get heartbeat comments"""
+        communicator = self.open(self.token)
+        await self.start(communicator)
+        await self.read(communicator)
+
+        self.assertEqual(await self.read(communicator), ': heartbeat\n\n')
+        await self.close(communicator)
+
+    async def test_resume_from_last_event_id(self):
+        """Test a reconnecting client gets the events it missed"""
+        communicator = self.open(self.token)
+        await self.start(communicator)
+        broker = events.get_broker()
+        broker.dispatch(notification(self.user, [1]))
+        last_event_id = (await self.read_event(communicator))['id']
+        await self.close(communicator)
+
+        broker.dispatch(notification(self.user, [2]))
+        broker.dispatch(notification(self.user, [3], kind='tag'))
+        communicator = self.open(self.token, last_event_id=last_event_id)
+        await self.start(communicator)
+
+        missed = [await self.read_event(communicator) for _ in range(2)]
+        self.assertEqual([event['event'] for event in missed],
+                         ['recipe.updated', 'tag.updated'])
+        self.assertEqual([json.loads(event['data'])['ids']
+                          for event in missed], [[2], [3]])
+        await self.close(communicator)
+
+    @override_settings(EVENTS_BUFFER_SIZE=2)
+    async def test_resume_too_old_resets(self):
+        """Test a client that missed evicted events is told to sync"""
+        broker = events.get_broker()
+        broker.dispatch(notification(self.user, [1]))
+        last_event_id = broker.event_id(broker.seq)
+        for pk in range(2, 5):
+            broker.dispatch(notification(self.user, [pk]))
+
+        for stale_id in (last_event_id, 'unknown-1'):
+            communicator = self.open(self.token, last_event_id=stale_id)
+            await self.start(communicator)
+            event = await self.read_event(communicator)
+            self.assertEqual(event['event'], 'reset')
+            self.assertEqual(event['id'], broker.event_id(4))
+            await self.close(communicator)
+
+    @override_settings(EVENTS_MAX_PENDING=2)
+    async def test_slow_stream_resets(self):
+        """Test a stream too far behind is told to sync instead"""
+        communicator = self.open(self.token)
+        await self.start(communicator)
+        broker = events.get_broker()
+        for pk in range(3):
+            broker.dispatch(notification(self.user, [pk]))
+
+        event = await self.read_event(communicator)
+        self.assertEqual(event['event'], 'reset')
+        broker.dispatch(notification(self.user, [3]))
+        event = await self.read_event(communicator)
+        self.assertEqual(json.loads(event['data'])['ids'], [3])
+        await self.close(communicator)
+
+    @override_settings(EVENTS_MAX_USER_CONNECTIONS=1)
+    async def test_user_connection_limit(self):
+        """Test a user can only hold a limited number of streams"""
+        communicator = self.open(self.token)
+        await self.start(communicator)
+
+        headers = await self.start(self.open(self.token), status=429)
+        self.assertEqual(headers[b'retry-after'], b'3')
+        await self.close(communicator)
+
+    @override_settings(EVENTS_MAX_CONNECTIONS=1)
+    async def test_process_connection_limit(self):
+        """Test a process only holds a limited number of streams"""
+        other = await sync_to_async(create_user)(email='other@example.com')
+        token = await sync_to_async(Token.objects.create)(user=other)
+        communicator = self.open(self.token)
+        await self.start(communicator)
+
+        await self.start(self.open(token.key), status=503)
+        await self.close(communicator)
+
+
+class ChangeNotificationTests(EventStreamMixin, TransactionTestCase):
+    """Test notifications sent by committed writes."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user).key
+
+    def listen(self):
+        conn = psycopg2.connect(**connection.get_connection_params())
+        conn.autocommit = True
+        conn.cursor().execute(f'LISTEN {events.CHANNEL}')
+        self.addCleanup(conn.close)
+        return conn
+
+    def notifications(self, conn):
+        select.select([conn], [], [], 5)
+        conn.poll()
+        payloads = [json.loads(n.payload) for n in conn.notifies]
+        conn.notifies.clear()
+        return payloads
+
+    def test_writes_notify(self):
+        """Test each statement notifies its changed rows by user"""
+        conn = self.listen()
+        recipe = create_recipe(self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+        Recipe.objects.filter(pk=recipe.pk).update(title='New')
+        Recipe.objects.filter(pk=recipe.pk).delete()
+
+        payloads = self.notifications(conn)
+
+        self.assertEqual(
+            [(p['kind'], p['action'], p['ids']) for p in payloads],
+            [('recipe', 'created', [recipe.pk]),
+             ('tag', 'created', [payloads[1]['ids'][0]]),
+             ('recipe', 'updated', [recipe.pk]),
+             ('recipe', 'deleted', [recipe.pk])],
+        )
+        self.assertTrue(all(p['user'] == self.user.pk for p in payloads))
+
+    def test_set_based_writes_notify_in_chunks(self):
+        """Test large statements notify in chunks of ids"""
+        Recipe.objects.bulk_create([
+            Recipe(user=self.user, title=f'Recipe {i}', time_minutes=5,
+                   price='1.00')
+            for i in range(250)
+        ])
+        conn = self.listen()
+
+        Recipe.objects.filter(user=self.user).update(time_minutes=10)
+
+        payloads = self.notifications(conn)
+        self.assertEqual([len(p['ids']) for p in payloads], [200, 50])
+
+    async def test_committed_change_is_streamed(self):
+        """Test a committed write reaches the user's open stream"""
+        communicator = self.open(self.token)
+        await self.start(communicator)
+        await self.read(communicator)
+
+        recipe = await sync_to_async(create_recipe)(self.user)
+        event = await self.read_event(communicator)
+
+        self.assertEqual(event['event'], 'recipe.created')
+        self.assertEqual(json.loads(event['data'])['ids'], [recipe.pk])
+        await self.close(communicator)
@@ -0,0 +1,244 @@
+"""
+Tests for the background job queue.
+"""
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Job
+
+JOBS_URL = reverse('core:job-list')
+CALLS = []
+
+
+@jobs.job('tests.record')
+def record(job_obj):
+    CALLS.append(job_obj.payload)
+    job_obj.set_progress(done=1)
+    return {'echo': job_obj.payload}
+
+
+@jobs.job('tests.explode')
+def explode(job_obj):
+    raise RuntimeError('boom')
+
+
+@jobs.job('tests.wait_for_heartbeat')
+def wait_for_heartbeat(job_obj):
+    """Wait, without reporting progress, for the lock to be refreshed."""
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        locked_at = Job.objects.values_list('locked_at', flat=True) \
+            .get(pk=job_obj.pk)
+        if locked_at > job_obj.locked_at:
+            return {'refreshed': True}
+        time.sleep(0.01)
+    return {'refreshed': False}
+
+
+def run_worker(**options):
+    """Drain the queue with the worker command."""
+    call_command('run_worker', once=True, stdout=StringIO(), **options)
+
+
+class JobQueueTests(TestCase):
+    """Test enqueueing, claiming and running jobs."""
+
+    def setUp(self):
+        CALLS.clear()
+
+    def test_enqueue_unknown_job_raises_error(self):
+        """Test enqueueing a job without a handler fails"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue('tests.missing')
+
+    def test_worker_runs_job(self):
+        """Test the worker runs queued jobs and stores the result"""
+        job_obj = jobs.enqueue('tests.record', {'value': 1})
+
+        run_worker()
+
+        job_obj.refresh_from_db()
+        self.assertEqual(CALLS, [{'value': 1}])
+        self.assertEqual(job_obj.status, Job.SUCCEEDED)
+        self.assertEqual(job_obj.result, {'echo': {'value': 1}})
+        self.assertEqual(job_obj.progress, {'done': 1})
+        self.assertEqual(job_obj.attempts, 1)
+
+    def test_worker_skips_future_jobs(self):
+        """Test jobs scheduled in the future are not claimed yet"""
+        jobs.enqueue(
+            'tests.record',
+            run_after=timezone.now() + timedelta(hours=1),
+        )
+
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_failed_job_is_retried_with_backoff(self):
+        """Test a failing job is requeued with a later run_after"""
+        job_obj = jobs.enqueue('tests.explode', max_attempts=3)
+
+        run_worker()
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.QUEUED)
+        self.assertEqual(job_obj.attempts, 1)
+        self.assertGreater(job_obj.run_after, timezone.now())
+        self.assertIn('boom', job_obj.last_error)
+
+    def test_job_fails_after_max_attempts(self):
+        """Test a job is marked failed once attempts are exhausted"""
+        job_obj = jobs.enqueue('tests.explode', max_attempts=1)
+
+        run_worker()
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.FAILED)
+
+    def test_max_jobs_limits_worker(self):
+        """Test the worker stops after --max-jobs jobs"""
+        for i in range(3):
+            jobs.enqueue('tests.record', {'value': i})
+
+        run_worker(max_jobs=2)
+
+        self.assertEqual(len(CALLS), 2)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_requeue_stale_jobs(self):
+        """Test abandoned running jobs return to the queue"""
+        job_obj = jobs.enqueue('tests.record')
+        Job.objects.filter(pk=job_obj.pk).update(
+            status=Job.RUNNING,
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 1)
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.QUEUED)
+
+    def test_requeue_stale_fails_exhausted_jobs(self):
+        """Test stale jobs out of attempts are failed, not requeued"""
+        job_obj = jobs.enqueue('tests.record', max_attempts=2)
+        Job.objects.filter(pk=job_obj.pk).update(
+            status=Job.RUNNING,
+            attempts=2,
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 1)
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.FAILED)
+        self.assertEqual(job_obj.locked_by, '')
+
+    def test_progress_refreshes_lock(self):
+        """Test reporting progress keeps a long job from going stale"""
+        jobs.enqueue('tests.record')
+        job_obj = jobs.claim('worker-1')
+        Job.objects.filter(pk=job_obj.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        job_obj.set_progress(done=1)
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 0)
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.RUNNING)
+
+    def test_heartbeat_refreshes_lock(self):
+        """Test the heartbeat keeps the lock of the worker running a job"""
+        jobs.enqueue('tests.record')
+        job_obj = jobs.claim('worker-1')
+        Job.objects.filter(pk=job_obj.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertFalse(jobs.heartbeat(job_obj.pk, 'worker-2'))
+        self.assertTrue(jobs.heartbeat(job_obj.pk, 'worker-1'))
+
+        self.assertEqual(jobs.requeue_stale(timeout=60), 0)
+
+    def test_run_discards_outcome_after_lock_lost(self):
+        """Test a worker whose job was requeued does not overwrite it"""
+        jobs.enqueue('tests.record')
+        job_obj = jobs.claim('worker-1')
+        Job.objects.filter(pk=job_obj.pk).update(
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+        jobs.requeue_stale(timeout=60)
+        jobs.claim('worker-2')
+
+        jobs.run(job_obj)
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.RUNNING)
+        self.assertEqual(job_obj.locked_by, 'worker-2')
+        self.assertEqual(job_obj.progress, {})
+
+
+class WorkerHeartbeatTests(TransactionTestCase):
+    """Test the worker refreshes the locks of the jobs it runs."""
+
+    def test_worker_refreshes_lock_while_job_runs(self):
+        """Test a job not reporting progress keeps its lock fresh"""
+        job_obj = jobs.enqueue('tests.wait_for_heartbeat')
+
+        run_worker(heartbeat=0.05)
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.SUCCEEDED)
+        self.assertEqual(job_obj.result, {'refreshed': True})
+        self.assertIsNone(job_obj.locked_at)
+
+
+class JobApiTests(TestCase):
+    """Test the job status API."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_auth_required(self):
+        """Test authentication is required for job status"""
+        res = APIClient().get(JOBS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_list_jobs_limited_to_user(self):
+        """Test users only see their own jobs"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com',
+            password='test@123',
+        )
+        job_obj = jobs.enqueue('tests.record', user=self.user)
+        jobs.enqueue('tests.record', user=other)
+
+        res = self.client.get(JOBS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([j['id'] for j in res.data], [job_obj.id])
+
+    def test_retrieve_job_status(self):
+        """Test retrieving a job shows its status and progress"""
+        job_obj = jobs.enqueue('tests.record', user=self.user)
+        run_worker()
+
+        res = self.client.get(reverse('core:job-detail', args=[job_obj.id]))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], Job.SUCCEEDED)
+        self.assertEqual(res.data['progress'], {'done': 1})
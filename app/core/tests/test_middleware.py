@@ -0,0 +1,123 @@
+"""
+Tests for response compression.
+"""
+import gzip
+import zlib
+
+import brotli
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core.middleware import CompressionMiddleware, accepted_encodings
+
+BODY = b'{"title": "Sample recipe", "time_minutes": 5}' * 100
+
+
+def respond(body=BODY, content_type='application/json', headers=None):
+    def get_response(request):
+        response = HttpResponse(body, content_type=content_type)
+        for name, value in (headers or {}).items():
+            response[name] = value
+        return response
+    return get_response
+
+
+@override_settings(
+    COMPRESSION_MIN_SIZE=1024,
+    COMPRESSION_GZIP_LEVEL=6,
+    COMPRESSION_BROTLI_QUALITY=4,
+)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Test negotiated compression of responses."""
+
+    def get(self, get_response, accept='gzip, deflate, br'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return CompressionMiddleware(get_response)(request)
+
+    def test_accepted_encodings(self):
+        """Test quality values are parsed from Accept-Encoding"""
+        self.assertEqual(
+            accepted_encodings('gzip;q=0.8, BR, identity ; q=0, *;q=0.1'),
+            {'gzip': 0.8, 'br': 1.0, 'identity': 0.0, '*': 0.1},
+        )
+
+    def test_brotli_preferred(self):
+        """Test brotli is used when accepted as much as gzip"""
+        res = self.get(respond())
+
+        self.assertEqual(res['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(res.content), BODY)
+        self.assertEqual(res['Content-Length'], str(len(res.content)))
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+
+    def test_gzip_by_quality(self):
+        """Test the client's quality values decide the coding"""
+        res = self.get(respond(), accept='br;q=0.5, gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(res.content), BODY)
+
+    @override_settings(COMPRESSION_BROTLI_QUALITY=None)
+    def test_disabled_coding_not_used(self):
+        """Test a coding set to None is never negotiated"""
+        res = self.get(respond(), accept='br')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res.content, BODY)
+
+    def test_small_body_not_compressed(self):
+        """Test bodies under the threshold are sent as is"""
+        res = self.get(respond(body=b'{}'))
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertFalse(res.has_header('Vary'))
+
+    def test_binary_content_not_compressed(self):
+        """Test content types that are already compressed are skipped"""
+        res = self.get(respond(content_type='image/jpeg'))
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_encoded_response_not_compressed_again(self):
+        """Test responses with a Content-Encoding are left alone"""
+        res = self.get(respond(headers={'Content-Encoding': 'gzip'}))
+
+        self.assertEqual(res.content, BODY)
+
+    def test_identity_only(self):
+        """Test clients that accept no coding get the body as is"""
+        res = self.get(respond(), accept='identity')
+
+        self.assertEqual(res.content, BODY)
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+
+    def test_strong_etag_weakened(self):
+        """Test a strong ETag is made weak on the compressed body"""
+        def get_response(request):
+            response = respond()(request)
+            response['ETag'] = '"abc"'
+            return response
+
+        res = self.get(get_response)
+
+        self.assertEqual(res['ETag'], 'W/"abc"')
+
+    def test_streaming_compressed_incrementally(self):
+        """Test every streamed chunk is flushed as it is produced"""
+        chunks = [b'data: %d\n\n' % i for i in range(3)]
+        decompressor = zlib.decompressobj(31)
+
+        def get_response(request):
+            return StreamingHttpResponse(
+                iter(chunks), content_type='text/event-stream',
+            )
+
+        res = self.get(get_response, accept='gzip')
+        stream = iter(res.streaming_content)
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        for chunk in chunks:
+            self.assertEqual(decompressor.decompress(next(stream)), chunk)
+        decompressor.decompress(b''.join(stream))
+        self.assertTrue(decompressor.eof)
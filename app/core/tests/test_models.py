@@ -1,11 +1,14 @@
 """Test for models"""
 from decimal import Decimal  # noqa: F401
+from threading import Thread
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from faker import Faker
 
-from core import models
+from core import models, orphans
 
 
 def create_user(email='user@example.com', password='test@123'):
@@ -99,3 +102,66 @@ class ModelTests(TestCase):
 
         self.assertIsNotNone(ingredient)
         self.assertEqual(str(ingredient), ingredient.name)
+
+    def test_tag_name_normalized(self):
+        """Test tag names are stripped and inner whitespace collapsed"""
+        tag = models.Tag.objects.create(
+            user=create_user(),
+            name='  Comfort \t  Food ',
+        )
+
+        self.assertEqual(tag.name, 'Comfort Food')
+
+    def test_get_or_create_names(self):
+        """Test names are matched ignoring case and created once"""
+        user = create_user()
+        existing = models.Tag.objects.create(user=user, name='Vegan')
+
+        tags = models.Tag.objects.get_or_create_names(
+            user, ['vegan', 'Quick ', ' quick', 'Dinner'],
+        )
+
+        self.assertEqual([t.name for t in tags], ['Vegan', 'Quick', 'Dinner'])
+        self.assertEqual(tags[0].id, existing.id)
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 3)
+
+    @patch('core.models.uuid.uuid4')
+    def test_recipe_file_name_uuid(self, mock_uuid):
+        """Test generating image path."""
+        uuid = 'test-uuid'
+        mock_uuid.return_value = uuid
+        file_path = models.recipe_image_file_path(None, 'example.JPG')
+
+        self.assertEqual(file_path, f'uploads/recipe/{uuid}.jpg')
+
+
+class NameLockTests(TransactionTestCase):
+    """Test reused names are safe from the orphan collector"""
+
+    def collect_orphans(self):
+        """Run the orphan collector on its own connection."""
+        def collect():
+            try:
+                list(orphans.collect('tag'))
+            finally:
+                connection.close()
+        thread = Thread(target=collect)
+        thread.start()
+        thread.join()
+
+    def test_reused_orphan_kept_until_linked(self):
+        """Test an orphan returned for reuse is not collected before its
+        link is written"""
+        user = create_user()
+        orphan = models.Tag.objects.create(user=user, name='Vegan')
+        recipe = models.Recipe.objects.create(
+            user=user, title='Curry', time_minutes=5, price=1,
+        )
+
+        with transaction.atomic():
+            tag, = models.Tag.objects.get_or_create_names(user, ['vegan'])
+            self.collect_orphans()
+            recipe.tags.add(tag)
+
+        self.assertEqual(tag.id, orphan.id)
+        self.assertEqual(list(recipe.tags.all()), [orphan])
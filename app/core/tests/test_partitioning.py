@@ -0,0 +1,212 @@
+"""
+Tests for the partitioned recipe tables.
+"""
+import re
+from collections import defaultdict
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import partitioning
+from core.models import Ingredient, Recipe, RecipeTag, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+PARTITIONED = re.compile(r'\bcore_recipe(_tags|_ingredients)?\b')
+
+PARTITION = re.compile(r'\b(core_recipe(?:_tags|_ingredients)?)_p(\d+)\b')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(**params):
+    """Create and return a new user."""
+    defaults = {
+        'email': 'user@example.com',
+        'password': 'test@123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+def create_recipes(user, count=3):
+    """Create recipes linked to one tag and one ingredient."""
+    tag = Tag.objects.create(user=user, name='Vegan')
+    ingredient = Ingredient.objects.create(user=user, name='Salt')
+    recipes = []
+    for i in range(count):
+        recipe = Recipe.objects.create(user=user, title=f'Recipe {i}',
+                                       time_minutes=5, price='2.00')
+        recipe.tags.add(tag)
+        recipe.ingredients.add(ingredient)
+        recipes.append(recipe)
+    return recipes, tag, ingredient
+
+
+class PartitionedTablesTests(TestCase):
+    """Test migrated tables are partitioned and pruned."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.recipes, self.tag, self.ingredient = create_recipes(self.user)
+        # Users spread over the partitions.
+        for i in range(partitioning.PARTITIONS):
+            create_recipes(create_user(email=f'user{i}@example.com'), 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tables_partitioned(self):
+        """Test the recipe and link tables are hash partitioned"""
+        with connection.cursor() as cursor:
+            for table in partitioning.TABLES:
+                self.assertTrue(partitioning.is_partitioned(cursor, table))
+                self.assertFalse(partitioning.has_shadow(cursor, table))
+                cursor.execute(
+                    'SELECT COUNT(*) FROM pg_inherits '
+                    'WHERE inhparent = %s::regclass', [table],
+                )
+                self.assertEqual(cursor.fetchone()[0],
+                                 partitioning.PARTITIONS)
+
+    def test_view_queries_pruned(self):
+        """Test every recipe and link query of the views reads one
+        partition of each table"""
+        recipe = self.recipes[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(RECIPES_URL, {'tags': str(self.tag.pk)})
+            self.client.get(detail_url(recipe.pk))
+            self.client.get(reverse('recipe:recipe-similar',
+                                    args=[recipe.pk]))
+            self.client.get(reverse('recipe:recipe-cook-with'),
+                            {'ingredients': str(self.ingredient.pk)})
+            res = self.client.post(RECIPES_URL, {
+                'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+                'tags': [{'name': 'Warm'}],
+            }, format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            self.client.patch(detail_url(recipe.pk), {
+                'title': 'New', 'tags': [{'name': 'Cold'}],
+            }, format='json')
+            self.client.put(detail_url(recipe.pk), {
+                'title': 'Newer', 'time_minutes': 5, 'price': '1.00',
+            }, format='json')
+            self.client.post(
+                reverse('recipe:tag-assign', args=[self.tag.pk]),
+                {'recipes': [r.pk for r in self.recipes]}, format='json',
+            )
+            self.client.post(
+                reverse('recipe:tag-unassign', args=[self.tag.pk]),
+                {'filter': {'ingredients': [self.ingredient.pk]}},
+                format='json',
+            )
+            self.client.get(reverse('recipe:sync'))
+            self.client.delete(detail_url(self.recipes[1].pk))
+
+        checked = 0
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                # The ORM deletes by primary key and by recipe alone (see
+                # core.partitioning).
+                if not PARTITIONED.search(sql) or \
+                        sql.startswith(('INSERT', 'SAVEPOINT', 'RELEASE',
+                                        'DELETE FROM "core_recipe')):
+                    continue
+                cursor.execute('EXPLAIN ' + sql)
+                plan = '\n'.join(line for line, in cursor.fetchall())
+                scanned = defaultdict(set)
+                for table, partition in PARTITION.findall(plan):
+                    scanned[table].add(partition)
+                for table, partitions in scanned.items():
+                    self.assertEqual(len(partitions), 1, f'{sql}\n{plan}')
+                checked += 1
+        self.assertGreater(checked, 10)
+
+    def test_links_carry_owner(self):
+        """Test links added without their owner get the tag's owner"""
+        tag = Tag.objects.create(user=self.user, name='Quick')
+
+        self.recipes[0].tags.add(tag)
+
+        self.assertEqual(RecipeTag.objects.get(tag=tag).user, self.user)
+
+
+class PartitionRecipesCommandTests(TransactionTestCase):
+    """Test partitioning tables holding rows."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = create_user()
+        self.recipes, self.tag, _ = create_recipes(self.user)
+        with connection.cursor() as cursor:
+            self.unpartition(cursor)
+
+    def unpartition(self, cursor):
+        """Turn the tables back into plain tables awaiting the command."""
+        for table in partitioning.TABLES:
+            shadow = partitioning.shadow_name(table)
+            cursor.execute(
+                f'CREATE TABLE {shadow} (LIKE {table} INCLUDING ALL)'
+            )
+            cursor.execute(f'INSERT INTO {shadow} SELECT * FROM {table}')
+        partitioning.swap(cursor)
+        for table in partitioning.TABLES:
+            partitioning.create_shadow(cursor, table)
+
+    def test_partition_tables_online(self):
+        """Test rows and writes during the copy reach the partitions"""
+        changed, deleted, _ = self.recipes
+        deleted_id = deleted.pk
+        catch_up = partitioning.catch_up
+
+        def write_during_copy(cursor, since, batch_size):
+            if not writes:
+                writes.append(True)
+                Recipe.objects.filter(pk=changed.pk).update(title='Renamed')
+                changed.tags.add(Tag.objects.create(user=self.user,
+                                                    name='New'))
+                deleted.delete()
+            return catch_up(cursor, since, batch_size)
+
+        writes = []
+        out = StringIO()
+        with mock.patch('core.partitioning.catch_up', write_during_copy):
+            call_command('partition_recipes', batch_size=2, stdout=out)
+
+        self.assertIn('default: partitioned', out.getvalue())
+        with connection.cursor() as cursor:
+            for table in partitioning.TABLES:
+                self.assertTrue(partitioning.is_partitioned(cursor, table))
+                self.assertFalse(partitioning.has_shadow(cursor, table))
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('title', flat=True)),
+            ['Recipe 2', 'Renamed'],
+        )
+        self.assertEqual(
+            sorted(Recipe.objects.get(pk=changed.pk).tags
+                   .values_list('name', flat=True)),
+            ['New', 'Vegan'],
+        )
+        self.assertEqual(Recipe.tags.through.objects.count(), 3)
+        self.assertEqual(Recipe.ingredients.through.objects.count(), 2)
+
+        # Triggers and sequences moved with the tables.
+        recipe = Recipe.objects.create(user=self.user, title='Late',
+                                       time_minutes=5, price='1.00')
+        self.assertGreater(recipe.pk, deleted_id)
+        self.assertIsNotNone(Recipe.objects.get(pk=recipe.pk).change_xid)
+
+        out = StringIO()
+        call_command('partition_recipes', stdout=out)
+        self.assertIn('default: already partitioned', out.getvalue())
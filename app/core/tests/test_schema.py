@@ -0,0 +1,125 @@
+"""
+Tests for the prebuilt OpenAPI schema.
+"""
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import schema
+
+SCHEMA_URL = reverse('api-schema')
+DOCS_URL = reverse('api-docs')
+
+
+class SchemaTests(TestCase):
+    """Test building and serving the cached schema."""
+
+    def setUp(self):
+        self.schema_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_root)
+        settings_override = override_settings(SCHEMA_ROOT=self.schema_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_build_schema_writes_compressed_files(self):
+        """Test the command stores a gzip file per format"""
+        call_command('build_schema', stdout=StringIO())
+
+        with open(os.path.join(self.schema_root, 'openapi.json.gz'),
+                  'rb') as fh:
+            content = gzip.decompress(fh.read())
+        self.assertIn(b'/api/recipe/recipes/', content)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.schema_root, 'openapi.yaml.gz')),
+        )
+
+    def test_schema_is_generated_once(self):
+        """Test requests serve the stored artifact without regenerating"""
+        call_command('build_schema', stdout=StringIO())
+
+        with patch('core.schema.build') as build:
+            self.client.get(SCHEMA_URL)
+            self.client.get(SCHEMA_URL, {'format': 'json'})
+
+        build.assert_not_called()
+
+    def test_missing_schema_is_built_on_first_use(self):
+        """Test the artifact is built when the command has not run"""
+        res = self.client.get(SCHEMA_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'application/vnd.oai.openapi')
+        self.assertIn(b'openapi:', res.content)
+
+    def test_schema_served_compressed_with_etag(self):
+        """Test gzip capable clients get the stored bytes and an ETag"""
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn(b'openapi:', gzip.decompress(res.content))
+        self.assertIn('no-cache', res['Cache-Control'])
+
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='gzip',
+                              HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_schema_etag_depends_on_coding(self):
+        """Test the gzip and identity bodies are validated separately"""
+        gzipped = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='gzip')
+        identity = self.client.get(SCHEMA_URL,
+                                   HTTP_ACCEPT_ENCODING='identity')
+
+        self.assertNotEqual(gzipped['ETag'], identity['ETag'])
+        self.assertIn('Accept-Encoding', identity['Vary'])
+
+        res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING='identity',
+                              HTTP_IF_NONE_MATCH=gzipped['ETag'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, identity.content)
+
+    def test_schema_respects_refused_gzip(self):
+        """Test gzip;q=0 gets the uncompressed schema"""
+        for header in ('gzip;q=0', 'identity, GZIP; q=0.0'):
+            res = self.client.get(SCHEMA_URL, HTTP_ACCEPT_ENCODING=header)
+
+            self.assertFalse(res.has_header('Content-Encoding'))
+            self.assertIn(b'openapi:', res.content)
+
+    def test_versioned_schema_is_cached_forever(self):
+        """Test a URL carrying the current ETag is immutable"""
+        etag = schema.load('json').etag
+
+        res = self.client.get(SCHEMA_URL, {'format': 'json', 'v': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertEqual(res.json()['openapi'][:2], '3.')
+
+    def test_docs_use_versioned_schema(self):
+        """Test the docs page points at the current schema version"""
+        etag = schema.load('json').etag
+
+        res = self.client.get(DOCS_URL)
+
+        self.assertContains(res, etag)
+
+    def test_thumbnails_documented_as_url_map(self):
+        """Test method fields are documented with their shape"""
+        res = self.client.get(SCHEMA_URL, {'format': 'json'})
+
+        recipe = res.json()['components']['schemas']['Recipe']
+        self.assertEqual(recipe['properties']['thumbnails']['type'],
+                         'object')
+        self.assertEqual(
+            recipe['properties']['thumbnails']['additionalProperties'],
+            {'type': 'string', 'format': 'uri'},
+        )
@@ -0,0 +1,291 @@
+"""
+Tests for user sharding.
+
+The tests moving data need shard databases; run them with, for example:
+
+    DB_SHARDS=recipe_app_shard_1,recipe_app_shard_2 SHARD_RING=default \
+        python manage.py test
+
+(Test databases are created for every shard; the named ones need not
+exist.)
+"""
+from collections import Counter
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import sharding, sync
+from core.models import Ingredient, Recipe, RecipeStats, Tag, TagStats
+from core.rebalance import Move
+
+RECIPES_URL = reverse('recipe:recipe-list')
+SYNC_URL = reverse('recipe:sync')
+
+MULTIPLE_SHARDS = len(settings.SHARDS) > 1
+
+
+def create_user(**params):
+    """Create and return a new user."""
+    defaults = {
+        'email': 'user@example.com',
+        'password': 'test@123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+class HashRingTests(SimpleTestCase):
+    """Test placement by consistent hashing."""
+
+    def test_keys_spread_over_aliases(self):
+        """Test every alias gets a fair share of the keys"""
+        ring = sharding.HashRing(['a', 'b', 'c'])
+
+        counts = Counter(ring.node(key) for key in range(3000))
+
+        self.assertEqual(set(counts), {'a', 'b', 'c'})
+        self.assertTrue(all(700 < n < 1300 for n in counts.values()))
+
+    def test_new_alias_only_takes_keys(self):
+        """Test adding an alias only moves keys to it"""
+        before = sharding.HashRing(['a', 'b', 'c'])
+        after = sharding.HashRing(['a', 'b', 'c', 'd'])
+
+        moved = [key for key in range(3000)
+                 if before.node(key) != after.node(key)]
+
+        self.assertEqual({after.node(key) for key in moved}, {'d'})
+        self.assertTrue(500 < len(moved) < 1000)
+
+    @override_settings(SHARD_RING=['default', 'other'])
+    def test_placement_uses_ring_setting(self):
+        """Test users are placed on the shards of SHARD_RING"""
+        ring = sharding.HashRing(['default', 'other'])
+
+        self.assertEqual([sharding.placement(pk) for pk in range(50)],
+                         [ring.node(pk) for pk in range(50)])
+
+
+class ShardRoutingTests(SimpleTestCase):
+    """Test routing by the active shard."""
+
+    def test_user_data_follows_active_shard(self):
+        """Test user data is routed to the active shard"""
+        router = sharding.ShardRouter()
+
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+        with sharding.use_shard('other'):
+            self.assertEqual(router.db_for_read(Recipe), 'other')
+            self.assertEqual(router.db_for_write(Recipe.tags.through),
+                             'other')
+            self.assertEqual(router.db_for_read(get_user_model()),
+                             'default')
+        self.assertEqual(sharding.current(), 'default')
+
+    def test_related_objects_follow_instance(self):
+        """Test related user data is read from its instance's shard"""
+        router = sharding.ShardRouter()
+        recipe = Recipe()
+        recipe._state.db = 'other'
+
+        self.assertEqual(router.db_for_read(Tag, instance=recipe), 'other')
+        self.assertEqual(
+            router.db_for_read(get_user_model(), instance=recipe),
+            'default',
+        )
+
+    def test_cursor_of_other_shard_expired(self):
+        """Test a sync cursor is only valid on the shard issuing it"""
+        cursor = sync.encode_cursor((10, 0, 1))
+
+        self.assertEqual(sync.decode_cursor(cursor), (10, 0, 1))
+        with sharding.use_shard('other'):
+            with self.assertRaises(sync.ExpiredCursor):
+                sync.decode_cursor(cursor)
+
+
+@skipUnless(MULTIPLE_SHARDS, 'needs DB_SHARDS')
+class ShardedDataTests(TransactionTestCase):
+    """Test users' data on shard databases."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.shard = settings.SHARDS[1]
+        with override_settings(SHARD_RING=['default']):
+            self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_data(self):
+        """Give the user recipes, tags, ingredients and a deletion."""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5,
+                price='2.00',
+            )
+            recipe.tags.add(tag)
+            recipe.ingredients.add(ingredient)
+        Tag.objects.create(user=self.user, name='Gone').delete()
+        return tag, ingredient
+
+    def rows(self, alias):
+        """Return the user's row counts on `alias`."""
+        user = self.user.pk
+        return {
+            'recipes': Recipe.objects.using(alias).filter(user=user).count(),
+            'tags': Tag.objects.using(alias).filter(user=user).count(),
+            'ingredients':
+                Ingredient.objects.using(alias).filter(user=user).count(),
+            'tag_links': Recipe.tags.through.objects.using(alias)
+                .filter(recipe__user=user).count(),
+            'ingredient_links': Recipe.ingredients.through.objects
+                .using(alias).filter(recipe__user=user).count(),
+            'recipe_stats':
+                RecipeStats.objects.using(alias).filter(user=user).count(),
+            'tag_stats':
+                TagStats.objects.using(alias).filter(user=user).count(),
+        }
+
+    def move(self, **options):
+        call_command('rebalance_shards', users=[self.user.pk],
+                     target=self.shard, grace=0, stdout=StringIO(),
+                     **options)
+        self.user.refresh_from_db()
+
+    @override_settings(SHARD_RING=['default'])
+    def test_new_user_placed_on_ring(self):
+        """Test new users are placed on a shard of the ring"""
+        with override_settings(SHARD_RING=[self.shard]):
+            other = create_user(email='other@example.com')
+
+        self.assertEqual(self.user.shard, 'default')
+        self.assertEqual(other.shard, self.shard)
+
+    def test_requests_use_user_shard(self):
+        """Test a user's requests read and write their shard"""
+        self.user.shard = self.shard
+        self.user.save()
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+            'tags': [{'name': 'Warm'}],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Recipe.objects.using('default').exists())
+        recipe = Recipe.objects.using(self.shard).get()
+        self.assertGreaterEqual(
+            recipe.pk, sharding.sequence_start(self.shard),
+        )
+        self.assertEqual(list(recipe.tags.values_list('name', flat=True)),
+                         ['Warm'])
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual([r['id'] for r in res.data],
+                         [recipe.pk])
+
+    def test_rebalance_moves_user(self):
+        """Test a user's rows are moved with their ids"""
+        self.create_data()
+        before = self.rows('default')
+        ids = sorted(Recipe.objects.using('default').values_list('id',
+                                                                 flat=True))
+
+        self.move()
+
+        self.assertEqual(self.user.shard, self.shard)
+        self.assertFalse(self.user.shard_locked)
+        self.assertEqual(self.rows(self.shard), before)
+        self.assertEqual(set(self.rows('default').values()), {0})
+        self.assertEqual(
+            sorted(Recipe.objects.using(self.shard).values_list('id',
+                                                                flat=True)),
+            ids,
+        )
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(sorted(r['id'] for r in res.data), ids)
+
+    def test_rebalance_catches_up_on_changes(self):
+        """Test writes made while rows are copied are moved too"""
+        tag, ingredient = self.create_data()
+        recipe = Recipe.objects.order_by('id').first()
+        copy_pass = Move.copy_pass
+
+        def write_after_first_pass(move, since, stats=False):
+            horizon = copy_pass(move, since, stats)
+            if move.passes == 1:
+                self.client.patch(
+                    f'{RECIPES_URL}{recipe.pk}/',
+                    {'title': 'Renamed', 'tags': [{'name': 'New'}]},
+                    format='json',
+                )
+                Tag.objects.filter(pk=tag.pk).delete()
+                Ingredient.objects.filter(pk=ingredient.pk).update(
+                    name='Sea salt',
+                )
+            return horizon
+
+        with mock.patch.object(Move, 'copy_pass', write_after_first_pass):
+            self.move()
+
+        moved = Recipe.objects.using(self.shard).get(pk=recipe.pk)
+        self.assertEqual(moved.title, 'Renamed')
+        self.assertEqual(list(moved.tags.values_list('name', flat=True)),
+                         ['New'])
+        self.assertFalse(Tag.objects.using(self.shard).filter(
+            pk=tag.pk).exists())
+        self.assertEqual(
+            Ingredient.objects.using(self.shard).get(pk=ingredient.pk).name,
+            'Sea salt',
+        )
+        self.assertEqual(self.rows(self.shard)['tag_links'], 1)
+        self.assertEqual(set(self.rows('default').values()), {0})
+
+    def test_sync_restarts_after_move(self):
+        """Test a sync cursor of the old shard must start over"""
+        self.create_data()
+        cursor = self.client.get(SYNC_URL).data['cursor']
+
+        self.move()
+
+        res = self.client.get(SYNC_URL, {'since': cursor})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        res = self.client.get(SYNC_URL)
+        self.assertEqual(len(res.data['recipes']), 3)
+
+    def test_writes_refused_while_moving(self):
+        """Test a moving user can read but not write"""
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            shard_locked=True,
+        )
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Soup', 'time_minutes': 5, 'price': '1.00',
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '5')
+        self.assertEqual(self.client.get(RECIPES_URL).status_code,
+                         status.HTTP_200_OK)
+
+    def test_dry_run(self):
+        """Test a dry run only counts the users to move"""
+        self.create_data()
+        out = StringIO()
+
+        call_command('rebalance_shards', users=[self.user.pk],
+                     target=self.shard, dry_run=True, stdout=out)
+
+        self.assertIn(f'default -> {self.shard}: 1 users', out.getvalue())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, 'default')
+        self.assertEqual(self.rows(self.shard)['recipes'], 0)
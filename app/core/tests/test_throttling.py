@@ -0,0 +1,158 @@
+"""
+Tests for token bucket throttling.
+"""
+import multiprocessing
+import os
+import tempfile
+import uuid
+from multiprocessing import resource_tracker
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import throttling
+from core.tests.utils import UserShardTestMixin
+
+TOKEN_URL = reverse('user:token')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def consume_many(name, count, results):
+    """Take `count` tokens from a shared bucket in a separate process."""
+    backend = throttling.SharedMemoryBackend(name=name, slots=64)
+    results.put(sum(
+        backend.consume('user:1', 100, 0.0001)[0] for _ in range(count)
+    ))
+
+
+class BackendTestsMixin:
+    """Behaviour every throttle backend must have."""
+
+    def test_burst_then_deny(self):
+        """Test a full bucket allows a burst of its capacity"""
+        allowed = [self.backend.consume('k', 3, 1, now=10)[0]
+                   for _ in range(4)]
+
+        self.assertEqual(allowed, [True, True, True, False])
+
+    def test_wait_and_refill(self):
+        """Test the wait until the next token and refilling over time"""
+        for _ in range(2):
+            self.backend.consume('k', 2, 0.5, now=0)
+
+        allowed, wait = self.backend.consume('k', 2, 0.5, now=1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+
+        allowed, _ = self.backend.consume('k', 2, 0.5, now=2)
+        self.assertTrue(allowed)
+
+    def test_keys_are_independent(self):
+        """Test buckets of different keys do not share tokens"""
+        self.backend.consume('a', 1, 1, now=0)
+
+        self.assertFalse(self.backend.consume('a', 1, 1, now=0)[0])
+        self.assertTrue(self.backend.consume('b', 1, 1, now=0)[0])
+
+
+class LocalMemoryBackendTests(BackendTestsMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.backend = throttling.LocalMemoryBackend(max_keys=100)
+
+    def test_least_recently_used_keys_are_evicted(self):
+        """Test the bucket count stays bounded"""
+        backend = throttling.LocalMemoryBackend(max_keys=2)
+        for key in 'abc':
+            backend.consume(key, 1, 1, now=0)
+
+        self.assertEqual(list(backend._buckets), ['b', 'c'])
+
+
+class SharedMemoryBackendTests(BackendTestsMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.name = f'recipe-test-{uuid.uuid4().hex[:12]}'
+        self.backend = throttling.SharedMemoryBackend(name=self.name,
+                                                      slots=64)
+        self.addCleanup(self.remove_segment)
+
+    def remove_segment(self):
+        shm = self.backend._shm
+        shm.close()
+        # The backend unregistered the segment; unlink() unregisters again.
+        resource_tracker.register(shm._name, 'shared_memory')
+        shm.unlink()
+        os.close(self.backend._fd)
+        os.unlink(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'))
+
+    def test_state_is_shared_between_processes(self):
+        """Test workers on a host draw from the same buckets"""
+        results = multiprocessing.get_context('fork').Queue()
+        workers = [
+            multiprocessing.get_context('fork').Process(
+                target=consume_many, args=(self.name, 60, results),
+            )
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(sum(results.get() for _ in workers), 100)
+
+
+@override_settings(REST_FRAMEWORK={
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '100/min',
+        'user': '3/min',
+        'user:token': '2/min',
+    },
+})
+class ThrottleApiTests(UserShardTestMixin, TestCase):
+    """Test throttling of API requests."""
+
+    def setUp(self):
+        throttling.get_backend().clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.client = APIClient()
+
+    def test_user_requests_throttled(self):
+        """Test authenticated users get 429 once their bucket is empty"""
+        self.client.force_authenticate(self.user)
+
+        codes = [self.client.get(RECIPES_URL).status_code for _ in range(4)]
+
+        self.assertEqual(codes[:3], [status.HTTP_200_OK] * 3)
+        self.assertEqual(codes[3], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_token_endpoint_has_own_bucket(self):
+        """Test the token endpoint is limited by its scoped rate"""
+        payload = {'email': 'user@example.com', 'password': 'testpass123'}
+
+        codes = [self.client.post(TOKEN_URL, payload).status_code
+                 for _ in range(3)]
+
+        self.assertEqual(codes, [
+            status.HTTP_200_OK,
+            status.HTTP_200_OK,
+            status.HTTP_429_TOO_MANY_REQUESTS,
+        ])
+
+    @override_settings(THROTTLE_BACKEND='')
+    def test_throttling_can_be_disabled(self):
+        """Test an empty backend setting turns throttling off"""
+        self.client.force_authenticate(self.user)
+
+        for _ in range(5):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -0,0 +1,148 @@
+"""
+Shared helpers for the API test suites.
+"""
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+
+from core import sharding
+
+
+class UserShardTestMixin:
+    """TestCase mixin keeping a test's users and their data on one shard.
+
+    New users are placed on the last shard, which is active for the whole
+    test, so fixtures created through the ORM or ``sharding.connection``
+    land where the API reads them. Without shard databases this is
+    ``default``. ``captureOnCommitCallbacks`` captures the shard's
+    callbacks by default.
+    """
+    databases = '__all__'
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        alias = settings.SHARDS[-1]
+        self._shard_settings = override_settings(SHARD_RING=[alias])
+        self._shard_settings.enable()
+        self._shard_token = sharding.activate(alias)
+
+    def _post_teardown(self):
+        sharding.deactivate(self._shard_token)
+        self._shard_settings.disable()
+        super()._post_teardown()
+
+    @classmethod
+    def captureOnCommitCallbacks(cls, *, using=None, execute=False):
+        return super().captureOnCommitCallbacks(
+            using=using or sharding.current(), execute=execute,
+        )
+
+
+class QueryRecorder:
+    """Record executed SQL together with the project frames issuing it.
+
+    Queries are recorded on the database aliases `using`, by default
+    ``default`` and the active shard.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = []
+
+    def __enter__(self):
+        aliases = self.using or {DEFAULT_DB_ALIAS, sharding.current()}
+        self._wrappers = ExitStack()
+        for alias in aliases:
+            self._wrappers.enter_context(
+                connections[alias].execute_wrapper(self),
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrappers.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, self._project_frames()))
+        return execute(sql, params, many, context)
+
+    def _project_frames(self):
+        """Return the innermost project frames plus the library caller."""
+        base_dir = str(settings.BASE_DIR)
+        stack = [
+            frame for frame in traceback.extract_stack()[:-2]
+            if frame.filename != __file__
+        ]
+        project = [
+            frame for frame in stack
+            if frame.filename.startswith(base_dir)
+            and '/site-packages/' not in frame.filename
+        ]
+        library = [
+            frame for frame in stack
+            if '/django/db/' not in frame.filename
+        ]
+        frames = project[-3:]
+        if library and library[-1] not in frames:
+            frames.append(library[-1])
+        return frames
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        """Format recorded queries with their Python call sites."""
+        lines = []
+        for index, (sql, frames) in enumerate(self.queries, 1):
+            lines.append(f'{index}. {sql}')
+            for frame in frames:
+                lines.append(
+                    f'     at {frame.filename}:{frame.lineno} '
+                    f'in {frame.name}: {frame.line}'
+                )
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting a request issues a bounded query count.
+
+    The request is repeated at several dataset sizes so that a query count
+    which grows with the number of rows (an N+1) fails even when it would
+    happen to fit the budget for a tiny fixture.
+    """
+    query_budget_sizes = (1, 5, 20)
+
+    def assertQueryBudget(self, budget, request, populate, sizes=None):
+        """Assert `request()` runs at most `budget` queries for any size.
+
+        `populate(n)` must grow the dataset so that it holds `n` items
+        before `request()` is issued again.
+        """
+        counts = []
+        recorders = []
+        for size in sizes or self.query_budget_sizes:
+            populate(size)
+            with QueryRecorder() as recorder:
+                res = request()
+            self.assertLess(
+                res.status_code, 400,
+                f'Request failed at size {size}: {res.status_code}',
+            )
+            counts.append((size, len(recorder)))
+            recorders.append(recorder)
+
+        worst = max(range(len(counts)), key=lambda i: counts[i][1])
+        size, count = counts[worst]
+        sizes_msg = ', '.join(f'n={s}: {c}' for s, c in counts)
+        if count > budget:
+            self.fail(
+                f'{count} queries exceed the budget of {budget} at n={size} '
+                f'({sizes_msg}):\n{recorders[worst].report()}'
+            )
+        if counts[-1][1] > counts[0][1]:
+            self.fail(
+                f'Query count grows with the dataset ({sizes_msg}):\n'
+                f'{recorders[-1].report()}'
+            )
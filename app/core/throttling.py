@@ -0,0 +1,243 @@
+"""
+Token bucket request throttling.
+
+Every client key owns a bucket holding up to ``capacity`` tokens that
+refill continuously at ``capacity / period``; a request takes one token.
+Rates use DRF's ``DEFAULT_THROTTLE_RATES`` format (``'100/min'``), where
+the number is both the sustained rate and the allowed burst.
+
+Buckets live in the backend named by ``THROTTLE_BACKEND``:
+
+- ``LocalMemoryBackend`` keeps them in the process (the default).
+- ``SharedMemoryBackend`` keeps them in a ``multiprocessing.shared_memory``
+  table shared by every worker process on the host.
+
+Both are O(1) per check and never touch the database. An empty
+``THROTTLE_BACKEND`` disables throttling.
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """Return ``(capacity, tokens per second)`` for a ``'N/period'`` rate.
+    """
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalMemoryBackend:
+    """Buckets in a per-process LRU dict."""
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys or settings.THROTTLE_LOCAL_MAX_KEYS
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now=None):
+        """Take a token; return ``(allowed, seconds until one is free)``."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedMemoryBackend:
+    """Buckets in a fixed size hash table in host shared memory.
+
+    The table is split in groups of ``GROUP_SIZE`` slots; a key always
+    maps to the same group and takes a free slot there, or the least
+    recently used one. Groups are guarded by striped ``lockf`` byte-range
+    locks on a lock file, so processes only contend on the same stripe.
+    """
+    SLOT = struct.Struct('=Qdd')  # key hash, tokens, last update
+    GROUP_SIZE = 8
+    STRIPES = 256
+
+    def __init__(self, name=None, slots=None):
+        if fcntl is None:
+            raise RuntimeError('SharedMemoryBackend requires fcntl')
+        name = name or settings.THROTTLE_SHARED_MEMORY_NAME
+        slots = slots or settings.THROTTLE_SHARED_MEMORY_SLOTS
+        self.groups = max(slots // self.GROUP_SIZE, 1)
+        size = self.groups * self.GROUP_SIZE * self.SLOT.size
+        try:
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True, size=size,
+            )
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # The segment outlives any one worker; stop the resource tracker
+        # from unlinking it when this process exits.
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self.groups = min(
+            self.groups,
+            self._shm.size // (self.GROUP_SIZE * self.SLOT.size),
+        )
+        self._buf = self._shm.buf
+        self._fd = os.open(
+            os.path.join(tempfile.gettempdir(), f'{name}.lock'),
+            os.O_RDWR | os.O_CREAT,
+            0o600,
+        )
+        # Record locks belong to the process, so threads queue here first.
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') | 1  # 0 marks a free slot
+
+    def consume(self, key, capacity, rate, now=None):
+        """Take a token; return ``(allowed, seconds until one is free)``."""
+        now = time.monotonic() if now is None else now
+        key_hash = self._hash(key)
+        group = key_hash % self.groups
+        stripe = group % self.STRIPES
+        first = group * self.GROUP_SIZE
+
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                slot, tokens, updated = None, capacity, now
+                oldest, oldest_updated = first, None
+                for index in range(first, first + self.GROUP_SIZE):
+                    slot_hash, slot_tokens, slot_updated = \
+                        self.SLOT.unpack_from(self._buf,
+                                              index * self.SLOT.size)
+                    if slot_hash == key_hash:
+                        slot, tokens, updated = \
+                            index, slot_tokens, slot_updated
+                        break
+                    if slot_hash == 0:
+                        slot_updated = float('-inf')
+                    if oldest_updated is None or slot_updated < oldest_updated:
+                        oldest, oldest_updated = index, slot_updated
+                if slot is None:
+                    slot = oldest
+
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self.SLOT.pack_into(self._buf, slot * self.SLOT.size,
+                                    key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        with self._thread_lock:
+            self._buf[:] = bytes(len(self._buf))
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured backend, created once per process."""
+    path = settings.THROTTLE_BACKEND
+    if not path:
+        return None
+    with _backends_lock:
+        if path not in _backends:
+            _backends[path] = import_string(path)()
+        return _backends[path]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base throttle taking one token per request from a keyed bucket."""
+    scope = None
+
+    def get_scope(self, view):
+        return self.scope
+
+    def get_key(self, request, view):
+        """Return the bucket key of the request, or None to not throttle.
+        """
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def allow_request(self, request, view):
+        self._wait = None
+        scope = self.get_scope(view)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        backend = get_backend()
+        if rate is None or backend is None:
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+
+        capacity, per_second = parse_rate(rate)
+        allowed, wait = backend.consume(
+            f'{scope}:{key}', capacity, per_second,
+        )
+        self._wait = wait
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class AnonTokenBucketThrottle(TokenBucketThrottle):
+    """Throttle unauthenticated requests per client IP."""
+    scope = 'anon'
+
+    def get_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.get_ident(request)
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Throttle authenticated requests per user."""
+    scope = 'user'
+
+    def get_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class ScopedTokenBucketThrottle(TokenBucketThrottle):
+    """Throttle views with a ``throttle_scope`` by user or client IP."""
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None)
+
+    def get_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return self.get_ident(request)
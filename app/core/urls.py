@@ -0,0 +1,20 @@
+"""
+URL mapping for the core APIs.
+"""
+from django.urls import (
+    path,
+    include
+)
+
+from rest_framework.routers import SimpleRouter
+
+from core import views
+
+router = SimpleRouter()
+router.register('', views.JobViewSet)
+
+app_name = 'core'
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
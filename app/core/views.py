@@ -0,0 +1,21 @@
+"""
+Views for the core app.
+"""
+from rest_framework import viewsets
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+
+from core.models import Job
+from core.serializers import JobSerializer
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """View the status of the authenticated user's background jobs."""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        """Return jobs of the current authenticated user only."""
+        return self.queryset.filter(user=self.request.user).order_by('-id')
@@ -1,6 +1,12 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 
 class RecipeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipe'
+
+    def ready(self):
+        from recipe import signals  # noqa: F401
+        # The API profile does not install drf_spectacular.
+        if apps.is_installed('drf_spectacular'):
+            from recipe import schema  # noqa: F401
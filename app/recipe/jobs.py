@@ -0,0 +1,71 @@
+"""
+Background jobs for the recipe app.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core import jobs, orphans
+from core.dedupe import NAME_TABLES
+from core.models import Tombstone
+
+
+@jobs.job('recipe.gc_orphans')
+def gc_orphans(job_obj):
+    """Delete orphaned tags and ingredients, reporting progress.
+
+    With an ``interval`` (seconds) in the payload, the job queues its next
+    run, so enqueueing it once keeps the collection scheduled.
+    """
+    payload = job_obj.payload
+    progress = {}
+    for kind in payload.get('kinds') or list(NAME_TABLES):
+        for scanned, deleted in orphans.collect(
+            kind,
+            batch_size=payload.get('batch_size', 1000),
+            sleep=payload.get('sleep', 0),
+        ):
+            progress[kind] = {'scanned': scanned, 'deleted': deleted}
+            job_obj.set_progress(**progress)
+
+    if payload.get('interval'):
+        jobs.enqueue(
+            job_obj.name,
+            payload,
+            run_after=timezone.now() + timedelta(seconds=payload['interval']),
+        )
+    return progress
+
+
+@jobs.job('recipe.prune_tombstones')
+def prune_tombstones(job_obj):
+    """Delete tombstones older than ``SYNC_TOMBSTONE_RETENTION``.
+
+    Sync cursors expire before that, so no client still needs them. With
+    an ``interval`` (seconds) in the payload, the job queues its next run.
+    """
+    payload = job_obj.payload
+    batch_size = payload.get('batch_size', 1000)
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.SYNC_TOMBSTONE_RETENTION,
+    )
+    deleted = job_obj.progress.get('deleted', 0)
+    for alias in settings.SHARDS:
+        tombstones = Tombstone.objects.using(alias)
+        expired = tombstones.filter(deleted_at__lt=cutoff)
+        while True:
+            ids = list(expired.order_by('deleted_at')
+                       .values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += tombstones.filter(pk__in=ids).delete()[0]
+            job_obj.set_progress(deleted=deleted)
+
+    if payload.get('interval'):
+        jobs.enqueue(
+            job_obj.name,
+            payload,
+            run_after=timezone.now() + timedelta(seconds=payload['interval']),
+        )
+    return {'deleted': deleted}
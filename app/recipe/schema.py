@@ -0,0 +1,84 @@
+"""
+OpenAPI schema of the recipe views drf_spectacular can not introspect.
+
+The extensions register themselves on import, which ``RecipeConfig``
+only does where drf_spectacular is installed, so the API profile never
+loads it.
+"""
+from django.conf import settings
+
+from drf_spectacular.extensions import OpenApiViewExtension
+from drf_spectacular.utils import (
+    OpenApiParameter,
+    extend_schema,
+    extend_schema_field,
+)
+from rest_framework import serializers
+
+from recipe import serializers as recipe_serializers
+
+
+class StatsSummarySerializer(serializers.Serializer):
+    """Summary of one recipe field over the user's recipes."""
+    avg = serializers.FloatField(allow_null=True)
+    min = serializers.FloatField(allow_null=True)
+    max = serializers.FloatField(allow_null=True)
+
+
+class TopTagSerializer(serializers.Serializer):
+    """A tag among the most used ones."""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipe_count = serializers.IntegerField()
+
+
+# Declares the shapes of the method fields.
+class RecipeStatsSerializer(recipe_serializers.RecipeStatsSerializer):
+    """Serializer for the per-user recipe statistics."""
+    price = StatsSummarySerializer()
+    time_minutes = StatsSummarySerializer()
+    top_tags = TopTagSerializer(many=True)
+
+
+# Thumbnail URLs keyed by their size in pixels.
+extend_schema_field({
+    'type': 'object',
+    'additionalProperties': {'type': 'string', 'format': 'uri'},
+})(recipe_serializers.RecipeSerializer.get_thumbnails)
+
+
+class RecipeStatsViewSchema(OpenApiViewExtension):
+    target_class = 'recipe.views.RecipeStatsView'
+
+    def view_replacement(self):
+        @extend_schema(responses=RecipeStatsSerializer)
+        class Documented(self.target_class):
+            pass
+        return Documented
+
+
+class SyncViewSchema(OpenApiViewExtension):
+    target_class = 'recipe.views.SyncView'
+
+    def view_replacement(self):
+        @extend_schema(
+            parameters=[
+                OpenApiParameter(
+                    'since', str,
+                    description='The cursor of the previous page; without '
+                                'it the sync starts over.',
+                ),
+                OpenApiParameter(
+                    'limit', int,
+                    description=(
+                        f'Rows per page, deletes included (default '
+                        f'{settings.SYNC_BATCH_SIZE}, at most '
+                        f'{settings.SYNC_MAX_BATCH_SIZE}).'
+                    ),
+                ),
+            ],
+            responses=recipe_serializers.SyncSerializer,
+        )
+        class Documented(self.target_class):
+            pass
+        return Documented
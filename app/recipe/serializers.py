@@ -1,15 +1,30 @@
 """
 Serializers for recipe APIs.
 """
-from rest_framework import serializers
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F, prefetch_related_objects
+from django.db.models.signals import m2m_changed, post_save
+
+from rest_framework import exceptions, serializers
 
 from core.models import (
     Tag,
     Recipe,
     Ingredient,
+    link_prefetches,
 )
 
 
+class VersionConflict(exceptions.APIException):
+    """The recipe was changed by someone else since it was read."""
+    status_code = 409
+    default_detail = 'The recipe was modified by another request.'
+    default_code = 'version_conflict'
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     """Serializer for ingredient objects."""
 
@@ -28,50 +43,353 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class IngredientAutocompleteSerializer(IngredientSerializer):
+    """Serializer for an ingredient name suggestion."""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + ('recipe_count',)
+
+
+class TagAutocompleteSerializer(TagSerializer):
+    """Serializer for a tag name suggestion."""
+    recipe_count = serializers.IntegerField(read_only=True)
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('recipe_count',)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializer for the recipe object."""
     tags = TagSerializer(many=True, required=False)
+    ingredients = IngredientSerializer(many=True, required=False)
+    image = serializers.ImageField(read_only=True)
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'title', 'time_minutes', 'price', 'link',
-            'description', 'tags'
+            'description', 'tags', 'ingredients', 'image', 'thumbnails',
+            'version'
         )
         read_only_fields = ('id',)
+        extra_kwargs = {'version': {'required': False}}
 
-    def _get_or_create_tags(self, recipe, tags):
-        auth_user = self.context['request'].user
-        for tag in tags:
-            tag_obj, _ = Tag.objects.get_or_create(
-                user=auth_user,
-                **tag,
+    def get_thumbnails(self, recipe):
+        """Return thumbnail URLs keyed by their size in pixels."""
+        request = self.context.get('request')
+        urls = {}
+        for size, name in recipe.thumbnails.items():
+            url = recipe.image.storage.url(name)
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls
+
+    def to_representation(self, instance):
+        # Links not prefetched by the view, for example after a write, are
+        # read from the owner's partition as well.
+        prefetch_related_objects([instance],
+                                 *link_prefetches(instance.user_id))
+        return super().to_representation(instance)
+
+    def _get_or_create(self, model, items):
+        """Return the user's objects for the given names, creating them."""
+        return model.objects.get_or_create_names(
+            self.context['request'].user,
+            [item['name'] for item in items],
+        )
+
+    def _sync_related(self, recipe, field_name, objs, current=None):
+        """Make a recipe's m2m match `objs`, writing only the difference.
+
+        Removed links go in one DELETE and new links in one INSERT; the
+        m2m_changed signals are sent for the changed ids only, so a no-op
+        update writes nothing at all. Returns True if anything changed.
+        """
+        manager = getattr(recipe, field_name)
+        through = manager.through
+        source = manager.source_field_name
+        target = f'{manager.target_field_name}_id'
+        links = through.objects.filter(
+            **{source: recipe.pk, 'user': recipe.user_id},
+        )
+        if current is None:
+            current = set(links.values_list(target, flat=True))
+        wanted = {obj.pk for obj in objs}
+        removed = current - wanted
+        added = wanted - current
+
+        def send(action, pk_set):
+            m2m_changed.send(
+                sender=through, action=action, instance=recipe,
+                reverse=False, model=manager.model, pk_set=pk_set,
+                using=links.db,
             )
-            recipe.tags.add(tag_obj)
 
-    # override the create method to handle the tags
+        if removed:
+            send('pre_remove', removed)
+            links.filter(**{f'{target}__in': removed}).delete()
+            send('post_remove', removed)
+        if added:
+            send('pre_add', added)
+            through.objects.bulk_create(
+                [through(**{f'{source}_id': recipe.pk, target: pk,
+                            'user_id': recipe.user_id})
+                 for pk in added],
+                ignore_conflicts=True,
+            )
+            send('post_add', added)
+        if removed or added:
+            getattr(recipe, '_prefetched_objects_cache', {}).pop(
+                manager.prefetch_cache_name, None,
+            )
+        return bool(removed or added)
+
+    # override the create method to handle the tags and ingredients
     def create(self, validated_data):
         tags = validated_data.pop('tags', [])
-        recipe = Recipe.objects.create(**validated_data)
-        self._get_or_create_tags(recipe, tags)
+        ingredients = validated_data.pop('ingredients', [])
+        validated_data.pop('version', None)
+        # The names stay locked against the orphan collector until their
+        # links are committed.
+        with transaction.atomic(using=router.db_for_write(Recipe)):
+            recipe = Recipe.objects.create(**validated_data)
+            self._sync_related(
+                recipe, 'tags', self._get_or_create(Tag, tags),
+                current=set(),
+            )
+            self._sync_related(
+                recipe, 'ingredients',
+                self._get_or_create(Ingredient, ingredients), current=set(),
+            )
         return recipe
 
-    # override the update method to handle the tags
+    # override the update method to handle the tags and ingredients
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags', None)
-        if tags is not None:
-            instance.tags.clear()
-            self._get_or_create_tags(instance, tags)
+        ingredients = validated_data.pop('ingredients', None)
+        expected_version = validated_data.pop('version', instance.version)
+        changed = {
+            key: value for key, value in validated_data.items()
+            if getattr(instance, key) != value
+        }
 
-        for key, value in validated_data.items():
-            setattr(instance, key, value)
+        with transaction.atomic(using=instance._state.db):
+            related_changed = False
+            if tags is not None:
+                related_changed |= self._sync_related(
+                    instance, 'tags', self._get_or_create(Tag, tags),
+                )
+            if ingredients is not None:
+                related_changed |= self._sync_related(
+                    instance, 'ingredients',
+                    self._get_or_create(Ingredient, ingredients),
+                )
+            if changed or related_changed:
+                self._save_changes(instance, changed, expected_version)
 
-        instance.save()
         return instance
 
+    def _save_changes(self, instance, changed, expected_version):
+        """Write only the changed columns if the version still matches.
+
+        The version check and increment happen in the UPDATE itself, so a
+        concurrent writer makes this match no row instead of being
+        silently overwritten.
+        """
+        updated = Recipe.objects.filter(
+            pk=instance.pk,
+            user=instance.user_id,
+            version=expected_version,
+        ).update(version=F('version') + 1, **changed)
+        if not updated:
+            raise VersionConflict()
+
+        for key, value in changed.items():
+            setattr(instance, key, value)
+        instance.version = expected_version + 1
+        post_save.send(
+            sender=Recipe,
+            instance=instance,
+            created=False,
+            update_fields=frozenset([*changed, 'version']),
+            raw=False,
+            using=instance._state.db,
+        )
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for the recipe detail object."""
 
     class Meta(RecipeSerializer.Meta):
         fields = RecipeSerializer.Meta.fields
+
+
+class SimilarRecipeSerializer(RecipeSerializer):
+    """Serializer for a recipe ranked by similarity to another."""
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('score',)
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """Serializer for a recipe ranked by how much of it a pantry covers."""
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage',)
+
+
+class SyncRecipeSerializer(RecipeDetailSerializer):
+    """Serializer for a recipe in a delta sync page."""
+
+    class Meta(RecipeDetailSerializer.Meta):
+        fields = RecipeDetailSerializer.Meta.fields + (
+            'created_at', 'updated_at',
+        )
+
+
+class SyncTagSerializer(TagSerializer):
+    """Serializer for a tag in a delta sync page."""
+
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ('created_at', 'updated_at')
+
+
+class SyncIngredientSerializer(IngredientSerializer):
+    """Serializer for an ingredient in a delta sync page."""
+
+    class Meta(IngredientSerializer.Meta):
+        fields = IngredientSerializer.Meta.fields + (
+            'created_at', 'updated_at',
+        )
+
+
+class SyncDeletedSerializer(serializers.Serializer):
+    """Serializer for the ids deleted in a delta sync page, by kind."""
+    recipe = serializers.ListField(child=serializers.IntegerField())
+    tag = serializers.ListField(child=serializers.IntegerField())
+    ingredient = serializers.ListField(child=serializers.IntegerField())
+
+
+class SyncSerializer(serializers.Serializer):
+    """Serializer for a page of delta sync changes."""
+    recipes = SyncRecipeSerializer(many=True)
+    tags = SyncTagSerializer(many=True)
+    ingredients = SyncIngredientSerializer(many=True)
+    deleted = SyncDeletedSerializer()
+    cursor = serializers.CharField()
+    has_more = serializers.BooleanField()
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """Serializer for a filter over the user's recipes.
+
+    Every given condition must hold; ``tags`` and ``ingredients`` match
+    recipes linked to any of the ids.
+    """
+    title = serializers.CharField(required=False, max_length=255)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+    )
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+    )
+    min_price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False,
+    )
+    max_price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, required=False,
+    )
+    max_time_minutes = serializers.IntegerField(required=False)
+
+    LOOKUPS = {
+        'title': 'title__icontains',
+        'tags': 'recipetag__tag__in',
+        'ingredients': 'recipeingredient__ingredient__in',
+        'min_price': 'price__gte',
+        'max_price': 'price__lte',
+        'max_time_minutes': 'time_minutes__lte',
+    }
+
+    # Links are filtered by owner too, in the same join, so they are read
+    # from one partition (see core.partitioning).
+    LINK_OWNERS = {
+        'tags': 'recipetag__user',
+        'ingredients': 'recipeingredient__user',
+    }
+
+
+class TagAssignmentSerializer(serializers.Serializer):
+    """Serializer for the recipes a tag is assigned to or removed from."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        max_length=settings.RECIPE_ASSIGN_MAX_RECIPES,
+    )
+    filter = RecipeFilterSerializer(required=False)
+
+    def validate(self, attrs):
+        if ('recipes' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError(
+                'Give either a list of recipes or a filter.',
+            )
+        return attrs
+
+    def filter_recipes(self, queryset):
+        """Return the recipes of `queryset` that were selected."""
+        if 'recipes' in self.validated_data:
+            return queryset.filter(pk__in=self.validated_data['recipes'])
+        lookups = {}
+        for field, value in self.validated_data['filter'].items():
+            lookups[RecipeFilterSerializer.LOOKUPS[field]] = value
+            if field in RecipeFilterSerializer.LINK_OWNERS:
+                lookups[RecipeFilterSerializer.LINK_OWNERS[field]] = \
+                    self.context['request'].user.pk
+        return queryset.filter(**lookups)
+
+
+class RecipeImageSerializer(serializers.ModelSerializer):
+    """Serializer for uploading images to recipes."""
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'image')
+        read_only_fields = ('id',)
+        extra_kwargs = {'image': {'required': True, 'allow_null': False}}
+
+
+class RecipeStatsSerializer(serializers.Serializer):
+    """Serializer for the per-user recipe statistics."""
+    recipe_count = serializers.IntegerField()
+    price = serializers.SerializerMethodField()
+    time_minutes = serializers.SerializerMethodField()
+    top_tags = serializers.SerializerMethodField()
+
+    def _summary(self, stats, field, quantize=None):
+        count = stats.recipe_count
+        avg = getattr(stats, f'{field}_sum') / count if count else None
+        if avg is not None and quantize is not None:
+            avg = Decimal(avg).quantize(quantize)
+        return {
+            'avg': avg,
+            'min': getattr(stats, f'{field}_min'),
+            'max': getattr(stats, f'{field}_max'),
+        }
+
+    def get_price(self, stats):
+        return self._summary(stats, 'price', Decimal('0.01'))
+
+    def get_time_minutes(self, stats):
+        return self._summary(stats, 'time_minutes', Decimal('0.1'))
+
+    def get_top_tags(self, stats):
+        return [
+            {
+                'id': tag_stats.tag_id,
+                'name': tag_stats.tag.name,
+                'recipe_count': tag_stats.recipe_count,
+            }
+            for tag_stats in self.context['top_tags']
+        ]
@@ -0,0 +1,305 @@
+"""
+Similar recipes and pantry coverage from a per-user sparse index of tags
+and ingredients.
+
+A user's recipes are the rows of a binary CSR matrix whose columns are
+their tags and ingredients. Its transpose is an inverted index, so the
+overlap of one recipe with all the others is a sparse product that only
+touches recipes sharing a feature with it. Jaccard and cosine similarity
+follow from the overlap and the number of features of each row; the
+coverage of a pantry is the same product restricted to ingredients.
+
+Indexes are built with one query per user and kept in a per-process LRU.
+``RecipeStats.links_version`` is bumped by every write to a user's links
+and an index behind it is refreshed: when every change since it was
+built was committed by this process, the changed recipes are known from
+the signals and only their rows are reloaded; otherwise it is rebuilt.
+
+numpy and scipy are imported by the functions that need them, so that
+loading this module (the signal receivers do at startup) stays cheap.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.sharding import connection
+
+METRICS = ('jaccard', 'cosine')
+
+# Tags and ingredients share one column space; ingredient ids are offset.
+INGREDIENT_OFFSET = 1 << 48
+
+STATE_SQL = """
+SELECT links_version, recipe_count FROM core_recipestats WHERE user_id = %s
+"""
+
+# Links carry their recipe's owner, so each part reads one partition (see
+# core.partitioning).
+FEATURES_SQL = """
+SELECT l.recipe_id, l.tag_id
+FROM core_recipe_tags l
+WHERE l.user_id = %(user_id)s {recipes}
+UNION ALL
+SELECT l.recipe_id, l.ingredient_id + %(offset)s
+FROM core_recipe_ingredients l
+WHERE l.user_id = %(user_id)s {recipes}
+"""
+
+SOME_RECIPES_SQL = 'AND l.recipe_id = ANY(%(recipe_ids)s::bigint[])'
+
+COVERAGE_SQL = """
+SELECT recipe_id, held::float8 / total FROM (
+    SELECT ri.recipe_id, COUNT(*) AS total, COUNT(*) FILTER (
+        WHERE ri.ingredient_id = ANY(%(ingredient_ids)s::bigint[])
+    ) AS held
+    FROM core_recipe_ingredients ri
+    WHERE ri.user_id = %(user_id)s
+    GROUP BY ri.recipe_id
+) counts
+WHERE held > 0
+ORDER BY held::float8 / total DESC, held DESC, recipe_id DESC
+LIMIT %(limit)s
+"""
+
+
+class UserIndex:
+    """Similarity index of one user's recipes.
+
+    The matrix is never modified: refreshing returns a new index, so a
+    request can keep using the one it got while another replaces it.
+    """
+
+    def __init__(self, version, ids, matrix, columns):
+        import numpy as np
+
+        self.version = version
+        self.ids = ids  # recipe id of each row, -1 for replaced rows
+        self.matrix = matrix
+        self.columns = columns  # feature key -> column
+        self.sizes = np.diff(matrix.indptr)
+        self.postings = matrix.T.tocsr()
+        is_ingredient = np.zeros(len(columns), dtype=np.float32)
+        is_ingredient[[column for key, column in columns.items()
+                       if key >= INGREDIENT_OFFSET]] = 1
+        self.ingredient_counts = matrix @ is_ingredient
+        self.rows = {
+            recipe_id: row for row, recipe_id in enumerate(ids.tolist())
+            if recipe_id >= 0
+        }
+        # Recipes changed by transactions this process committed since.
+        self.dirty = set()
+        self.pending = 0
+
+    @classmethod
+    def build(cls, version, pairs):
+        """Build an index from ``(recipe id, feature key)`` pairs."""
+        import numpy as np
+        from scipy import sparse
+
+        ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        keys, cols = np.unique(pairs[:, 1], return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+            shape=(len(ids), len(keys)),
+        )
+        return cls(version, ids, matrix,
+                   dict(zip(keys.tolist(), range(len(keys)))))
+
+    def replace(self, version, recipe_ids, pairs):
+        """Return a copy with the rows of `recipe_ids` set from `pairs`.
+
+        Old rows are emptied and the new ones appended; the matrix is
+        compacted once half of its rows are replaced ones.
+        """
+        import numpy as np
+        from scipy import sparse
+
+        ids = self.ids.copy()
+        ids[[self.rows[r] for r in recipe_ids if r in self.rows]] = -1
+        matrix = sparse.diags((ids >= 0).astype(np.float32)) @ self.matrix
+        matrix.eliminate_zeros()
+
+        columns = dict(self.columns)
+        for key in pairs[:, 1].tolist():
+            columns.setdefault(key, len(columns))
+        new_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        cols = np.array([columns[key] for key in pairs[:, 1].tolist()],
+                        dtype=np.int64)
+        added = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+            shape=(len(new_ids), len(columns)),
+        )
+        matrix.resize((matrix.shape[0], len(columns)))
+        matrix = sparse.vstack([matrix, added], format='csr')
+        ids = np.concatenate([ids, new_ids])
+
+        live = ids >= 0
+        if live.sum() * 2 < len(ids):
+            matrix, ids = matrix[live], ids[live]
+        return UserIndex(version, ids, matrix, columns)
+
+    def similar(self, recipe_id, metric='jaccard', limit=10):
+        """Return ``(recipe id, score)`` of the most similar recipes.
+
+        Ties are broken by the newest recipe first.
+        """
+        import numpy as np
+
+        row = self.rows.get(recipe_id)
+        if row is None or not limit:
+            return []
+        overlap = self.matrix[row] @ self.postings
+        candidates = overlap.indices
+        shared = overlap.data.astype(np.float64)
+        others = candidates != row
+        candidates, shared = candidates[others], shared[others]
+
+        sizes = self.sizes[candidates]
+        size = self.sizes[row]
+        if metric == 'cosine':
+            scores = shared / np.sqrt(sizes * size)
+        else:
+            scores = shared / (sizes + size - shared)
+        ids = self.ids[candidates]
+
+        if len(scores) > limit:
+            top = scores >= np.partition(scores, -limit)[-limit]
+            scores, ids = scores[top], ids[top]
+        order = np.lexsort((-ids, -scores))[:limit]
+        return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+    def coverage(self, ingredient_ids, limit=10):
+        """Return ``(recipe id, coverage)`` of the best covered recipes.
+
+        Coverage is the fraction of a recipe's ingredients that are in
+        `ingredient_ids`; ties go to more held ingredients, then to the
+        newest recipe.
+        """
+        import numpy as np
+        from scipy import sparse
+
+        columns = [
+            self.columns[key] for key in
+            {INGREDIENT_OFFSET + pk for pk in ingredient_ids}
+            if key in self.columns
+        ]
+        if not columns or not limit:
+            return []
+        pantry = sparse.csr_matrix(
+            (np.ones(len(columns), dtype=np.float32),
+             (np.zeros(len(columns), dtype=np.int64), columns)),
+            shape=(1, len(self.columns)),
+        )
+        held = pantry @ self.postings
+        rows = held.indices
+        counts = held.data.astype(np.float64)
+        scores = counts / self.ingredient_counts[rows]
+        ids = self.ids[rows]
+
+        if len(scores) > limit:
+            top = scores >= np.partition(scores, -limit)[-limit]
+            scores, counts, ids = scores[top], counts[top], ids[top]
+        order = np.lexsort((-ids, -counts, -scores))[:limit]
+        return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _state(user_id):
+    """Return the links version and recipe count of a user."""
+    with connection.cursor() as cursor:
+        cursor.execute(STATE_SQL, [user_id])
+        row = cursor.fetchone()
+    return row or (0, 0)
+
+
+def _load(user_id, recipe_ids=None):
+    """Return the ``(recipe id, feature key)`` pairs of a user's recipes.
+    """
+    import numpy as np
+
+    sql = FEATURES_SQL.format(
+        recipes='' if recipe_ids is None else SOME_RECIPES_SQL,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'user_id': user_id,
+            'offset': INGREDIENT_OFFSET,
+            'recipe_ids': None if recipe_ids is None else list(recipe_ids),
+        })
+        rows = cursor.fetchall()
+    return np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+
+def get_index(user_id, min_recipes=0):
+    """Return an index of the user's recipes that is up to date.
+
+    Returns None instead of building one for users with fewer than
+    `min_recipes` recipes.
+    """
+    version, recipe_count = _state(user_id)
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is None and recipe_count < min_recipes:
+            return None
+        if index is not None:
+            _indexes.move_to_end(user_id)
+            if index.version == version:
+                return index
+            dirty, pending = set(index.dirty), index.pending
+
+    if index is not None and dirty and index.version + pending == version:
+        index = index.replace(version, dirty, _load(user_id, dirty))
+    else:
+        index = UserIndex.build(version, _load(user_id))
+
+    with _lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > settings.RECIPE_SIMILARITY_CACHED_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def recipes_changed(user_id, recipe_ids):
+    """Record links of `recipe_ids` written by a committed transaction.
+
+    Must be called once per ``links_version`` bump, after commit.
+    """
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            index.dirty.update(recipe_ids)
+            index.pending += 1
+
+
+def similar(recipe, metric='jaccard', limit=10):
+    """Return ``(recipe id, score)`` of the owner's most similar recipes.
+    """
+    return get_index(recipe.user_id).similar(recipe.pk, metric, limit)
+
+
+def coverage(user, ingredient_ids, limit=10):
+    """Return ``(recipe id, coverage)`` of the user's best covered recipes.
+
+    Users with few recipes are ranked in SQL, unless their index is in
+    memory already.
+    """
+    index = get_index(user.pk, settings.RECIPE_INDEX_MIN_RECIPES)
+    if index is not None:
+        return index.coverage(ingredient_ids, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(COVERAGE_SQL, {
+            'user_id': user.pk,
+            'ingredient_ids': list(ingredient_ids),
+            'limit': limit,
+        })
+        return cursor.fetchall()
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
@@ -6,12 +6,14 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Ingredient
+from core.models import Ingredient, Recipe
+from core.tests.utils import QueryBudgetMixin, UserShardTestMixin
 
 from recipe.serializers import IngredientSerializer
 
 
 INGREDIENTS_URL = reverse('recipe:ingredient-list')
+AUTOCOMPLETE_URL = reverse('recipe:ingredient-autocomplete')
 
 
 def create_user(**params):
@@ -37,7 +39,7 @@ class PublicIngredientsApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateIngredientsApiTests(TestCase):
+class PrivateIngredientsApiTests(UserShardTestMixin, TestCase):
     """Test the private ingredients API."""
 
     def setUp(self):
@@ -72,3 +74,44 @@ class PrivateIngredientsApiTests(TestCase):
         self.assertEqual(len(res.data), 1)
 
         self.assertEqual(res.data[0]['name'], ingredient.name)
+
+    def test_autocomplete_ordered_by_usage(self):
+        """Test ingredient suggestions are ranked by recipe count."""
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        salmon = Ingredient.objects.create(user=self.user, name='Salmon')
+        Ingredient.objects.create(user=self.user, name='Sage')
+        Ingredient.objects.create(user=self.user, name='Pepper')
+        for i in range(2):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=1,
+            )
+            recipe.ingredients.add(salmon)
+        recipe.ingredients.add(salt)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'sa'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(i['name'], i['recipe_count']) for i in res.data],
+            [('Salmon', 2), ('Salt', 1), ('Sage', 0)],
+        )
+
+
+class IngredientQueryBudgetTests(UserShardTestMixin, QueryBudgetMixin,
+                                 TestCase):
+    """Test ingredient endpoints issue a constant number of queries."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def test_list_ingredients_query_budget(self):
+        """Test listing ingredients issues a single query."""
+        def populate(size):
+            for i in range(Ingredient.objects.count(), size):
+                Ingredient.objects.create(user=self.user, name=f'Item {i}')
+
+        self.assertQueryBudget(
+            1, lambda: self.client.get(INGREDIENTS_URL), populate,
+        )
@@ -0,0 +1,45 @@
+"""
+Tests for the recipe background jobs.
+"""
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from core import jobs
+from core.models import Ingredient, Job, Tag
+from recipe.jobs import gc_orphans  # noqa: F401
+
+
+class GcOrphansJobTests(TestCase):
+    """Test the scheduled orphan collection job."""
+    # The collection visits every shard.
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='test@123',
+        )
+
+    def test_gc_orphans_job(self):
+        """Test the job deletes orphans, reports progress and reschedules"""
+        Tag.objects.create(user=self.user, name='Unused')
+        Ingredient.objects.create(user=self.user, name='Unused')
+        job_obj = jobs.enqueue('recipe.gc_orphans', {'interval': 3600})
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.SUCCEEDED)
+        self.assertEqual(job_obj.progress, {
+            'tag': {'scanned': 1, 'deleted': 1},
+            'ingredient': {'scanned': 1, 'deleted': 1},
+        })
+        self.assertFalse(Tag.objects.exists())
+        self.assertTrue(
+            Job.objects.filter(
+                name='recipe.gc_orphans', status=Job.QUEUED,
+            ).exists(),
+        )
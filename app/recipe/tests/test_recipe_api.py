@@ -1,10 +1,15 @@
 """
 Test for the recipe APIs.
 """
+import os
+import shutil
+import tempfile
 from decimal import Decimal
 
+from PIL import Image
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
 from rest_framework import status
@@ -15,6 +20,12 @@ from faker import Faker
 from core.models import (
     Recipe,
     Tag,
+    Ingredient,
+)
+from core.tests.utils import (
+    QueryBudgetMixin,
+    QueryRecorder,
+    UserShardTestMixin,
 )
 
 from recipe.serializers import (
@@ -31,6 +42,11 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def image_upload_url(recipe_id):
+    """Create and return an image upload URL."""
+    return reverse('recipe:recipe-upload-image', args=[recipe_id])
+
+
 def create_recipe(user, **params):
     """Create and return a sample recipe"""
     faker = Faker()
@@ -64,7 +80,7 @@ class PublicRecipeApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateRecipeApiTests(TestCase):
+class PrivateRecipeApiTests(UserShardTestMixin, TestCase):
     """Test authenticated recipe API access"""
 
     def setUp(self):
@@ -263,6 +279,24 @@ class PrivateRecipeApiTests(TestCase):
         self.assertTrue(recipe.tags.filter(name=tag1.name).exists())
         self.assertTrue(recipe.tags.filter(name=tag2.name).exists())
 
+    def test_recipe_tags_match_names_ignoring_case(self):
+        """Test tag names differing in case or spacing reuse one tag"""
+        tag = Tag.objects.create(user=self.user, name='Comfort Food')
+        payload = {
+            'title': 'Sample recipe',
+            'time_minutes': 20,
+            'price': Decimal('10.00'),
+            'tags': [{'name': 'comfort  food'}, {'name': 'COMFORT FOOD'}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [t['id'] for t in res.data['tags']], [tag.id],
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def create_tag_on_update(self):
         """Create tag when updating the recipe."""
         recipe = create_recipe(user=self.user)
@@ -319,3 +353,324 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.tags.count(), 0)
         self.assertNotIn(tagBreakfast, recipe.tags.all())
         self.assertNotIn(tagLunch, recipe.tags.all())
+
+    def test_clear_recipe_tags_keeps_other_recipes(self):
+        """Test clearing tags of a recipe leaves other recipes untouched."""
+        tag = Tag.objects.create(user=self.user, name='Breakfast')
+        recipe = create_recipe(user=self.user)
+        other = create_recipe(user=self.user)
+        recipe.tags.add(tag)
+        other.tags.add(tag)
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'tags': []}, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['tags'], [])
+        self.assertIn(tag, other.tags.all())
+
+    def test_update_with_same_tags_writes_nothing(self):
+        """Test a no-op tag update issues no through table writes."""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag1, tag2)
+        payload = {'tags': [{'name': 'Vegan'}, {'name': 'Dessert'}]}
+
+        with QueryRecorder() as recorder:
+            res = self.client.patch(
+                detail_url(recipe.id), payload, format='json',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        writes = [
+            sql for sql, _ in recorder.queries
+            if 'core_recipe_tags' in sql and
+            sql.startswith(('INSERT', 'DELETE'))
+        ]
+        self.assertEqual(writes, [])
+        self.assertEqual(recipe.tags.count(), 2)
+
+    def test_update_tags_only_writes_difference(self):
+        """Test changing one tag deletes and inserts one link each."""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        recipe = create_recipe(user=self.user)
+        recipe.tags.add(tag1, tag2)
+        kept_link = Recipe.tags.through.objects.get(recipe=recipe, tag=tag1)
+        payload = {'tags': [{'name': 'Vegan'}, {'name': 'Lunch'}]}
+
+        with QueryRecorder() as recorder:
+            res = self.client.patch(
+                detail_url(recipe.id), payload, format='json',
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        writes = [
+            sql.split(' ')[0] for sql, _ in recorder.queries
+            if 'core_recipe_tags' in sql and
+            sql.startswith(('INSERT', 'DELETE'))
+        ]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT'])
+        self.assertEqual(
+            sorted(res.data['tags'], key=lambda t: t['name']),
+            sorted([{'id': tag1.id, 'name': 'Vegan'},
+                    {'id': Tag.objects.get(name='Lunch').id,
+                     'name': 'Lunch'}], key=lambda t: t['name']),
+        )
+        self.assertTrue(
+            Recipe.tags.through.objects.filter(id=kept_link.id).exists()
+        )
+
+    def test_create_recipe_with_new_ingredients(self):
+        """Test creating a recipe with new ingredients."""
+        payload = {
+            'title': 'Cauliflower Tacos',
+            'time_minutes': 60,
+            'price': Decimal('4.30'),
+            'ingredients': [{'name': 'Cauliflower'}, {'name': 'Salt'}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.ingredients.count(), 2)
+        for ingredient in payload['ingredients']:
+            self.assertTrue(recipe.ingredients.filter(
+                name=ingredient['name'],
+                user=self.user,
+            ).exists())
+
+    def test_create_recipe_with_existing_ingredient(self):
+        """Test creating a recipe with existing ingredient."""
+        ingredient = Ingredient.objects.create(user=self.user, name='Lemon')
+        payload = {
+            'title': 'Vietnamese Soup',
+            'time_minutes': 25,
+            'price': '2.55',
+            'ingredients': [{'name': 'Lemon'}, {'name': 'Fish Sauce'}],
+        }
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(recipe.ingredients.count(), 2)
+        self.assertIn(ingredient, recipe.ingredients.all())
+        self.assertEqual(Ingredient.objects.filter(name='Lemon').count(), 1)
+
+    def test_update_recipe_assign_ingredient(self):
+        """Test assigning an existing ingredient when updating a recipe."""
+        ingredient1 = Ingredient.objects.create(user=self.user, name='Pepper')
+        recipe = create_recipe(user=self.user)
+        recipe.ingredients.add(ingredient1)
+
+        ingredient2 = Ingredient.objects.create(user=self.user, name='Chili')
+        payload = {'ingredients': [{'name': 'Chili'}]}
+        res = self.client.patch(
+            detail_url(recipe.id), payload, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(ingredient2, recipe.ingredients.all())
+        self.assertNotIn(ingredient1, recipe.ingredients.all())
+
+    def test_clear_recipe_ingredients(self):
+        """Test clearing a recipes ingredients."""
+        ingredient = Ingredient.objects.create(user=self.user, name='Garlic')
+        recipe = create_recipe(user=self.user)
+        recipe.ingredients.add(ingredient)
+
+        payload = {'ingredients': []}
+        res = self.client.patch(
+            detail_url(recipe.id), payload, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(recipe.ingredients.count(), 0)
+
+
+class RecipeVersionTests(UserShardTestMixin, TestCase):
+    """Test minimal writes and optimistic concurrency of recipe updates."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test@123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user, title='Sample recipe')
+
+    def recipe_updates(self, recorder):
+        return [
+            sql for sql, _ in recorder.queries
+            if sql.startswith('UPDATE "core_recipe"')
+        ]
+
+    def test_update_increments_version(self):
+        """Test a successful update bumps the version."""
+        res = self.client.patch(
+            detail_url(self.recipe.id), {'title': 'New', 'version': 1},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['version'], 2)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_stale_version_returns_conflict(self):
+        """Test updating with an outdated version is rejected."""
+        Recipe.objects.filter(id=self.recipe.id).update(version=2)
+
+        res = self.client.patch(
+            detail_url(self.recipe.id), {'title': 'Lost', 'version': 1},
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Sample recipe')
+
+    def test_conflict_rolls_back_tag_changes(self):
+        """Test a conflicting update leaves the tags untouched."""
+        Recipe.objects.filter(id=self.recipe.id).update(version=5)
+        payload = {'tags': [{'name': 'Lunch'}], 'version': 1}
+
+        res = self.client.patch(
+            detail_url(self.recipe.id), payload, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.recipe.tags.count(), 0)
+
+    def test_noop_update_skips_write(self):
+        """Test an update without changes issues no UPDATE."""
+        with QueryRecorder() as recorder:
+            res = self.client.patch(
+                detail_url(self.recipe.id), {'title': 'Sample recipe'},
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.recipe_updates(recorder), [])
+        self.assertEqual(res.data['version'], 1)
+
+    def test_update_writes_changed_columns_only(self):
+        """Test only modified columns appear in the UPDATE."""
+        with QueryRecorder() as recorder:
+            self.client.patch(detail_url(self.recipe.id), {'title': 'New'})
+
+        updates = self.recipe_updates(recorder)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"title"', updates[0])
+        self.assertNotIn('"description"', updates[0])
+        self.assertIn('"version"', updates[0].split('WHERE')[1])
+
+
+class RecipeQueryBudgetTests(UserShardTestMixin, QueryBudgetMixin, TestCase):
+    """Test recipe endpoints issue a constant number of queries"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test@123')
+        self.client.force_authenticate(self.user)
+
+    def populate(self, size):
+        """Grow the user's recipes, each with two tags, to size"""
+        for i in range(Recipe.objects.filter(user=self.user).count(), size):
+            recipe = create_recipe(user=self.user)
+            recipe.tags.add(
+                Tag.objects.create(user=self.user, name=f'Tag {i}a'),
+                Tag.objects.create(user=self.user, name=f'Tag {i}b'),
+            )
+
+    def test_list_recipes_query_budget(self):
+        """Test listing recipes does not issue a query per recipe"""
+        self.assertQueryBudget(
+            3, lambda: self.client.get(RECIPES_URL), self.populate,
+        )
+
+    def test_recipe_detail_query_budget(self):
+        """Test retrieving a recipe does not depend on its tag count"""
+        recipe = create_recipe(user=self.user)
+
+        def populate(size):
+            for i in range(recipe.tags.count(), size):
+                recipe.tags.add(
+                    Tag.objects.create(user=self.user, name=f'Tag {i}'),
+                )
+
+        self.assertQueryBudget(
+            3, lambda: self.client.get(detail_url(recipe.id)), populate,
+        )
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_THUMBNAIL_WORKERS=0)
+class ImageUploadTests(UserShardTestMixin, TestCase):
+    """Tests for the image upload API."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test@123')
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+
+    def upload(self, recipe_id):
+        """Upload a generated JPEG and run the on-commit hooks."""
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            img = Image.new('RGB', (1024, 768))
+            img.save(image_file, format='JPEG')
+            image_file.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(
+                    image_upload_url(recipe_id),
+                    {'image': image_file},
+                    format='multipart',
+                )
+
+    def test_upload_image(self):
+        """Test uploading an image to a recipe."""
+        res = self.upload(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('image', res.data)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
+    def test_upload_image_generates_thumbnails(self):
+        """Test thumbnails are generated and exposed after upload."""
+        self.upload(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(set(self.recipe.thumbnails), {'128', '512'})
+        for name in self.recipe.thumbnails.values():
+            with Image.open(os.path.join(MEDIA_ROOT, name)) as thumb:
+                self.assertLessEqual(max(thumb.size), 512)
+
+        res = self.client.get(detail_url(self.recipe.id))
+        self.assertTrue(res.data['image'].startswith('http'))
+        self.assertEqual(set(res.data['thumbnails']), {'128', '512'})
+
+    def test_upload_replaces_previous_image(self):
+        """Test uploading again removes the previous files."""
+        self.upload(self.recipe.id)
+        self.recipe.refresh_from_db()
+        old_path = self.recipe.image.path
+
+        self.upload(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
+    def test_upload_image_bad_request(self):
+        """Test uploading invalid image."""
+        url = image_upload_url(self.recipe.id)
+        payload = {'image': 'notanimage'}
+        res = self.client.post(url, payload, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,320 @@
+"""
+Tests for similar recipes.
+"""
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk
+from core.models import Ingredient, Recipe, Tag
+from core.tests.utils import UserShardTestMixin
+from recipe import similarity
+
+
+def similar_url(recipe_id):
+    """Create and return a similar recipes URL."""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def pairs(features):
+    """Return index pairs for a {recipe id: feature keys} dict."""
+    return np.array(
+        [(recipe_id, key) for recipe_id, keys in features.items()
+         for key in keys],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+
+class UserIndexTests(SimpleTestCase):
+    """Test the sparse similarity index."""
+
+    def setUp(self):
+        self.index = similarity.UserIndex.build(1, pairs({
+            1: [10, 11, 12],
+            2: [10, 11],
+            3: [10, 13, 14, 15],
+            4: [16],
+        }))
+
+    def test_jaccard(self):
+        """Test recipes are ranked by Jaccard similarity"""
+        ranked = self.index.similar(1)
+
+        self.assertEqual([recipe_id for recipe_id, _ in ranked], [2, 3])
+        self.assertAlmostEqual(ranked[0][1], 2 / 3)
+        self.assertAlmostEqual(ranked[1][1], 1 / 6)
+
+    def test_cosine(self):
+        """Test recipes are ranked by cosine similarity"""
+        ranked = self.index.similar(1, metric='cosine')
+
+        self.assertAlmostEqual(ranked[0][1], 2 / np.sqrt(6))
+        self.assertAlmostEqual(ranked[1][1], 1 / np.sqrt(12))
+
+    def test_limit_and_ties(self):
+        """Test the limit keeps the best scores, newest first on ties"""
+        index = similarity.UserIndex.build(1, pairs({
+            1: [10], 2: [10], 3: [10], 4: [10, 11],
+        }))
+
+        self.assertEqual(index.similar(1, limit=2), [(3, 1.0), (2, 1.0)])
+
+    def test_unknown_recipe(self):
+        """Test a recipe without tags or ingredients has no matches"""
+        self.assertEqual(self.index.similar(99), [])
+
+    def test_replace_rows(self):
+        """Test replacing rows matches an index built from scratch"""
+        index = self.index.replace(2, {2, 4, 5}, pairs({
+            2: [12, 20],
+            5: [10, 11, 12],
+        }))
+        rebuilt = similarity.UserIndex.build(2, pairs({
+            1: [10, 11, 12],
+            2: [12, 20],
+            3: [10, 13, 14, 15],
+            5: [10, 11, 12],
+        }))
+
+        for recipe_id in (1, 2, 3, 5):
+            self.assertEqual(index.similar(recipe_id),
+                             rebuilt.similar(recipe_id))
+        self.assertEqual(index.similar(4), [])
+
+
+class SimilarRecipesApiTests(UserShardTestMixin, TestCase):
+    """Test the similar recipes endpoint."""
+
+    def setUp(self):
+        similarity.clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, title, tags=(), ingredients=(), user=None):
+        recipe = Recipe.objects.create(
+            user=user or self.user, title=title, time_minutes=5, price=1,
+        )
+        for name in tags:
+            recipe.tags.add(
+                Tag.objects.get_or_create(user=recipe.user, name=name)[0],
+            )
+        for name in ingredients:
+            recipe.ingredients.add(Ingredient.objects.get_or_create(
+                user=recipe.user, name=name,
+            )[0])
+        return recipe
+
+    def test_similar_ranked(self):
+        """Test similar recipes are ranked by shared tags and ingredients"""
+        curry = self.create_recipe('Curry', ['Dinner', 'Spicy'], ['Rice'])
+        self.create_recipe('Soup', ['Dinner'], ['Leek'])
+        dal = self.create_recipe('Dal', ['Dinner', 'Spicy'], ['Lentils'])
+        self.create_recipe('Cake', ['Sweet'], ['Sugar'])
+
+        res = self.client.get(similar_url(curry.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['title'] for r in res.data], ['Dal', 'Soup'])
+        self.assertEqual(res.data[0]['id'], dal.id)
+        self.assertAlmostEqual(res.data[0]['score'], 0.5)
+        self.assertEqual(res.data[0]['tags'][0]['name'], 'Dinner')
+
+    def test_metric_and_limit(self):
+        """Test the metric and limit query parameters"""
+        curry = self.create_recipe('Curry', ['Dinner', 'Spicy'])
+        self.create_recipe('Soup', ['Dinner'])
+        self.create_recipe('Dal', ['Dinner', 'Spicy', 'Vegan'])
+
+        res = self.client.get(similar_url(curry.id),
+                              {'metric': 'cosine', 'limit': 1})
+
+        self.assertEqual(len(res.data), 1)
+        self.assertAlmostEqual(res.data[0]['score'], 2 / np.sqrt(6))
+
+    def test_invalid_parameters(self):
+        """Test unknown metrics and non numeric limits are rejected"""
+        curry = self.create_recipe('Curry', ['Dinner'])
+
+        for params in ({'metric': 'euclid'}, {'limit': 'many'}):
+            res = self.client.get(similar_url(curry.id), params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_users_recipes_excluded(self):
+        """Test only the user's own recipes are compared and returned"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='testpass123',
+        )
+        curry = self.create_recipe('Curry', ['Dinner'])
+        theirs = self.create_recipe('Stew', ['Dinner'], user=other)
+
+        self.assertEqual(self.client.get(similar_url(curry.id)).data, [])
+        res = self.client.get(similar_url(theirs.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_follows_committed_changes(self):
+        """Test changed rows are reloaded instead of rebuilding the index"""
+        curry = self.create_recipe('Curry', ['Dinner'])
+        soup = self.create_recipe('Soup', ['Lunch'])
+        self.client.get(similar_url(curry.id))
+        built = similarity.get_index(self.user.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(
+                reverse('recipe:recipe-detail', args=[soup.id]),
+                {'tags': [{'name': 'Dinner'}]},
+                format='json',
+            )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(similar_url(curry.id))
+
+        self.assertEqual([r['id'] for r in res.data], [soup.id])
+        index = similarity.get_index(self.user.id)
+        self.assertIsNot(index, built)
+        self.assertEqual(len(index.ids), len(built.ids) + 1)
+
+    def test_index_rebuilt_after_bulk_changes(self):
+        """Test writes that bypass signals make the index stale"""
+        curry = self.create_recipe('Curry', ['Dinner'])
+        soup = self.create_recipe('Soup', ['Lunch'])
+        self.client.get(similar_url(curry.id))
+
+        bulk.add_tag(bulk.selection(Recipe.objects.filter(id=soup.id)),
+                     'Dinner')
+        res = self.client.get(similar_url(curry.id))
+
+        self.assertEqual([r['id'] for r in res.data], [soup.id])
+
+    def test_deleted_recipe_dropped(self):
+        """Test deleted recipes are no longer returned"""
+        curry = self.create_recipe('Curry', ['Dinner'])
+        soup = self.create_recipe('Soup', ['Dinner'])
+        self.client.get(similar_url(curry.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soup.delete()
+        res = self.client.get(similar_url(curry.id))
+
+        self.assertEqual(res.data, [])
+        self.assertNotIn(soup.id, similarity.get_index(self.user.id).rows)
+
+    def test_index_follows_deleted_tag(self):
+        """Test deleting a tag unlinks it from the indexed recipes"""
+        curry = self.create_recipe('Curry', ['Dinner'])
+        self.create_recipe('Soup', ['Dinner'])
+        self.client.get(similar_url(curry.id))
+        tag = Tag.objects.get(user=self.user, name='Dinner')
+
+        res = self.client.delete(reverse('recipe:tag-detail', args=[tag.id]))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(similar_url(curry.id)).data, [])
+
+
+COOK_WITH_URL = reverse('recipe:recipe-cook-with')
+
+
+class CoverageIndexTests(SimpleTestCase):
+    """Test ranking recipes by pantry coverage with the index."""
+
+    def test_coverage(self):
+        """Test recipes are ranked by the share of ingredients held"""
+        offset = similarity.INGREDIENT_OFFSET
+        index = similarity.UserIndex.build(1, pairs({
+            1: [10, offset + 1, offset + 2],
+            2: [offset + 1, offset + 2, offset + 3, offset + 4],
+            3: [offset + 5],
+            4: [offset + 1, offset + 6],
+            5: [1, 2],
+        }))
+
+        self.assertEqual(index.coverage([1, 2, 99]), [
+            (1, 1.0), (2, 0.5), (4, 0.5),
+        ])
+        self.assertEqual(index.coverage([10]), [])
+
+
+class CookWithApiTests(UserShardTestMixin, TestCase):
+    """Test the cook with what I have endpoint."""
+
+    def setUp(self):
+        similarity.clear()
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ingredients = {
+            name: Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Rice', 'Egg', 'Leek', 'Salt')
+        }
+        for title, names in (
+            ('Fried rice', ['Rice', 'Egg']),
+            ('Omelette', ['Egg', 'Salt']),
+            ('Leek soup', ['Leek', 'Salt', 'Rice']),
+            ('Boiled rice', ['Rice']),
+        ):
+            recipe = Recipe.objects.create(
+                user=self.user, title=title, time_minutes=5, price=1,
+            )
+            recipe.ingredients.set(self.ingredients[n] for n in names)
+
+    def cook_with(self, *names, **params):
+        ids = ','.join(str(self.ingredients[n].id) for n in names)
+        return self.client.get(COOK_WITH_URL, {'ingredients': ids, **params})
+
+    def ranking(self, res):
+        return [(r['title'], round(r['coverage'], 2)) for r in res.data]
+
+    def test_ranked_by_coverage_in_sql(self):
+        """Test users without an index are ranked in SQL"""
+        res = self.cook_with('Rice', 'Egg')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ranking(res), [
+            ('Fried rice', 1.0),
+            ('Boiled rice', 1.0),
+            ('Omelette', 0.5),
+            ('Leek soup', 0.33),
+        ])
+        self.assertIsNone(similarity.get_index(self.user.id, 1000))
+
+    @override_settings(RECIPE_INDEX_MIN_RECIPES=1)
+    def test_ranked_by_coverage_with_index(self):
+        """Test the index gives the same ranking as SQL"""
+        with self.settings(RECIPE_INDEX_MIN_RECIPES=1000):
+            expected = self.ranking(self.cook_with('Rice', 'Egg', limit=3))
+
+        res = self.cook_with('Rice', 'Egg', limit=3)
+
+        self.assertEqual(self.ranking(res), expected)
+        self.assertEqual(len(expected), 3)
+        self.assertIsNotNone(similarity.get_index(self.user.id, 1000))
+
+    def test_other_users_ingredients_ignored(self):
+        """Test ingredients of other users cover nothing"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='testpass123',
+        )
+        theirs = Ingredient.objects.create(user=other, name='Rice')
+
+        res = self.client.get(COOK_WITH_URL, {'ingredients': theirs.id})
+
+        self.assertEqual(res.data, [])
+
+    def test_invalid_ingredients(self):
+        """Test missing or malformed ingredient lists are rejected"""
+        for params in ({}, {'ingredients': 'rice'}, {'ingredients': ','},
+                       {'ingredients': '0'}, {'ingredients': str(2 ** 63)},
+                       {'ingredients': f'1,{10 ** 30}'}):
+            res = self.client.get(COOK_WITH_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,185 @@
+"""
+Tests for the recipe statistics API.
+"""
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db.models import Avg, Count, Max, Min
+from django.test import TestCase
+from django.urls import reverse
+
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import (
+    Recipe,
+    RecipeStats,
+    Tag,
+    TagStats,
+)
+from core.tests.utils import QueryBudgetMixin, UserShardTestMixin
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(**params):
+    """Create and return a new user."""
+    defaults = {
+        'email': 'user@example.com',
+        'password': 'test@123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+class PublicRecipeStatsApiTests(TestCase):
+    """Test unauthenticated recipe stats API access"""
+
+    def test_auth_required(self):
+        """Test that authentication is required"""
+        res = APIClient().get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_schema_documents_response(self):
+        """Test the schema describes the statistics response body"""
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+
+        response = schema['paths'][STATS_URL]['get']['responses']['200']
+        self.assertEqual(
+            response['content']['application/json']['schema'],
+            {'$ref': '#/components/schemas/RecipeStats'},
+        )
+
+
+class PrivateRecipeStatsApiTests(UserShardTestMixin, QueryBudgetMixin,
+                                 TestCase):
+    """Test authenticated recipe stats API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, price, time_minutes, tags=()):
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Sample recipe',
+            'time_minutes': time_minutes,
+            'price': price,
+            'tags': [{'name': name} for name in tags],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    def assertStatsMatch(self):
+        """Assert the endpoint agrees with aggregating the recipe table"""
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        expected = Recipe.objects.filter(user=self.user).aggregate(
+            count=Count('id'),
+            price_avg=Avg('price'),
+            price_min=Min('price'),
+            price_max=Max('price'),
+            time_min=Min('time_minutes'),
+            time_max=Max('time_minutes'),
+        )
+        self.assertEqual(res.data['recipe_count'], expected['count'])
+        self.assertEqual(res.data['price']['min'], expected['price_min'])
+        self.assertEqual(res.data['price']['max'], expected['price_max'])
+        if expected['price_avg'] is not None:
+            self.assertEqual(
+                res.data['price']['avg'],
+                expected['price_avg'].quantize(Decimal('0.01')),
+            )
+        self.assertEqual(res.data['time_minutes']['min'], expected['time_min'])
+        self.assertEqual(res.data['time_minutes']['max'], expected['time_max'])
+
+        tag_counts = {
+            tag.name: tag.recipe_count for tag in
+            Tag.objects.filter(user=self.user).annotate(
+                recipe_count=Count('recipe'),
+            ) if tag.recipe_count
+        }
+        self.assertEqual(
+            {t['name']: t['recipe_count'] for t in res.data['top_tags']},
+            tag_counts,
+        )
+        return res.data
+
+    def test_stats_without_recipes(self):
+        """Test stats of a user without recipes are empty"""
+        data = self.assertStatsMatch()
+
+        self.assertEqual(data['recipe_count'], 0)
+        self.assertIsNone(data['price']['avg'])
+        self.assertEqual(data['top_tags'], [])
+
+    def test_stats_follow_recipe_writes(self):
+        """Test creates, updates and deletes are reflected in the stats"""
+        cheap = self.create_recipe('2.50', 10, tags=['Vegan'])
+        self.create_recipe('7.00', 45, tags=['Vegan', 'Dinner'])
+        pricey = self.create_recipe('20.00', 90, tags=['Dinner'])
+        self.assertStatsMatch()
+
+        self.client.patch(detail_url(cheap), {'price': '30.00'})
+        self.assertStatsMatch()
+
+        self.client.patch(detail_url(pricey), {'tags': []}, format='json')
+        self.assertStatsMatch()
+
+        self.client.delete(detail_url(cheap))
+        data = self.assertStatsMatch()
+        self.assertEqual(data['price']['max'], Decimal('20.00'))
+
+    def test_stats_limited_to_user(self):
+        """Test stats only cover the authenticated user's recipes"""
+        other = create_user(email='other@example.com')
+        Recipe.objects.create(
+            user=other, title='Other', time_minutes=5, price=Decimal('1.00'),
+        )
+        self.create_recipe('5.00', 20)
+
+        data = self.assertStatsMatch()
+        self.assertEqual(data['recipe_count'], 1)
+
+    def test_tag_removed_from_recipe_side(self):
+        """Test removing recipes from a tag updates its usage"""
+        recipe_id = self.create_recipe('5.00', 20, tags=['Lunch'])
+        tag = Tag.objects.get(name='Lunch')
+
+        tag.recipe_set.remove(recipe_id)
+
+        self.assertEqual(TagStats.objects.get(tag=tag).recipe_count, 0)
+        self.assertStatsMatch()
+
+    def test_stats_query_budget(self):
+        """Test stats cost is independent of the catalog size"""
+        def populate(size):
+            for i in range(Recipe.objects.count(), size):
+                self.create_recipe('5.00', 20, tags=[f'Tag {i}'])
+
+        self.assertQueryBudget(
+            2, lambda: self.client.get(STATS_URL), populate,
+        )
+
+    def test_rebuild_command_matches_incremental_stats(self):
+        """Test rebuilding from scratch gives the same aggregates"""
+        self.create_recipe('3.00', 15, tags=['Vegan'])
+        self.create_recipe('9.00', 60, tags=['Vegan', 'Quick'])
+        before = self.client.get(STATS_URL).data
+        RecipeStats.objects.all().delete()
+        TagStats.objects.all().delete()
+
+        call_command('rebuild_recipe_stats', stdout=StringIO())
+
+        self.assertEqual(self.client.get(STATS_URL).data, before)
@@ -0,0 +1,266 @@
+"""
+Tests for the delta sync API.
+
+Sync only returns changes of committed transactions, so these tests commit
+every write instead of running inside a test transaction.
+"""
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk, jobs
+from core.models import Ingredient, Job, Recipe, Tag, Tombstone
+from core.tests.utils import UserShardTestMixin
+from recipe.jobs import prune_tombstones  # noqa: F401
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def detail_url(recipe_id):
+    """Return recipe detail URL"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(**params):
+    """Create and return a new user."""
+    defaults = {
+        'email': 'user@example.com',
+        'password': 'test@123',
+    }
+    defaults.update(params)
+    return get_user_model().objects.create_user(**defaults)
+
+
+def create_recipe(user, **params):
+    """Create and return a recipe."""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 22,
+        'price': '5.25',
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTests(TransactionTestCase):
+    """Test unauthenticated sync requests."""
+
+    def test_auth_required(self):
+        """Test auth is required to sync"""
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_schema_documents_page(self):
+        """Test the schema describes the parameters and the page"""
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+
+        operation = schema['paths'][SYNC_URL]['get']
+        self.assertEqual(
+            {param['name'] for param in operation['parameters']},
+            {'since', 'limit'},
+        )
+        self.assertEqual(
+            operation['responses']['200']['content']['application/json']
+            ['schema'],
+            {'$ref': '#/components/schemas/Sync'},
+        )
+
+
+class PrivateSyncApiTests(UserShardTestMixin, TransactionTestCase):
+    """Test authenticated sync requests."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, cursor=None, **params):
+        if cursor is not None:
+            params['since'] = cursor
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def sync_all(self, cursor=None, **params):
+        """Follow the cursor until the last page; return every page."""
+        pages = [self.sync(cursor, **params)]
+        while pages[-1]['has_more']:
+            pages.append(self.sync(pages[-1]['cursor'], **params))
+        return pages
+
+    def test_full_sync(self):
+        """Test syncing without a cursor returns everything"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        recipe.tags.add(tag)
+
+        data = self.sync()
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'],
+                         [{'id': tag.id, 'name': 'Vegan'}])
+        self.assertIn('updated_at', data['recipes'][0])
+        self.assertIn('created_at', data['recipes'][0])
+        self.assertEqual([t['id'] for t in data['tags']], [tag.id])
+        self.assertEqual([i['id'] for i in data['ingredients']],
+                         [ingredient.id])
+        self.assertEqual(data['deleted'],
+                         {'recipe': [], 'tag': [], 'ingredient': []})
+        self.assertFalse(data['has_more'])
+
+    def test_sync_since_cursor_returns_changes_only(self):
+        """Test a cursor only returns rows changed after it"""
+        unchanged = create_recipe(self.user, title='Unchanged')
+        changed = create_recipe(self.user, title='Changed')
+        cursor = self.sync()['cursor']
+
+        self.assertEqual(self.sync(cursor)['recipes'], [])
+
+        self.client.patch(detail_url(changed.id), {'title': 'New title'})
+        new = create_recipe(self.user, title='New')
+        data = self.sync(cursor)
+
+        self.assertEqual([r['id'] for r in data['recipes']],
+                         [changed.id, new.id])
+        self.assertEqual(data['recipes'][0]['title'], 'New title')
+        self.assertNotIn(unchanged.id, [r['id'] for r in data['recipes']])
+        self.assertEqual(self.sync(data['cursor'])['recipes'], [])
+
+    def test_link_changes_are_synced(self):
+        """Test changing a recipe's tags marks the recipe as changed"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Quick')
+        cursor = self.sync()['cursor']
+
+        tag.recipe_set.add(recipe)
+        data = self.sync(cursor)
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual([t['name'] for t in data['recipes'][0]['tags']],
+                         ['Quick'])
+
+    def test_deletes_are_synced_as_tombstones(self):
+        """Test deleted rows are listed under deleted"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Gone')
+        ingredient = Ingredient.objects.create(user=self.user, name='Gone')
+        cursor = self.sync()['cursor']
+
+        self.client.delete(detail_url(recipe.id))
+        Tag.objects.filter(pk=tag.pk).delete()
+        Ingredient.objects.filter(pk=ingredient.pk).delete()
+        data = self.sync(cursor)
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['deleted'], {
+            'recipe': [recipe.id],
+            'tag': [tag.id],
+            'ingredient': [ingredient.id],
+        })
+
+    def test_set_based_changes_are_synced(self):
+        """Test recipes changed by bulk SQL statements are synced"""
+        recipes = [create_recipe(self.user) for _ in range(3)]
+        cursor = self.sync()['cursor']
+
+        bulk.adjust_price(
+            bulk.selection(Recipe.objects.filter(pk=recipes[0].pk)), 10,
+        )
+        bulk.delete_recipes(
+            bulk.selection(Recipe.objects.filter(pk=recipes[1].pk)),
+        )
+        data = self.sync(cursor)
+
+        self.assertEqual([r['id'] for r in data['recipes']],
+                         [recipes[0].id])
+        self.assertEqual(data['deleted']['recipe'], [recipes[1].id])
+
+    def test_sync_in_batches(self):
+        """Test changes are paged with limit and has_more"""
+        recipes = [create_recipe(self.user) for _ in range(5)]
+        tags = [Tag.objects.create(user=self.user, name=f'Tag {i}')
+                for i in range(2)]
+        Recipe.objects.filter(pk=recipes[0].pk).delete()
+
+        pages = self.sync_all(limit=2)
+
+        self.assertEqual(len(pages), 4)
+        self.assertTrue(all(page['has_more'] for page in pages[:-1]))
+        self.assertEqual(
+            [r['id'] for page in pages for r in page['recipes']],
+            [recipe.id for recipe in recipes[1:]],
+        )
+        self.assertEqual(
+            [t['id'] for page in pages for t in page['tags']],
+            [tag.id for tag in tags],
+        )
+        self.assertEqual(
+            [pk for page in pages for pk in page['deleted']['recipe']],
+            [recipes[0].id],
+        )
+
+    def test_sync_is_limited_to_user(self):
+        """Test sync only returns the authenticated user's changes"""
+        other = create_user(email='other@example.com')
+        create_recipe(other)
+        Tag.objects.create(user=other, name='Other')
+        create_recipe(other).delete()
+        recipe = create_recipe(self.user)
+
+        data = self.sync()
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual(data['tags'], [])
+        self.assertEqual(data['deleted']['recipe'], [])
+
+    def test_invalid_cursor(self):
+        """Test a cursor not issued by the server is rejected"""
+        res = self.client.get(SYNC_URL, {'since': 'not-a-cursor'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('since', res.data)
+
+    @override_settings(SYNC_CURSOR_MAX_AGE=60)
+    def test_expired_cursor(self):
+        """Test an old cursor must start over"""
+        cursor = self.sync()['cursor']
+
+        with mock.patch('django.core.signing.time.time',
+                        return_value=time.time() + 120):
+            res = self.client.get(SYNC_URL, {'since': cursor})
+
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+
+    def test_prune_tombstones_job(self):
+        """Test the job deletes tombstones past the retention"""
+        create_recipe(self.user).delete()
+        create_recipe(self.user).delete()
+        Tombstone.objects.filter(
+            pk=Tombstone.objects.order_by('id').first().pk,
+        ).update(deleted_at=timezone.now() - timedelta(days=31))
+        job_obj = jobs.enqueue('recipe.prune_tombstones', {'interval': 60})
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.SUCCEEDED)
+        self.assertEqual(job_obj.progress, {'deleted': 1})
+        self.assertEqual(Tombstone.objects.count(), 1)
+        self.assertTrue(
+            Job.objects.filter(
+                name='recipe.prune_tombstones', status=Job.QUEUED,
+            ).exists(),
+        )
@@ -8,12 +8,18 @@ from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Tag
+from core.models import Recipe, Tag, TagStats
+from core.tests.utils import (
+    QueryBudgetMixin,
+    QueryRecorder,
+    UserShardTestMixin,
+)
 
 from recipe.serializers import TagSerializer
 
 
 TAGS_URL = reverse('recipe:tag-list')
+AUTOCOMPLETE_URL = reverse('recipe:tag-autocomplete')
 
 
 def detail_url(tag_id):
@@ -21,6 +27,27 @@ def detail_url(tag_id):
     return reverse('recipe:tag-detail', args=[tag_id])
 
 
+def assign_url(tag_id):
+    """Return the tag assign URL"""
+    return reverse('recipe:tag-assign', args=[tag_id])
+
+
+def unassign_url(tag_id):
+    """Return the tag unassign URL"""
+    return reverse('recipe:tag-unassign', args=[tag_id])
+
+
+def create_recipe(user, **params):
+    """Create and return a recipe."""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': '5.00',
+    }
+    defaults.update(params)
+    return Recipe.objects.create(user=user, **defaults)
+
+
 def create_user(**params):
     # set the default parameters
     defaults = {
@@ -45,7 +72,7 @@ class PublicTagsApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateTagsApiTests(TestCase):
+class PrivateTagsApiTests(UserShardTestMixin, TestCase):
     """Test the authorized user tags API"""
 
     def setUp(self):
@@ -92,6 +119,17 @@ class PrivateTagsApiTests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_update_tag_duplicate_name(self):
+        """Test renaming a tag to an existing name is rejected"""
+        Tag.objects.create(user=self.user, name='Dessert')
+        tag = Tag.objects.create(user=self.user, name='After Dinner')
+
+        res = self.client.patch(detail_url(tag.id), {'name': ' dessert'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'After Dinner')
+
     def test_delete_tag(self):
         """Test deleting a tag"""
         tag = Tag.objects.create(user=self.user, name='After Dinner')
@@ -104,3 +142,192 @@ class PrivateTagsApiTests(TestCase):
             user=self.user,
             name='After Dinner'
         ).count(), 0)
+
+    def test_autocomplete_ordered_by_usage(self):
+        """Test name suggestions match the prefix, most used first"""
+        tags = {
+            name: Tag.objects.create(user=self.user, name=name)
+            for name in ('Chinese', 'Chicken', 'cheap', 'Dinner')
+        }
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                user=self.user, title=f'Recipe {i}', time_minutes=5, price=1,
+            )
+            recipe.tags.add(tags['Chicken'])
+            if i:
+                recipe.tags.add(tags['Chinese'])
+        other = create_user(email='other@example.com')
+        Tag.objects.create(user=other, name='Chili')
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'CH'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(t['name'], t['recipe_count']) for t in res.data],
+            [('Chicken', 3), ('Chinese', 2), ('cheap', 0)],
+        )
+
+    def test_autocomplete_limit_and_wildcards(self):
+        """Test the limit and that LIKE wildcards match literally"""
+        for name in ('100% rye', '100 grams', 'a_b', 'axb'):
+            Tag.objects.create(user=self.user, name=name)
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': '100%'})
+        self.assertEqual([t['name'] for t in res.data], ['100% rye'])
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': 'a_'})
+        self.assertEqual([t['name'] for t in res.data], ['a_b'])
+
+        res = self.client.get(AUTOCOMPLETE_URL, {'prefix': '10',
+                                                 'limit': 1})
+        self.assertEqual(len(res.data), 1)
+
+    def test_autocomplete_requires_prefix(self):
+        """Test prefixes matching nearly every name are rejected"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        for params in ({}, {'prefix': 'v'}, {'prefix': ' v  '}):
+            res = self.client.get(AUTOCOMPLETE_URL, params)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TagAssignmentApiTests(UserShardTestMixin, TestCase):
+    """Test assigning a tag to many recipes at once"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Quick')
+
+    def tagged(self):
+        return set(self.tag.recipe_set.values_list('id', flat=True))
+
+    def test_assign_by_ids(self):
+        """Test assigning links the recipes not linked yet"""
+        recipes = [create_recipe(self.user) for _ in range(3)]
+        recipes[0].tags.add(self.tag)
+
+        res = self.client.post(
+            assign_url(self.tag.id),
+            {'recipes': [r.id for r in recipes]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'assigned': 2})
+        self.assertEqual(self.tagged(), {r.id for r in recipes})
+        versions = Recipe.objects.order_by('id').values_list(
+            'version', flat=True,
+        )
+        self.assertEqual(list(versions), [1, 2, 2])
+        self.assertEqual(
+            TagStats.objects.get(tag=self.tag).recipe_count, 3,
+        )
+
+    def test_assign_by_filter(self):
+        """Test assigning to the recipes matching a filter"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        cheap = create_recipe(self.user, title='Green curry', price='4.00')
+        cheap.tags.add(vegan)
+        create_recipe(self.user, title='Green curry', price='20.00')
+        create_recipe(self.user, title='Stew', price='3.00').tags.add(vegan)
+        create_recipe(self.user, title='Green salad', price='2.00')
+
+        res = self.client.post(assign_url(self.tag.id), {'filter': {
+            'title': 'green', 'tags': [vegan.id], 'max_price': '10.00',
+        }}, format='json')
+
+        self.assertEqual(res.data, {'assigned': 1})
+        self.assertEqual(self.tagged(), {cheap.id})
+
+    def test_assign_limited_to_own_recipes(self):
+        """Test recipes of other users are never linked"""
+        other = create_user(email='other@example.com')
+        theirs = create_recipe(other)
+        mine = create_recipe(self.user)
+
+        res = self.client.post(
+            assign_url(self.tag.id),
+            {'recipes': [theirs.id, mine.id]},
+            format='json',
+        )
+
+        self.assertEqual(res.data, {'assigned': 1})
+        self.assertEqual(self.tagged(), {mine.id})
+
+    def test_assign_other_users_tag(self):
+        """Test another user's tag can not be assigned"""
+        other = create_user(email='other@example.com')
+        tag = Tag.objects.create(user=other, name='Theirs')
+        recipe = create_recipe(self.user)
+
+        res = self.client.post(
+            assign_url(tag.id), {'recipes': [recipe.id]}, format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(tag.recipe_set.exists())
+
+    def test_assign_requires_one_selection(self):
+        """Test a recipe list or a filter is required, not both"""
+        for payload in ({}, {'recipes': [1], 'filter': {'title': 'x'}}):
+            res = self.client.post(
+                assign_url(self.tag.id), payload, format='json',
+            )
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unassign(self):
+        """Test unassigning unlinks the tag from the selected recipes"""
+        recipes = [create_recipe(self.user, time_minutes=i * 10)
+                   for i in range(1, 4)]
+        for recipe in recipes:
+            recipe.tags.add(self.tag)
+
+        res = self.client.post(
+            unassign_url(self.tag.id),
+            {'filter': {'max_time_minutes': 20}},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'unassigned': 2})
+        self.assertEqual(self.tagged(), {recipes[2].id})
+        self.assertEqual(
+            TagStats.objects.get(tag=self.tag).recipe_count, 1,
+        )
+
+    def test_assign_query_count_is_constant(self):
+        """Test the selection is linked in a fixed number of statements"""
+        counts = []
+        for size in (1, 50):
+            Recipe.objects.filter(user=self.user).delete()
+            ids = [create_recipe(self.user).id for _ in range(size)]
+            with QueryRecorder() as queries:
+                res = self.client.post(
+                    assign_url(self.tag.id), {'recipes': ids},
+                    format='json',
+                )
+            self.assertEqual(res.data, {'assigned': size})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class TagQueryBudgetTests(UserShardTestMixin, QueryBudgetMixin, TestCase):
+    """Test tag endpoints issue a constant number of queries"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_tags_query_budget(self):
+        """Test listing tags issues a single query"""
+        def populate(size):
+            for i in range(Tag.objects.count(), size):
+                Tag.objects.create(user=self.user, name=f'Tag {i}')
+
+        self.assertQueryBudget(
+            1, lambda: self.client.get(TAGS_URL), populate,
+        )
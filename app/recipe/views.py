@@ -1,22 +1,62 @@
 """
 Views for the recipe APIs.
 """
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+
+from django.conf import settings
+
 from rest_framework import (
     viewsets,
     mixins,
+    status,
 )
 from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from core import bulk, sync
 from core.models import (
     Recipe,
+    RecipeStats,
     Tag,
+    TagStats,
     Ingredient,
+    link_prefetches,
+    normalize_name,
+)
+from core.images import (
+    delete_image_files,
+    schedule_thumbnails,
 )
-from recipe import serializers
+from core.sharding import UserShardMixin
+from recipe import serializers, similarity
+
+# Largest value of the bigint id columns; larger ids fail in the database.
+MAX_ID = 2 ** 63 - 1
+
+
+class SyncCursorExpired(APIException):
+    """The sync cursor is too old for the tombstones still kept."""
+    status_code = 410
+    default_detail = 'The sync cursor has expired; sync without one.'
+    default_code = 'sync_cursor_expired'
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def get_limit(request, default, maximum):
+    """Return the ``limit`` query parameter, clamped to `maximum`."""
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except ValueError:
+        raise ValidationError({'limit': ['A valid integer is required.']})
+    return max(0, min(limit, maximum))
+
+
+class RecipeViewSet(UserShardMixin, viewsets.ModelViewSet):
     """Viewset for Manage recipes APIs."""
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
@@ -25,12 +65,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Return objects for the current authenticated user only."""
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        return self.queryset.filter(
+            user=self.request.user
+        ).prefetch_related(
+            *link_prefetches(self.request.user.pk),
+        ).order_by('-id')
 
     def get_serializer_class(self):
         """Return appropriate serializer class for request."""
         if self.action == 'list':
             return serializers.RecipeSerializer
+        elif self.action == 'upload_image':
+            return serializers.RecipeImageSerializer
+        elif self.action == 'similar':
+            return serializers.SimilarRecipeSerializer
+        elif self.action == 'cook_with':
+            return serializers.PantryRecipeSerializer
 
         return self.serializer_class
 
@@ -38,8 +88,155 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Create a new recipe."""
         serializer.save(user=self.request.user)
 
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path='upload-image',
+        parser_classes=(MultiPartParser,),
+    )
+    def upload_image(self, request, pk=None):
+        """Upload an image to recipe."""
+        # Spool the upload to a temporary file instead of memory; storage
+        # then moves it into place without reading it back.
+        request._request.upload_handlers = [
+            TemporaryFileUploadHandler(request._request),
+        ]
+        recipe = self.get_object()
+        previous = (recipe.image.name, recipe.thumbnails)
+        serializer = self.get_serializer(recipe, data=request.data)
+
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        recipe = serializer.save(thumbnails={})
+        if previous[0]:
+            storage = recipe.image.storage
+            transaction.on_commit(
+                lambda: delete_image_files(storage, *previous),
+                using=recipe._state.db,
+            )
+        schedule_thumbnails(recipe)
+        return Response(
+            serializers.RecipeDetailSerializer(
+                recipe, context=self.get_serializer_context(),
+            ).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """List the user's recipes sharing most tags and ingredients.
+
+        Takes ``metric`` (``jaccard`` or ``cosine``) and ``limit``.
+        """
+        metric = request.query_params.get('metric', 'jaccard')
+        if metric not in similarity.METRICS:
+            raise ValidationError({'metric': [
+                f'Must be one of: {", ".join(similarity.METRICS)}.',
+            ]})
+        limit = get_limit(
+            request,
+            settings.RECIPE_SIMILAR_DEFAULT_LIMIT,
+            settings.RECIPE_SIMILAR_MAX_LIMIT,
+        )
+
+        ranked = similarity.similar(self.get_object(), metric, limit)
+        return self._ranked_response(ranked, 'score')
+
+    @action(methods=['GET'], detail=False, url_path='cook-with')
+    def cook_with(self, request):
+        """List recipes by the share of their ingredients the user has.
+
+        Takes ``ingredients``, a comma separated list of ingredient ids,
+        and ``limit``.
+        """
+        try:
+            ingredient_ids = {
+                int(value) for value in
+                request.query_params.get('ingredients', '').split(',')
+                if value.strip()
+            }
+            if not all(0 < pk <= MAX_ID for pk in ingredient_ids):
+                raise ValueError('Ingredient id out of range')
+        except ValueError:
+            raise ValidationError({'ingredients': [
+                'Must be a comma separated list of ingredient ids.',
+            ]})
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': ['This field is required.']})
+        if len(ingredient_ids) > settings.RECIPE_PANTRY_MAX_INGREDIENTS:
+            raise ValidationError({'ingredients': [
+                'Ensure this field has no more than '
+                f'{settings.RECIPE_PANTRY_MAX_INGREDIENTS} ingredients.',
+            ]})
+
+        limit = get_limit(
+            request,
+            settings.RECIPE_SIMILAR_DEFAULT_LIMIT,
+            settings.RECIPE_SIMILAR_MAX_LIMIT,
+        )
+
+        ranked = similarity.coverage(request.user, ingredient_ids, limit)
+        return self._ranked_response(ranked, 'coverage')
+
+    def _ranked_response(self, ranked, field):
+        """Serialize ``(recipe id, value)`` pairs in order.
+
+        Each value is set as the `field` attribute of its recipe.
+        """
+        recipes = {
+            recipe.pk: recipe for recipe in
+            self.get_queryset().filter(pk__in=[pk for pk, _ in ranked])
+        }
+        results = []
+        for recipe_id, value in ranked:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                setattr(recipe, field, value)
+                results.append(recipe)
+        return Response(self.get_serializer(results, many=True).data)
+
+
+class NameAutocompleteMixin:
+    """Add a ``?prefix=`` name autocomplete action to a viewset."""
+    autocomplete_serializer_class = None
+
+    def get_serializer_class(self):
+        if self.action == 'autocomplete':
+            return self.autocomplete_serializer_class
+        return super().get_serializer_class()
 
-class TagViewSet(viewsets.GenericViewSet,
+    @action(methods=['GET'], detail=False)
+    def autocomplete(self, request):
+        """List the most used names starting with ``prefix``."""
+        prefix = request.query_params.get('prefix', '')
+        if len(prefix) > 255:
+            raise ValidationError({'prefix': [
+                'Ensure this field has no more than 255 characters.',
+            ]})
+        min_length = settings.RECIPE_AUTOCOMPLETE_MIN_PREFIX
+        if len(normalize_name(prefix)) < min_length:
+            raise ValidationError({'prefix': [
+                f'Ensure this field has at least {min_length} characters.',
+            ]})
+        limit = get_limit(
+            request,
+            settings.RECIPE_AUTOCOMPLETE_DEFAULT_LIMIT,
+            settings.RECIPE_AUTOCOMPLETE_MAX_LIMIT,
+        )
+
+        matches = self.queryset.model.objects.autocomplete(
+            request.user, prefix, limit,
+        )
+        return Response(self.get_serializer(matches, many=True).data)
+
+
+class TagViewSet(UserShardMixin,
+                 NameAutocompleteMixin,
+                 viewsets.GenericViewSet,
                  mixins.ListModelMixin,
                  mixins.UpdateModelMixin,
                  mixins.DestroyModelMixin,
@@ -49,13 +246,57 @@ class TagViewSet(viewsets.GenericViewSet,
     permission_classes = (IsAuthenticated,)
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    autocomplete_serializer_class = serializers.TagAutocompleteSerializer
 
     def get_queryset(self):
         """Return objects for the current authenticated user."""
         return self.queryset.filter(user=self.request.user).order_by('-name')
 
+    def get_serializer_class(self):
+        if self.action in ('assign', 'unassign'):
+            return serializers.TagAssignmentSerializer
+        return super().get_serializer_class()
+
+    def _apply_to_recipes(self, request, apply):
+        """Run a ``core.bulk`` tag function over the selected recipes."""
+        tag = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.filter_recipes(
+            Recipe.objects.filter(user=request.user),
+        )
+        return apply(bulk.selection(recipes), tag)
+
+    @action(methods=['POST'], detail=True)
+    def assign(self, request, pk=None):
+        """Link the tag to the recipes given by id or by a filter.
 
-class IngredientViewSet(viewsets.GenericViewSet,
+        Runs as one statement whatever the number of recipes; returns how
+        many were not linked to the tag before.
+        """
+        count = self._apply_to_recipes(request, bulk.link_tag)
+        return Response({'assigned': count})
+
+    @action(methods=['POST'], detail=True)
+    def unassign(self, request, pk=None):
+        """Unlink the tag from the recipes given by id or by a filter."""
+        count = self._apply_to_recipes(request, bulk.unlink_tag)
+        return Response({'unassigned': count})
+
+    def perform_update(self, serializer):
+        """Reject renaming a tag to a name the user already has."""
+        try:
+            with transaction.atomic(using=serializer.instance._state.db):
+                serializer.save()
+        except IntegrityError:
+            raise ValidationError(
+                {'name': ['A tag with this name already exists.']},
+            )
+
+
+class IngredientViewSet(UserShardMixin,
+                        NameAutocompleteMixin,
+                        viewsets.GenericViewSet,
                         mixins.ListModelMixin,
                         ):
     """Viewset for Manage ingredients APIs."""
@@ -63,7 +304,75 @@ class IngredientViewSet(viewsets.GenericViewSet,
     permission_classes = (IsAuthenticated,)
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
+    autocomplete_serializer_class = \
+        serializers.IngredientAutocompleteSerializer
 
     def get_queryset(self):
         """Return objects for the current authenticated user."""
         return self.queryset.filter(user=self.request.user).order_by('-name')
+
+
+class RecipeStatsView(UserShardMixin, APIView):
+    """Summary statistics of the authenticated user's recipes."""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Return aggregates read from the user's summary rows."""
+        stats = RecipeStats.objects.filter(user=request.user).first()
+        if stats is None:
+            stats = RecipeStats(user=request.user)
+        top_tags = (
+            TagStats.objects.filter(user=request.user, recipe_count__gt=0)
+            .select_related('tag')
+            .order_by('-recipe_count', 'tag_id')
+        )[:settings.RECIPE_STATS_TOP_TAGS]
+        serializer = serializers.RecipeStatsSerializer(
+            stats, context={'top_tags': top_tags},
+        )
+        return Response(serializer.data)
+
+
+class SyncView(UserShardMixin, APIView):
+    """Changes to the authenticated user's recipes, tags and ingredients.
+
+    ``since`` is the ``cursor`` of the previous page; without it the sync
+    starts over. Pages hold at most ``limit`` rows, deletes included.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """Return the changes after the cursor and the next cursor."""
+        limit = get_limit(request, settings.SYNC_BATCH_SIZE,
+                          settings.SYNC_MAX_BATCH_SIZE)
+        try:
+            ids, has_more, cursor = sync.changes(
+                request.user,
+                request.query_params.get('since') or None,
+                max(limit, 1),
+            )
+        except sync.ExpiredCursor:
+            raise SyncCursorExpired()
+        except sync.InvalidCursor:
+            raise ValidationError({'since': ['Invalid sync cursor.']})
+
+        page = {
+            'recipes': Recipe.objects.filter(
+                user=request.user, pk__in=ids[sync.RECIPES],
+            ).prefetch_related(
+                *link_prefetches(request.user.pk),
+            ).order_by('id'),
+            'tags': Tag.objects.filter(
+                user=request.user, pk__in=ids[sync.TAGS],
+            ).order_by('id'),
+            'ingredients': Ingredient.objects.filter(
+                user=request.user, pk__in=ids[sync.INGREDIENTS],
+            ).order_by('id'),
+            'deleted': sync.tombstones(ids[sync.TOMBSTONES]),
+            'cursor': cursor,
+            'has_more': has_more,
+        }
+        return Response(serializers.SyncSerializer(
+            page, context={'request': request},
+        ).data)
@@ -0,0 +1,32 @@
+"""
+Background jobs for the user app.
+"""
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+
+from core import bulk, jobs, sharding
+
+
+@jobs.job('user.purge_user')
+def purge_user(job_obj):
+    """Delete a deactivated user's data in small batches, then the user.
+
+    Every batch is its own transaction, so a retried job carries on where
+    the previous attempt stopped and no lock is held for long.
+    """
+    user_id = job_obj.payload['user_id']
+    batch_size = job_obj.payload.get('batch_size', bulk.PURGE_BATCH_SIZE)
+    users = get_user_model().objects.filter(pk=user_id)
+    if users.filter(is_active=True).exists():
+        raise ValueError(f'User {user_id} is active and will not be purged')
+    if users.filter(shard_locked=True).exists():
+        raise ValueError(f'User {user_id} is moving; retrying later')
+
+    shard = users.values_list('shard', flat=True).first()
+    with sharding.use_shard(shard or DEFAULT_DB_ALIAS):
+        bulk.purge_user_data(user_id, batch_size, job_obj.progress,
+                             job_obj.set_progress)
+
+    # Only a handful of rows are left for the ORM cascade.
+    users.delete()
+    return job_obj.progress
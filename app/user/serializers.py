@@ -9,6 +9,8 @@ from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers
 
+from core.serializers import JobSerializer
+
 
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for the users object."""
@@ -63,3 +65,11 @@ class AuthTokenSerializer(serializers.Serializer):
 
         attrs['user'] = user
         return attrs
+
+
+class DeletionStatusSerializer(JobSerializer):
+    """Serializer for the progress of an account deletion."""
+
+    class Meta(JobSerializer.Meta):
+        fields = ('status', 'progress', 'updated_at')
+        read_only_fields = fields
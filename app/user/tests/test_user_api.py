@@ -1,6 +1,10 @@
 """
 Test for the user api.
 """
+from io import StringIO
+
+from django.core import signing
+from django.core.management import call_command
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
@@ -9,6 +13,10 @@ from rest_framework.test import APIClient
 from rest_framework import status
 from faker import Faker
 
+from core import jobs
+from core.models import Ingredient, Job, Recipe, Tag, Tombstone
+from core.tests.utils import QueryBudgetMixin, UserShardTestMixin
+
 fake = Faker()
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -127,7 +135,7 @@ class PublicUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class PrivateUserApiTest(TestCase):
+class PrivateUserApiTest(UserShardTestMixin, TestCase):
     """Test api request that require the authentication."""
 
     def setUp(self):
@@ -167,3 +175,103 @@ class PrivateUserApiTest(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
+
+    def create_recipes(self, user, count):
+        tag = Tag.objects.create(user=user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=user, name='Salt')
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=user, title=f'Recipe {i}', time_minutes=5, price='1.00',
+            )
+            recipe.tags.add(tag)
+            recipe.ingredients.add(ingredient)
+
+    def test_delete_user_deactivates_and_queues_purge(self):
+        """Test deleting the account deactivates it and queues a purge"""
+        res = self.client.delete(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        job_obj = Job.objects.get(name='user.purge_user')
+        self.assertEqual(job_obj.payload, {'user_id': self.user.pk})
+
+        res = APIClient().get(res.data['status_url'])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], Job.QUEUED)
+
+    def test_deletion_status_requires_signed_id(self):
+        """Test the deletion status is not served for forged URLs"""
+        job_obj = jobs.enqueue('user.purge_user', {'user_id': self.user.pk})
+
+        for token in (str(job_obj.pk), signing.dumps(job_obj.pk)):
+            res = APIClient().get(reverse('user:deletion', args=[token]))
+
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_purge_user_job_deletes_data_in_batches(self):
+        """Test the purge job removes only the deleted user's data"""
+        other = create_user(email='other@example.com', password='pass123')
+        self.create_recipes(self.user, 5)
+        self.create_recipes(other, 1)
+        Recipe.objects.filter(user=self.user).first().delete()
+        status_url = self.client.delete(ME_URL).data['status_url']
+        Job.objects.filter(name='user.purge_user').update(payload={
+            'user_id': self.user.pk, 'batch_size': 2,
+        })
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        res = APIClient().get(status_url)
+        self.assertEqual(res.data['status'], Job.SUCCEEDED)
+        # The purge's own deletes leave tombstones too, removed last.
+        self.assertEqual(
+            res.data['progress'],
+            {'recipes': 4, 'tags': 1, 'ingredients': 1, 'tombstones': 7},
+        )
+        self.assertFalse(Tombstone.objects.filter(user=self.user).exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists(),
+        )
+        self.assertEqual(Recipe.objects.count(), 1)
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+        self.assertEqual(list(Tag.objects.values_list('user', flat=True)),
+                         [other.pk])
+
+    def test_purge_user_refuses_active_user(self):
+        """Test the purge job never deletes an active account"""
+        job_obj = jobs.enqueue('user.purge_user', {'user_id': self.user.pk},
+                               max_attempts=1)
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        job_obj.refresh_from_db()
+        self.assertEqual(job_obj.status, Job.FAILED)
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.user.pk).exists(),
+        )
+
+
+class UserQueryBudgetTest(UserShardTestMixin, QueryBudgetMixin, TestCase):
+    """Test user endpoints issue a constant number of queries."""
+
+    def setUp(self):
+        self.user = create_user(
+            email='test@example.com',
+            password='testpass123',
+            name='Test Name'
+        )
+        self.client = APIClient()
+
+    def test_retrieve_profile_query_budget(self):
+        """Test token authenticated profile lookup is a single query."""
+        token = self.client.post(TOKEN_URL, {
+            'email': 'test@example.com',
+            'password': 'testpass123',
+        }).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+        self.assertQueryBudget(
+            1, lambda: self.client.get(ME_URL), lambda size: None,
+        )
@@ -1,28 +1,46 @@
 """
 View for the user API.
 """
-from rest_framework import generics, authentication, permissions
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+
+from rest_framework import generics, authentication, permissions, status
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core import jobs
+from core.models import Job
+
 from user.serializers import (
     UserSerializer,
     AuthTokenSerializer,
+    DeletionStatusSerializer,
 )
 
+DELETION_SALT = 'user.deletion'
+
 
 class CreateUserView(generics.CreateAPIView):
     """Create a new user in the system."""
     serializer_class = UserSerializer
+    throttle_scope = 'user:create'
 
 
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for the user."""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    throttle_scope = 'user:token'
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage authenticated user."""
     serializer_class = UserSerializer
     authentication_classes = [authentication.TokenAuthentication]
@@ -31,3 +49,47 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """Retrieve and return the authenticated user"""
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the user now and purge their data in the background.
+
+        Returns the URL reporting the purge's progress: the user's token
+        is gone, so it is addressed by a signed job id.
+        """
+        user = self.get_object()
+        with transaction.atomic():
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            Token.objects.filter(user=user).delete()
+            job_obj = jobs.enqueue(
+                'user.purge_user', {'user_id': user.pk}, user=user,
+            )
+        token = signing.dumps(job_obj.pk, salt=DELETION_SALT)
+        return Response(
+            {'status_url': request.build_absolute_uri(
+                reverse('user:deletion', args=[token]),
+            )},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class DeletionStatusView(generics.RetrieveAPIView):
+    """Report the progress of an account deletion.
+
+    Needs no authentication: the URL, handed out by the deletion only,
+    carries the signed id of the purge job.
+    """
+    serializer_class = DeletionStatusSerializer
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    queryset = Job.objects.filter(name='user.purge_user')
+
+    def get_object(self):
+        try:
+            job_id = signing.loads(
+                self.kwargs['token'], salt=DELETION_SALT,
+                max_age=settings.USER_DELETION_STATUS_MAX_AGE,
+            )
+        except signing.BadSignature:
+            raise NotFound()
+        return get_object_or_404(self.get_queryset(), pk=job_id)